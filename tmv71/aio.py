@@ -0,0 +1,532 @@
+"""An asyncio client for the TM-V71.
+
+AsyncTMV71 provides coroutine versions of the TMV71 API. Rather than
+blocking a thread in serial.Serial.read, it puts the serial port in
+non-blocking mode and lets the event loop tell it when data is
+available (loop.add_reader), so a single process can talk to many
+radios at once:
+
+    import asyncio
+    from tmv71.aio import AsyncTMV71
+
+    async def main():
+        async with AsyncTMV71('/dev/ttyUSB0') as radio:
+            print(await radio.radio_id())
+            async with radio.programming_mode():
+                data = await radio.read_block(0, 0)
+
+    asyncio.run(main())
+
+An AsyncTMV71 must be created from a coroutine running in the event
+loop that will drive it. Commands are serialized with a lock, so
+several tasks may share the same radio, and a programming mode
+session holds the lock until it exits.
+
+The commands themselves are shared with TMV71 (see
+tmv71.api.RadioCommands); this module only provides the I/O.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+import hexdump
+import itertools
+import logging
+import os
+import serial
+import struct
+import sys
+
+from tmv71 import api
+from tmv71.api import (
+    ReadTimeoutError,
+    UnexpectedResponseError,
+    UnknownCommandError,
+    UnknownDeviceError,
+    InvalidCommandError,
+    WrongModeError,
+    pm,
+)
+
+LOG = logging.getLogger(__name__)
+
+
+class AsyncTMV71(api.RadioCommands):
+    expected_id = api.TMV71.expected_id
+    memory_max = api.TMV71.memory_max
+    memory_magic = api.TMV71.memory_magic
+    pipeline_window = api.TMV71.pipeline_window
+
+    encode_command = api.TMV71.encode_command
+    parse_response = api.TMV71.parse_response
+
+    def __init__(self, port, speed=9600, debug=False, timeout=0.5):
+        self.port = port
+        self.speed = int(speed)
+        self.debug = debug
+        self.timeout = timeout
+        self._programming_mode = False
+        self._ptt = False
+        self._loop = asyncio.get_running_loop()
+        self._lock = asyncio.Lock()
+        self._owner = None
+        self._buffer = bytearray()
+        self._waiter = None
+        self._error = None
+        self.init_serial()
+
+    def __repr__(self):
+        return "<AsyncTMV71 on {0.port} @ {0.speed}>".format(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+    def init_serial(self):
+        LOG.info("opening %s at %d bps", self.port, self.speed)
+        self._port = serial.Serial(
+            self.port,
+            baudrate=self.speed,
+            rtscts=False,
+            dsrdtr=False,
+            timeout=0,
+        )
+        self._fd = self._port.fileno()
+        os.set_blocking(self._fd, False)
+        self._loop.add_reader(self._fd, self._on_readable)
+
+    def close(self):
+        """Stop watching the serial port and close it"""
+
+        self._loop.remove_reader(self._fd)
+        self._port.close()
+
+    @asynccontextmanager
+    async def _exclusive(self):
+        """Hold the command lock. This is re-entrant within a task, so
+        that (for example) clear can be called in programming mode."""
+
+        task = asyncio.current_task()
+        if self._owner is task:
+            yield
+            return
+
+        async with self._lock:
+            self._owner = task
+            try:
+                yield
+            finally:
+                self._owner = None
+
+    def _on_readable(self):
+        try:
+            data = os.read(self._fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError as err:
+            self._error = err
+            self._loop.remove_reader(self._fd)
+        else:
+            self._buffer.extend(data)
+
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def _wait_readable(self, deadline):
+        """Wait for more data to arrive. Return False on timeout."""
+
+        if self._error is not None:
+            raise self._error
+
+        remaining = deadline - self._loop.time()
+        if remaining <= 0:
+            return False
+
+        self._waiter = self._loop.create_future()
+        try:
+            await asyncio.wait_for(self._waiter, remaining)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._waiter = None
+
+        return True
+
+    async def _wait_writable(self):
+        waiter = self._loop.create_future()
+        self._loop.add_writer(self._fd, waiter.set_result, None)
+        try:
+            await waiter
+        finally:
+            self._loop.remove_writer(self._fd)
+
+    async def write_bytes(self, data):
+        """Write the given data to the radio."""
+
+        if self.debug:
+            print("write:", file=sys.stderr)
+            print("\n".join(hexdump.dumpgen(data)), file=sys.stderr)
+
+        view = memoryview(data)
+        while view:
+            try:
+                written = os.write(self._fd, view)
+            except BlockingIOError:
+                await self._wait_writable()
+                continue
+            view = view[written:]
+
+    async def read_bytes(self, n=0, until=None):
+        """Read n bytes of data from the radio.
+
+        Like serial.Serial.read, this returns whatever data has arrived
+        if the timeout expires first, and raises ReadTimeoutError if
+        there is none."""
+
+        deadline = self._loop.time() + self.timeout
+
+        while True:
+            if until is not None:
+                end = self._buffer.find(until)
+                if end >= 0:
+                    end += len(until)
+                    break
+            elif len(self._buffer) >= n:
+                end = n
+                break
+
+            if not await self._wait_readable(deadline):
+                end = len(self._buffer)
+                break
+
+        data = bytes(self._buffer[:end])
+        del self._buffer[:end]
+
+        if not data:
+            raise ReadTimeoutError()
+
+        if self.debug:
+            print("read:", file=sys.stderr)
+            print("\n".join(hexdump.dumpgen(data)), file=sys.stderr)
+        return data
+
+    async def read_line(self):
+        """Read a carriage-return terminated line from the radio."""
+
+        return (await self.read_bytes(until=b"\r"))[:-1]
+
+    async def send_command(self, *command):
+        """Send a command to the radio (see TMV71.send_command)"""
+
+        LOG.debug("sending command: %s", command)
+
+        async with self._exclusive():
+            await self.write_bytes(self.encode_command(*command))
+            res = (await self.read_line()).decode("ascii")
+
+        return self.parse_response(command, res)
+
+    async def send_commands(self, commands, window=None, return_exceptions=False):
+        """Send a sequence of commands with several commands in flight.
+
+        This behaves like TMV71.send_commands, but returns a list of
+        results rather than a generator."""
+
+        window = window or self.pipeline_window
+        commands = iter(commands)
+        results = []
+        pending = []
+
+        async with self._exclusive():
+            while True:
+                for command in commands:
+                    LOG.debug("sending command (pipelined): %s", command)
+                    await self.write_bytes(self.encode_command(*command))
+                    pending.append(command)
+                    if len(pending) >= window:
+                        break
+
+                if not pending:
+                    break
+
+                command = pending[0]
+                try:
+                    res = (await self.read_line()).decode("ascii")
+                except ReadTimeoutError:
+                    if window == 1:
+                        raise
+
+                    LOG.warning(
+                        "timeout with %d commands in flight "
+                        "(continuing without pipelining)",
+                        len(pending),
+                    )
+                    await self._clear()
+                    window = 1
+                    commands = itertools.chain(list(pending), commands)
+                    pending.clear()
+                    continue
+
+                pending.pop(0)
+                try:
+                    results.append(self.parse_response(command, res))
+                except (UnknownCommandError, InvalidCommandError) as err:
+                    if not return_exceptions:
+                        await self._drain(pending)
+                        raise
+                    results.append(err)
+
+        return results
+
+    async def _drain(self, pending):
+        for _command in pending:
+            try:
+                await self.read_line()
+            except ReadTimeoutError:
+                break
+
+    # ----------------------------------------------------------------------
+
+    async def clear(self):
+        """Clear the communication channel (see TMV71.clear)"""
+
+        async with self._exclusive():
+            await self._clear()
+
+    async def _clear(self):
+        await self.write_bytes(b"E\r")
+
+        while True:
+            try:
+                await self.read_bytes(1024)
+            except ReadTimeoutError:
+                break
+
+        await self.write_bytes(b"\r")
+        res = await self.read_line()
+        if res != b"?":
+            raise UnexpectedResponseError()
+
+    async def _run(self, steps):
+        """Run an operation (see tmv71.api.operation), returning its
+        result"""
+
+        send, value = steps.send, None
+        while True:
+            try:
+                method, args = send(value)
+            except StopIteration as stop:
+                return stop.value
+
+            try:
+                value, send = await getattr(self, method)(*args), steps.send
+            except Exception as err:
+                value, send = err, steps.throw
+
+    async def check_id(self):
+        res = await self.radio_id()
+        LOG.debug("check_id: wanted %s, got %s", self.expected_id, res)
+        if res != self.expected_id:
+            raise UnknownDeviceError(res)
+
+    @asynccontextmanager
+    async def ptt(self):
+        """A context manager that ensures ptt is released"""
+
+        try:
+            await self.set_ptt(True)
+            yield
+        finally:
+            await self.set_ptt(False)
+
+    async def send_dtmf(self, tones, fast=False):
+        """Send a series of DTMF tones (see TMV71.send_dtmf)"""
+
+        delay = self.dtmf_tone_fast if fast else self.dtmf_tone_slow
+
+        await asyncio.sleep(delay)
+        for tone in tones:
+            await self.send_command(
+                "DT", 0, "{:X}".format(api.DTMF_TONES.index(tone.upper()))
+            )
+            await asyncio.sleep(delay)
+
+    # ----------------------------------------------------------------------
+
+    @asynccontextmanager
+    async def programming_mode(self):
+        """Wrap code that interacts with the radio in programming mode.
+
+            async with radio.programming_mode():
+                await radio.read_block(0, 0)
+
+        The session holds the command lock, so other tasks that send
+        commands to the same radio (or start their own programming mode
+        session) wait until it has finished. If the current task is
+        already in programming mode this does nothing."""
+
+        if self._programming_mode and self._owner is asyncio.current_task():
+            yield
+            return
+
+        async with self._exclusive():
+            await self.enter_programming_mode()
+            try:
+                yield
+            finally:
+                await self.exit_programming_mode()
+
+    async def enter_programming_mode(self):
+        LOG.debug("entering programming mode")
+        await self.write_bytes(b"0M PROGRAM\r")
+        res = await self.read_line()
+        if res != b"0M":
+            raise UnexpectedResponseError()
+        self._programming_mode = True
+
+    async def exit_programming_mode(self):
+        LOG.debug("exiting programming mode")
+        await self.write_bytes(b"E")
+        self._programming_mode = False
+        for expected in [b"\x06", b"\r", b"\x00"]:
+            res = await self.read_bytes(1)
+            if res != expected:
+                raise UnexpectedResponseError()
+
+    def _check_owner(self):
+        """Raise WrongModeError unless the programming mode session
+        belongs to the current task"""
+
+        if self._owner is not asyncio.current_task():
+            raise WrongModeError("programming mode belongs to another task")
+
+    @pm
+    async def read_block(self, address, size):
+        """Read data from the radio"""
+
+        self._check_owner()
+        LOG.debug("read address %d, size %d", address, size)
+
+        args = struct.pack(">HB", address, size)
+
+        await self.write_bytes(b"R" + args)
+        res = await self.read_bytes(4)
+        if res != b"W" + args:
+            raise UnexpectedResponseError(res)
+
+        data = await self.read_bytes(size if size else 256)
+        await self.write_bytes(bytes([6]))
+        await self.check_ack()
+        return data
+
+    @pm
+    async def write_block(self, address, data):
+        """Write data to the radio"""
+
+        size = len(data)
+        if size > 256:
+            raise ValueError("write_block cannot write more than 256 bytes")
+
+        self._check_owner()
+        LOG.debug("write address %d, size %d", address, size)
+        if size == 256:
+            size = 0
+
+        await self.write_bytes(
+            struct.pack(">BHB", ord("W"), address, size) + bytes(data)
+        )
+        await self.check_ack()
+
+    async def check_ack(self):
+        """Validate the response to programming mode commands."""
+
+        res = await self.read_bytes(1)
+        if res == b"\x15":
+            LOG.warning("radio is in error state (continuing)")
+        elif res != b"\x06":
+            raise UnexpectedResponseError()
+
+    @pm
+    async def memory_dump(self, fd):
+        """Read data from the radio and write it to a file-like object."""
+
+        for block in range(self.memory_max):
+            addr = block * 256
+            LOG.debug("reading block %d", block)
+            data = await self.read_block(addr, 0)
+            fd.write(data)
+
+    # ----------------------------------------------------------------------
+
+    async def import_channels(
+        self, fd, selected=None, ignore_errors=False, sync=False, window=None
+    ):
+        """Import channels from a CSV document (see TMV71.import_channels)"""
+
+        selected = selected if selected else range(1000)
+        channelmap = api.read_channels_csv(fd)
+
+        actions = []
+        commands = []
+        for channel in selected:
+            if channel not in channelmap:
+                if sync:
+                    actions.append((channel, "delete"))
+                    commands.extend(api.channel_delete_commands(channel))
+            else:
+                actions.append((channel, "set"))
+                commands.extend(
+                    api.channel_write_commands(channel, channelmap[channel])
+                )
+
+        results = iter(
+            await self.send_commands(commands, window=window, return_exceptions=True)
+        )
+        for channel, action in actions:
+            if action == "delete":
+                LOG.info("deleting channel %d", channel)
+                next(results)
+                continue
+
+            LOG.info("setting information for channel %d", channel)
+            for res in (next(results), next(results)):
+                if isinstance(res, UnknownCommandError):
+                    raise res
+                elif isinstance(res, InvalidCommandError):
+                    if ignore_errors:
+                        LOG.warning("Unable to set channel %d", channel)
+                    else:
+                        raise res
+
+    async def export_channels(
+        self, fd, selected=None, skip_deleted=False, window=None, format="csv"
+    ):
+        """Export channels to a CSV document (see TMV71.export_channels)"""
+
+        selected = selected if selected else range(1000)
+        channels = await self.read_channels(selected, window=window)
+        api.CHANNEL_WRITERS[format](fd, channels, skip_deleted=skip_deleted)
+
+    async def read_channels(self, selected, window=None):
+        """Return a list of (channel, entry) for the selected channels.
+        The entry is None for deleted channels."""
+
+        commands = []
+        for channel in selected:
+            commands.extend(api.channel_commands(channel))
+
+        results = iter(
+            await self.send_commands(commands, window=window, return_exceptions=True)
+        )
+
+        return [
+            (channel, api.decode_channel(next(results), next(results)))
+            for channel in selected
+        ]
+
+
+class AsyncTMD710(AsyncTMV71):
+    expected_id = api.TMD710.expected_id
+    memory_magic = api.TMD710.memory_magic
+    memory_max = api.TMD710.memory_max
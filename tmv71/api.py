@@ -1,13 +1,22 @@
-from contextlib import contextmanager
+import collections
+from contextlib import closing, contextmanager
 import csv
 from functools import wraps
 import hexdump
+import itertools
+import json
 import logging
+import math
+import mmap
+import os
+import queue
 import serial
 import struct
 import sys
+import threading
 import time
 
+from tmv71 import image
 from tmv71 import schema
 
 LOG = logging.getLogger(__name__)
@@ -58,11 +67,45 @@ class WrongModeError(RadioError):
     """Radio is not in programming mode"""
 
 
+def operation(f):
+    """Decorator for the radio operations in RadioCommands.
+
+    An operation is a generator that describes an exchange with the
+    radio rather than performing it: it yields steps (see step), is
+    sent the result of each one (or has its exception raised at the
+    yield), and returns the result of the operation. Calling the
+    decorated method runs the operation with the radio's own I/O (see
+    TMV71._run), so on a tmv71.aio.AsyncTMV71 it returns a coroutine."""
+
+    @wraps(f)
+    def _(self, *args, **kwargs):
+        return self._run(f(self, *args, **kwargs))
+
+    return _
+
+
+def step(method, *args):
+    """A step of an operation that calls the radio method <method>
+    (e.g. read_block) with <args>"""
+
+    return method, args
+
+
+def cat_step(*command):
+    """A step of an operation that sends a CAT command (see
+    TMV71.send_command)"""
+
+    return step("send_command", *command)
+
+
 def schemacommand(schema):
+    """A decorator for operations whose result is converted with
+    <schema>"""
+
     def decorator(f):
         @wraps(f)
         def inner(*args, **kwargs):
-            return schema.from_tuple(f(*args, **kwargs))
+            return schema.from_tuple((yield from f(*args, **kwargs)))
 
         return inner
 
@@ -70,11 +113,11 @@ def schemacommand(schema):
 
 
 def bandcommand(f):
-    """A decorator for commands that have (band, value) results"""
+    """A decorator for operations that have (band, value) results"""
 
     @wraps(f)
     def _(*args, **kwargs):
-        res = f(*args, **kwargs)
+        res = yield from f(*args, **kwargs)
         return int(res[1])
 
     return _
@@ -98,334 +141,520 @@ def pm(f):
     return _
 
 
-class TMV71:
-    expected_id = "TM-V71"
-    memory_max = 0x7F
-    memory_magic = struct.pack("BB", 0x0, 0x4B)
+class LatencyEstimator:
+    """A running estimate of the round-trip time of one class of
+    operation.
 
-    def __init__(self, port, speed=9600, debug=False, timeout=0.5):
-        self.port = port
-        self.speed = int(speed)
-        self.debug = debug
-        self.timeout = timeout
-        self._programming_mode = False
-        self._ptt = False
-        self.init_serial()
+    The mean and variance are exponentially weighted moving averages of
+    the measured round-trip times, as in TCP's retransmission timer.
+    The timeout for the next operation is the mean plus k standard
+    deviations, clamped to [min_timeout, max_timeout]. Until the first
+    measurement the timeout is max_timeout."""
+
+    alpha = 0.125
+    k = 4
+
+    def __init__(self, min_timeout, max_timeout):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.samples = 0
+        self.mean = None
+        self.variance = None
 
     def __repr__(self):
-        return "<TMV71 on {0.port} @ {0.speed}>".format(self)
+        return "<LatencyEstimator mean={} timeout={}>".format(self.mean, self.timeout)
+
+    def update(self, rtt):
+        """Add a measured round-trip time (in seconds)"""
+
+        self.samples += 1
+        if self.mean is None:
+            self.mean = rtt
+            self.variance = (rtt / 2) ** 2
+            return
+
+        diff = rtt - self.mean
+        self.mean += self.alpha * diff
+        self.variance = (1 - self.alpha) * (self.variance + self.alpha * diff * diff)
+
+    def backoff(self):
+        """Double the estimate after an operation timed out"""
+
+        if self.mean is not None:
+            self.mean = min(self.mean * 2, self.max_timeout)
+
+    @property
+    def timeout(self):
+        if self.mean is None:
+            return self.max_timeout
+
+        timeout = self.mean + self.k * math.sqrt(self.variance)
+        return min(max(timeout, self.min_timeout), self.max_timeout)
+
+    def as_dict(self):
+        return {
+            "samples": self.samples,
+            "mean": self.mean,
+            "stddev": None if self.variance is None else math.sqrt(self.variance),
+            "timeout": self.timeout,
+        }
+
+
+class TransferPlanner:
+    """Choose between CAT commands and programming mode block reads for
+    reading a large amount of data from <radio>.
+
+    CAT commands cost a round trip each (less when several are in
+    flight, see TMV71.send_commands), while a block read moves 256 bytes
+    per round trip but needs a programming mode session, which resets
+    the radio when it ends. The planner estimates the time each method
+    would take from the number of commands and blocks, the port speed
+    and the measured latencies (see TMV71.latency), and picks the
+    cheaper one. All costs are in seconds."""
+
+    # Approximate bytes on the wire for one CAT exchange (an ME or MN
+    # command and its response) and for one block read
+    cat_bytes = 80
+    block_bytes = 4 + 4 + 256 + 2
+
+    # The radio's turnaround time, used until a latency has been measured
+    default_turnaround = 0.05
+
+    # The fixed cost of a programming mode session: entering and
+    # leaving it, and the radio reset that follows. This is a rough,
+    # deliberately pessimistic figure rather than a measurement: the
+    # radio restarts when it leaves programming mode and takes a few
+    # seconds to answer again (compare TMV71.settle_time, which allows
+    # for the same restart after a speed change), and a reset also
+    # interrupts whatever the radio was doing. Over-estimating it means
+    # that block reads are only chosen when they save a lot of time.
+    pm_overhead = 5.0
+
+    def __init__(self, radio, window=None):
+        self.radio = radio
+        self.window = window or radio.pipeline_window
+        self.latency = radio.latency()
+
+    def wire_time(self, nbytes):
+        return self.radio.wire_time(nbytes)
+
+    def turnaround(self, name):
+        """Return the measured turnaround time of operation class <name>"""
+
+        mean = self.latency.get(name, {}).get("mean")
+        if mean is None:
+            return self.default_turnaround
+
+        return mean
+
+    def cat_cost(self, commands):
+        if self.radio._programming_mode:
+            return math.inf
+
+        per_command = (
+            self.wire_time(self.cat_bytes) + self.turnaround("cat") / self.window
+        )
+        return commands * per_command
+
+    def memory_cost(self, blocks):
+        overhead = 0 if self.radio._programming_mode else self.pm_overhead
+        per_block = self.wire_time(self.block_bytes) + self.turnaround("read_block")
+        return overhead + blocks * per_block
+
+    def estimate(self, commands, blocks):
+        """Return the estimated cost of each method"""
+
+        return {"cat": self.cat_cost(commands), "memory": self.memory_cost(blocks)}
+
+    def choose(self, commands, blocks):
+        """Return "cat" or "memory", whichever is cheaper"""
+
+        costs = self.estimate(commands, blocks)
+        method = "cat" if costs["cat"] <= costs["memory"] else "memory"
+        LOG.debug("transfer costs %s, using %s", costs, method)
+        return method
+
+
+class ResultCache:
+    """Remember the responses to query commands for the length of a
+    session (see TMV71.results).
+
+    A command is a query if it has the number of (comma separated)
+    arguments listed in <queries>, e.g. ("ME", "000") but not
+    ("ME", "000,0145430000,..."). Any other command invalidates the
+    cached responses for that command and for the commands listed for
+    it in <related>. Commands that are not listed at all invalidate
+    everything, except for the <volatile> commands, which are never
+    cached and have no effect on the cache.
+
+    Commands listed in <write_through> are written through: when a
+    command that sets the full state (the number of arguments listed
+    there) succeeds, the state it confirms becomes the cached response
+    to the matching query, so reading back what was just written costs
+    nothing. That is the radio's reply when it echoes the full state
+    (as it does for MN), and otherwise the arguments that were sent:
+    the radio answers ME with a bare acknowledgement, so what was sent
+    is the best record of what it now holds (see TMV71.verify_policy).
+
+    The radio can be changed from its front panel, so only use this
+    when nobody is operating the radio while your code runs."""
+
+    queries = {
+        "AE": 0,
+        "AS": 1,
+        "BC": 0,
+        "CC": 1,
+        "DL": 0,
+        "FO": 1,
+        "FV": 1,
+        "ID": 0,
+        "LK": 0,
+        "ME": 1,
+        "MN": 1,
+        "MR": 1,
+        "MS": 0,
+        "MU": 0,
+        "PC": 1,
+        "TY": 0,
+        "VM": 1,
+    }
+    related = {
+        # setting or deleting a channel also changes its name
+        "ME": ["MN"],
+        # single band mode moves the control band
+        "DL": ["BC"],
+        # the VFO settings include the reverse flag
+        "AS": ["FO"],
+        "FO": ["AS"],
+        # selecting a channel puts the band in memory mode, and the
+        # selected channel depends on the mode
+        "MR": ["VM"],
+        "VM": ["MR"],
+    }
+    volatile = {"BY", "DT", "RX", "SQ", "TX"}
+    write_through = {"ME": 16, "MN": 2}
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._results = {}
 
-    def init_serial(self):
-        LOG.info("opening %s at %d bps", self.port, self.speed)
-        self._port = serial.Serial(
-            self.port,
-            baudrate=self.speed,
-            rtscts=False,
-            dsrdtr=False,
-            timeout=self.timeout,
+    def __repr__(self):
+        return "<ResultCache {} entries, {} hits, {} misses>".format(
+            len(self._results), self.hits, self.misses
         )
 
-    def write_bytes(self, data):
-        """Write the given data to the radio."""
+    def key(self, command):
+        """Return the cache key for a query, or None if the command is
+        not a query"""
 
-        if self.debug:
-            print("write:", file=sys.stderr)
-            print("\n".join(hexdump.dumpgen(data)), file=sys.stderr)
-        self._port.write(data)
+        name, args = command[0], self._split_args(command)
+        if name in self.volatile or self.queries.get(name) != len(args):
+            return None
 
-    def read_bytes(self, n=0, until=None):
-        """Read n bytes of data from the radio."""
+        return (name,) + args
 
-        if until is None:
-            data = self._port.read(n)
-        else:
-            data = self._port.read_until(until)
+    @staticmethod
+    def _split_args(command):
+        return tuple(
+            itertools.chain.from_iterable(str(arg).split(",") for arg in command[1:])
+        )
 
-        if not data:
-            raise ReadTimeoutError()
+    def get(self, command):
+        """Return the cached response to <command>, or None"""
 
-        if self.debug:
-            print("read:", file=sys.stderr)
-            print("\n".join(hexdump.dumpgen(data)), file=sys.stderr)
-        return data
+        key = self.key(command)
+        if key is None:
+            return None
 
-    def read_line(self):
-        """Read a carriage-return terminated line from the radio."""
+        try:
+            res = self._results[key]
+        except KeyError:
+            self.misses += 1
+            return None
 
-        return self.read_bytes(until=b"\r")[:-1]
+        self.hits += 1
+        return list(res)
 
-    def send_command_raw(self, command, *args):
-        self.write_bytes(command)
-        if args:
-            args_encoded = b" " + b",".join(args)
-            self.write_bytes(args_encoded)
-        self.write_bytes(b"\r")
-        return self.read_line()
+    def update(self, command, res):
+        """Record the radio's response to <command>"""
 
-    def send_command(self, *command):
-        """Send a command to the radio.
+        key = self.key(command)
+        if key is not None:
+            self._results[key] = list(res)
+            return
 
-        Convert the given command and arguments to bytes and send them to the
-        radio.  Read a response, convert it into a string, and split it on
-        commas.
+        self.sending(command)
 
-            >>> radio.send_command('FV', 0)
-            ['0', '1.00', '2.10', 'A', '1']
+        name, args = command[0], self._split_args(command)
+        if self.write_through.get(name) == len(args):
+            arity = self.queries[name]
+            key = (name,) + args[:arity]
+            state = res if len(res) == len(args) else args
+            self._results[key] = list(state)
 
-        All arguments are first converted to strings, so
-        send_command('FV', 0) and send_command('FV', '0') are
-        equivalent."""
+    def discard(self, command):
+        """Forget the cached response to a query"""
 
-        LOG.debug("sending command: %s", command)
+        key = self.key(command)
+        if key is not None:
+            self._results.pop(key, None)
 
-        command_encoded = [str(arg).encode("ascii") for arg in command]
-        res = self.send_command_raw(*command_encoded).decode("ascii")
+    def sending(self, command):
+        """Invalidate the responses that <command> may change. This is
+        called before a command is sent, in case it changes the radio
+        and then fails."""
 
-        if res == "?":
-            raise UnknownCommandError(command[0])
-        elif res == "N":
-            raise InvalidCommandError(command[0])
-        elif not res.startswith(command[0]):
-            raise UnexpectedResponseError(command[0])
+        name = command[0]
+        if self.key(command) is not None or name in self.volatile:
+            return
 
-        return res[3:].split(",")
+        if name not in self.queries:
+            self.invalidate()
+            return
 
-    # ----------------------------------------------------------------------
+        for name in [name] + self.related.get(name, []):
+            self.invalidate(name)
 
-    def reopen(self):
-        """Close and re-open the serial port"""
-        self._port.close()
-        self._port.open()
+    def invalidate(self, name=None):
+        """Forget the responses to <name> commands (default all)"""
 
-    def clear(self):
-        """Clear the communication channel.
+        if name is None:
+            self._results.clear()
+            return
 
-        Ensure the radio is in a known state by attempting to exit
-        programming mode, complete any partially entered command, and
-        read any remaining output."""
+        for key in [key for key in self._results if key[0] == name]:
+            del self._results[key]
 
-        self.write_bytes(b"E\r")
 
-        while True:
-            try:
-                self.read_bytes(1024)
-            except ReadTimeoutError:
-                break
+class RadioCommands:
+    """The radio operations that TMV71 and tmv71.aio.AsyncTMV71 share.
 
-        self.write_bytes(b"\r")
-        res = self.read_line()
-        if res != b"?":
-            raise UnexpectedResponseError()
+    Each operation is a generator that yields the steps it needs (see
+    operation), so the commands are encoded and the responses parsed in
+    one place; the class that mixes this in provides the I/O."""
 
-    def check_id(self):
-        res = self.radio_id()
-        LOG.debug("check_id: wanted %s, got %s", self.expected_id, res)
-        if res != self.expected_id:
-            raise UnknownDeviceError(res)
+    dtmf_tone_slow = 0.250
+    dtmf_tone_fast = 0.040
 
+    @operation
     def radio_id(self):
         """Return the radio ID"""
-        return self.send_command("ID")[0]
+        return (yield cat_step("ID"))[0]
 
+    @operation
     @schemacommand(schema.TY)
     def radio_type(self):
         """Return the radio type (K for the US, M for Europe)"""
 
-        return self.send_command("TY")
+        return (yield cat_step("TY"))
 
+    @operation
     @schemacommand(schema.AE)
     def radio_serial(self):
         """Return the radio serial number"""
 
-        return self.send_command("AE")
+        return (yield cat_step("AE"))
 
+    @operation
     @schemacommand(schema.FV)
     def radio_firmware(self):
-        return self.send_command("FV", 0)
+        return (yield cat_step("FV", 0))
 
+    @operation
     def get_band_squelch(self, band):
         """Return the squelch setting for the given band"""
 
-        return int(self.send_command("SQ", band)[0], 16)
+        return int((yield cat_step("SQ", band))[0], 16)
 
+    @operation
     @bandcommand
     def get_band_squelch_state(self, band):
         """Return the squelch setting for the given band"""
 
-        return self.send_command("BY", band)
+        return (yield cat_step("BY", band))
 
+    @operation
     @bandcommand
     def get_band_reverse(self, band):
         """Return the state of reverse mode for the given band"""
 
-        return self.send_command("AS", band)
+        return (yield cat_step("AS", band))
 
+    @operation
     @bandcommand
     def set_band_reverse(self, band, reverse_state):
         """Return the state of reverse mode for the given band"""
 
-        return self.send_command("AS", band, reverse_state)
+        return (yield cat_step("AS", band, reverse_state))
 
+    @operation
     def get_lock_state(self):
         """Get the current state of the key lock"""
-        return bool(int(self.send_command("LK")[0]))
+        return bool(int((yield cat_step("LK"))[0]))
 
+    @operation
     def set_lock_state(self, lock_state):
         """Set the current state of the key lock"""
-        return bool(self.send_command("LK", 1 if lock_state else 0)[0])
+        return bool((yield cat_step("LK", 1 if lock_state else 0))[0])
 
+    @operation
     def get_poweron_message(self):
-        return self.send_command("MS")[0]
+        return (yield cat_step("MS"))[0]
 
+    @operation
     def set_poweron_message(self, msg):
-        return self.send_command("MS", msg)[0]
+        return (yield cat_step("MS", msg))[0]
 
+    @operation
     def get_dual_band_mode(self):
-        return int(self.send_command("DL")[0])
+        return int((yield cat_step("DL"))[0])
 
+    @operation
     def set_dual_band_mode(self):
-        return int(self.send_command("DL", 0)[0])
+        return int((yield cat_step("DL", 0))[0])
 
+    @operation
     def set_single_band_mode(self):
-        return int(self.send_command("DL", 1)[0])
+        return int((yield cat_step("DL", 1))[0])
 
+    @operation
     @bandcommand
     def get_channel(self, band):
-        return self.send_command("MR", band)
+        return (yield cat_step("MR", band))
 
+    @operation
     @bandcommand
     def set_channel(self, band, channel):
         channel = "{:03d}".format(channel)
-        return self.send_command("MR", band, channel)
+        return (yield cat_step("MR", band, channel))
 
+    @operation
     @schemacommand(schema.BC)
     def get_ptt_ctrl(self):
-        return self.send_command("BC")
+        return (yield cat_step("BC"))
 
+    @operation
     @schemacommand(schema.BC)
     def set_ptt_ctrl(self, ctrl, ptt):
-        return self.send_command("BC", ctrl, ptt)
+        return (yield cat_step("BC", ctrl, ptt))
 
+    @operation
     def set_ptt(self, ptt_state):
         if ptt_state:
             self._ptt = True
-            return self.send_command("TX")
+            return (yield cat_step("TX"))
         else:
             self._ptt = False
-            return self.send_command("RX")
-
-    @contextmanager
-    def ptt(self):
-        """A context manager that ensures ptt is released"""
-
-        try:
-            self.set_ptt(True)
-            yield
-        finally:
-            self.set_ptt(False)
-
-    dtmf_tone_slow = 0.250
-    dtmf_tone_fast = 0.040
-
-    def send_dtmf(self, tones, fast=False):
-        """Send a series of DTMF tones.
-
-        This will send each tone for <delay> seconds (default 0.250).
-        When sending tones there are no "spaces" between tones. This
-        appears to be a limitation of the underlying `DT` command.
-        """
-
-        delay = self.dtmf_tone_fast if fast else self.dtmf_tone_slow
-
-        time.sleep(delay)
-        for tone in tones:
-            self.send_command("DT", 0, "{:X}".format(DTMF_TONES.index(tone.upper())))
-            time.sleep(delay)
+            return (yield cat_step("RX"))
 
+    @operation
     @bandcommand
     def get_band_mode(self, band):
-        return self.send_command("VM", band)
+        return (yield cat_step("VM", band))
 
+    @operation
     @bandcommand
     def set_band_mode(self, band, mode):
-        return self.send_command("VM", band, mode)
+        return (yield cat_step("VM", band, mode))
 
+    @operation
     @bandcommand
     def get_tx_power(self, band):
-        return self.send_command("PC", band)
+        return (yield cat_step("PC", band))
 
+    @operation
     @bandcommand
     def set_tx_power(self, band, power):
-        return self.send_command("PC", band, power)
+        return (yield cat_step("PC", band, power))
 
+    @operation
     @schemacommand(schema.FO)
     def get_band_vfo(self, band):
-        return self.send_command("FO", band)
+        return (yield cat_step("FO", band))
 
+    @operation
     @schemacommand(schema.FO)
     def set_band_vfo(self, band, settings):
         settings["band"] = band
-        return self.send_command("FO", schema.FO.to_csv(settings))
+        return (yield cat_step("FO", schema.FO.to_csv(settings)))
 
+    @operation
     @schemacommand(schema.CC)
     def get_call_channel(self, index):
-        return self.send_command("CC", index)
+        return (yield cat_step("CC", index))
 
+    @operation
     @schemacommand(schema.CC)
     def set_call_channel(self, index, settings):
-        settings[index] = index
-        return self.send_command("CC", schema.CC.to_csv(settings))
+        settings["index"] = index
+        return (yield cat_step("CC", schema.CC.to_csv(settings)))
 
+    @operation
     @schemacommand(schema.ME)
     def get_channel_entry(self, channel):
-        res = self.send_command("ME", "{:03d}".format(channel))
-        res.append(self.get_channel_name(channel))
+        res = yield cat_step("ME", "{:03d}".format(channel))
+        res.append((yield step("get_channel_name", channel)))
         return res
 
+    @operation
     def set_channel_entry(self, channel, settings):
-        settings[channel] = channel
-        self.send_command("ME", schema.ME_no_name.to_csv(settings))
-        self.set_channel_name(channel, settings["name"])
+        """Write a channel, and return its new state as an ME entry.
+
+        The radio only acknowledges the ME command, so the new state is
+        decoded from what was sent and the name the radio echoed."""
 
+        settings["channel"] = channel
+        values = schema.ME_no_name.to_tuple(settings)
+        yield cat_step("ME", ",".join(values))
+        name = yield step("set_channel_name", channel, settings["name"])
+        return schema.ME.from_tuple(values + [name])
+
+    @operation
     def delete_channel_entry(self, channel):
         channel = "{:03d}".format(channel)
         try:
-            return self.send_command("ME", channel, "")
+            return (yield cat_step("ME", channel, ""))
         except InvalidCommandError:
             return [""]
 
+    @operation
     def get_channel_name(self, channel):
         channel = "{:03d}".format(int(channel))
-        res = self.send_command("MN", channel)
-        return res[1]
+        return (yield cat_step("MN", channel))[1]
 
+    @operation
     def set_channel_name(self, channel, name):
         channel = "{:03d}".format(int(channel))
-        res = self.send_command("MN", channel, name)
-        return res[1]
+        return (yield cat_step("MN", channel, name))[1]
 
+    @operation
     @schemacommand(schema.MU)
     def get_radio_config(self):
-        return self.send_command("MU")
+        return (yield cat_step("MU"))
 
+    @operation
     @schemacommand(schema.MU)
     def set_radio_config(self, settings):
-        return self.send_command("MU", schema.MU.to_csv(settings))
+        return (yield cat_step("MU", schema.MU.to_csv(settings)))
 
     # ----------------------------------------------------------------------
 
     @pm
+    @operation
     def get_port_speed(self):
-        speed = self.read_block(M_OFFSET_PORT_SPEED, 1)
+        speed = yield step("read_block", M_OFFSET_PORT_SPEED, 1)
         speed = struct.unpack("B", speed)[0]
         return PORT_SPEED[speed]
 
     @pm
+    @operation
     def set_port_speed(self, speed):
         speed = PORT_SPEED.index(speed)
-        self.write_block(M_OFFSET_PORT_SPEED, bytes([speed]))
+        yield step("write_block", M_OFFSET_PORT_SPEED, bytes([speed]))
 
     @pm
+    @operation
     def get_frequency_band(self, band):
         if band == 0:
             address = M_OFFSET_BANDA_BAND
@@ -434,7 +663,7 @@ class TMV71:
         else:
             raise ValueError("invalid band: {}".format(band))
 
-        res = self.read_block(address, 1)
+        res = yield step("read_block", address, 1)
         res = struct.unpack("B", res)[0]
 
         # The constants in FREQUENCY_BAND are correct for band A, but
@@ -444,6 +673,7 @@ class TMV71:
         return FREQUENCY_BAND[res]
 
     @pm
+    @operation
     def set_frequency_band(self, band, freq_band):
         freq_band = FREQUENCY_BAND.index(freq_band)
 
@@ -458,177 +688,1134 @@ class TMV71:
         else:
             raise ValueError("invalid band: {}".format(band))
 
-        self.write_block(address, bytes([freq_band]))
+        yield step("write_block", address, bytes([freq_band]))
 
     @pm
+    @operation
     def reset(self):
         """Reset to default configuration"""
-        self.write_block(0, b"\xff")
+        yield step("write_block", 0, b"\xff")
 
     @pm
+    @operation
     def get_operating_mode(self):
         """Get current radio operating mode"""
 
-        res = self.read_block(M_OFFSET_OPERATING_MODE, 2)
+        res = yield step("read_block", M_OFFSET_OPERATING_MODE, 2)
         return struct.unpack("BB", res)
 
     @pm
+    @operation
     def set_operating_mode(self, repeater, wireless):
         wireless = 1 if wireless else 0
         repeater = 1 if repeater else 0
 
-        self.write_block(M_OFFSET_OPERATING_MODE, struct.pack("BB", repeater, wireless))
+        yield step(
+            "write_block",
+            M_OFFSET_OPERATING_MODE,
+            struct.pack("BB", repeater, wireless),
+        )
 
     @pm
+    @operation
     def get_remote_id(self):
-        res = self.read_block(0x12, 3)
-        return res
+        return (yield step("read_block", M_OFFSET_REMOTE_ID, 3))
 
     @pm
+    @operation
     def set_remote_id(self, remote_id):
         if len(remote_id) != 3:
             raise ValueError("remote id must be three digits")
 
-        self.write_block(0x12, remote_id)
-
-    # ----------------------------------------------------------------------
+        yield step("write_block", M_OFFSET_REMOTE_ID, remote_id)
 
-    @contextmanager
-    def programming_mode(self):
-        """Wrap code that interacts with the radio in programming mode.
 
-        You must enclose calls that require programming mode with this
-        context manager.  For example:
+class TMV71(RadioCommands):
+    expected_id = "TM-V71"
+    memory_max = 0x7F
+    memory_magic = struct.pack("BB", 0x0, 0x4B)
+    pipeline_window = 4
+    rxbuf_compact_size = 4096
+
+    # Classes of operation with their own latency estimate
+    latency_classes = ["cat", "read_block", "write_block"]
+    min_timeout = 0.02
+
+    # Classes of operation that always get the configured timeout. A
+    # block write cannot be retried safely in the middle of a restore,
+    # and flash writes vary too much to trust the estimate.
+    fixed_timeout_classes = ["write_block"]
+
+    # The longest response to a CAT command (an ME query), which is
+    # allowed for when deriving the timeout for a CAT command
+    cat_response_bytes = 72
+
+    # See resync
+    resync_probe = b"\rID\r"
+    resync_timeout = 0.1
+
+    # How long to wait for the radio to come back after a speed change
+    settle_time = 3.0
+
+    # A ResultCache, or None
+    results = None
+
+    # Whether set_channel_entry reads the channel back after writing it:
+    # "always", "sampled" (one write in every verify_interval), or
+    # "never" (trust the radio's acknowledgement)
+    verify_policy = "never"
+    verify_interval = 10
+    _writes = 0
+
+    # The number of channels that apply_import encodes ahead of the
+    # radio (see prefetch)
+    prefetch_size = 16
+
+    # A tmv71.mirror.ChannelMirror that is kept up to date with the
+    # channels we read and write, or None
+    mirror = None
+
+    def __init__(
+        self,
+        port,
+        speed=9600,
+        debug=False,
+        timeout=0.5,
+        adaptive_timeout=True,
+        cache_results=False,
+    ):
+        self.port = port
+        self.speed = int(speed)
+        self.debug = debug
+        self.timeout = timeout
+        self.adaptive_timeout = adaptive_timeout
+        if cache_results:
+            self.results = ResultCache()
+        self._programming_mode = False
+        self._ptt = False
+        self._reset_rxbuf()
+        self.reset_latency()
+        self.init_serial()
 
-            with radio.programming_mode():
-                radio.read_block(0, 0)
+    def __repr__(self):
+        return "<TMV71 on {0.port} @ {0.speed}>".format(self)
 
-        Failure to use the context manager will result in
-        WrongModeError exception."""
+    def init_serial(self):
+        LOG.info("opening %s at %d bps", self.port, self.speed)
+        self._port = serial.Serial(
+            self.port,
+            baudrate=self.speed,
+            rtscts=False,
+            dsrdtr=False,
+            timeout=self.timeout,
+        )
+        self._port_timeout = self.timeout
 
-        self.enter_programming_mode()
-        try:
-            yield
-        finally:
-            self.exit_programming_mode()
+    def set_speed(self, speed):
+        """Change the speed of the serial port.
 
-    def enter_programming_mode(self):
-        LOG.debug("entering programming mode")
-        self.write_bytes(b"0M PROGRAM\r")
-        res = self.read_line()
-        if res != b"0M":
-            raise UnexpectedResponseError()
-        self._programming_mode = True
+        This only changes the local port; use set_port_speed to change
+        the speed of the radio."""
 
-    def exit_programming_mode(self):
-        LOG.debug("exiting programming mode")
-        self.write_bytes(b"E")
-        self._programming_mode = False
-        for expected in [b"\x06", b"\r", b"\x00"]:
-            res = self.read_bytes(1)
-            if res != expected:
-                raise UnexpectedResponseError()
+        LOG.info("changing port speed to %s bps", speed)
+        self.speed = int(speed)
+        self._port.baudrate = self.speed
+        self._reset_rxbuf()
+        self.reset_latency()
 
-    @pm
-    def read_block(self, address, size):
-        """Read data from the radio"""
+    def reset_latency(self):
+        """Forget the measured round-trip times"""
 
-        LOG.debug("read address %d, size %d", address, size)
+        self._latency = {
+            name: LatencyEstimator(min(self.min_timeout, self.timeout), self.timeout)
+            for name in self.latency_classes
+        }
 
-        args = struct.pack(">HB", address, size)
+    def latency(self):
+        """Return the turnaround time estimate for each class of
+        operation:
 
-        self.write_bytes(b"R" + args)
-        res = self.read_bytes(4)
-        if res != b"W" + args:
-            raise UnexpectedResponseError(res)
+            >>> radio.latency()["cat"]
+            {'samples': 12, 'mean': 0.011, 'stddev': 0.002, 'timeout': 0.02}
 
-        data = self.read_bytes(size if size else 256)
-        self.write_bytes(bytes([6]))
-        self.check_ack()
-        return data
+        The turnaround time is the round-trip time less the time spent
+        sending the request and the response (see wire_time). Times are
+        in seconds; mean and stddev are None until an operation of that
+        class has completed."""
 
-    @pm
-    def write_block(self, address, data):
-        """Write data to the radio"""
+        return {name: est.as_dict() for name, est in self._latency.items()}
 
-        size = len(data)
-        if size > 256:
-            raise ValueError("write_block cannot write more than 256 bytes")
+    def set_port_timeout(self, timeout):
+        """Set the read timeout of the serial port.
 
-        LOG.debug("write address %d, size %d", address, size)
-        if size == 256:
-            size = 0
+        Changing the timeout reconfigures the port, so the timeout is
+        rounded up to 10ms and only changed when the rounded value
+        differs from the current one."""
 
-        self.write_bytes(struct.pack(">BHB", ord("W"), address, size))
-        self.write_bytes(bytes(data))
-        self.check_ack()
+        timeout = math.ceil(timeout * 100) / 100
+        if timeout != self._port_timeout:
+            self._port.timeout = timeout
+            self._port_timeout = timeout
 
-    def check_ack(self):
-        """Validate the response to programming mode commands."""
+    def wire_time(self, nbytes):
+        """Return the time it takes to send <nbytes> at the port speed
+        (10 bits per byte)"""
 
-        res = self.read_bytes(1)
-        if res == b"\x15":
-            LOG.warning("radio is in error state (continuing)")
-        elif res != b"\x06":
-            raise UnexpectedResponseError()
+        if not self.speed:
+            return 0
 
-    @pm
-    def memory_dump(self, fd):
-        """Read data from the radio and write it to a file-like object."""
+        return nbytes * 10 / self.speed
 
-        for block in range(self.memory_max):
-            addr = block * 256
-            LOG.debug("reading block %d", block)
-            data = self.read_block(addr, 0)
-            fd.write(data)
+    def exchange_timeout(self, name, nbytes):
+        """Return the read timeout for an operation of class <name> that
+        moves <nbytes> (the request and its response) on the wire.
 
-    @pm
-    def memory_restore(self, fd, force=False):
-        """Read data from a file-like object and write it to the radio.
+        Classes in fixed_timeout_classes are still measured, but get the
+        configured timeout rather than one derived from the estimate."""
 
-        This command is similar to the behavior of the MCP-2A "Write
-        data to the receiver" command"; in particular, it initially
-        writes 0xFF to address 0 before proceeding to load the data
-        from the input file descriptor to the radio. This will cause
-        the radio to reset to defaults if the write operation is
-        interrupted."""
+        if name in self.fixed_timeout_classes:
+            timeout = self.timeout
+        else:
+            timeout = self._latency[name].timeout
 
-        magiclen = len(self.memory_magic)
+        return timeout + self.wire_time(nbytes)
 
-        # Check that radio state seems sane
-        data = self.read_block(0, magiclen)
-        if data != self.memory_magic:
-            if force:
-                LOG.warning("Radio does not contain expected " "data (continuing)")
-            else:
-                raise ValueError("radio does not contain expected data")
+    @contextmanager
+    def timed(self, name, nbytes=0):
+        """Time an operation of class <name> that moves up to <nbytes>
+        on the wire, using the timeout derived from the latency estimate
+        for that class while it runs (see exchange_timeout).
 
-        # Check that input data seems sane
-        data = fd.read(magiclen)
-        if data != self.memory_magic:
-            if force:
-                LOG.warning("Input does not contain expected " "data (continuing)")
-            else:
-                raise ValueError("input does not contain expected data")
+        The wire time is subtracted from the measurement, so that the
+        estimate is of the radio's turnaround time. Operations that fail
+        are not measured; a timeout doubles the estimate instead."""
 
-        self.write_block(0, b"\xff")
+        if not self.adaptive_timeout:
+            yield
+            return
 
-        fd.seek(magiclen)
-        self.write_block(magiclen, fd.read(256 - magiclen))
+        estimator = self._latency[name]
+        self.set_port_timeout(self.exchange_timeout(name, nbytes))
+        start = time.monotonic()
+        try:
+            yield
+        except ReadTimeoutError:
+            estimator.backoff()
+            raise
 
-        for block in range(1, self.memory_max):
-            addr = block * 256
-            LOG.debug("writing block %d", block)
-            data = fd.read(256)
-            if not data:
-                raise EOFError("Ran out of data in memory_restore")
-            self.write_block(addr, data)
+        estimator.update(max(time.monotonic() - start - self.wire_time(nbytes), 0))
+
+    def write_bytes(self, data):
+        """Write the given data to the radio."""
+
+        if self.debug:
+            print("write:", file=sys.stderr)
+            print("\n".join(hexdump.dumpgen(data)), file=sys.stderr)
+        self._port.write(data)
+
+    def read_bytes(self, n=0, until=None):
+        """Read n bytes of data from the radio.
+
+        If until is given, read up to and including the terminator
+        instead. Like serial.Serial.read, this returns whatever data
+        has arrived if the port times out first, and raises
+        ReadTimeoutError if there is none."""
+
+        while True:
+            available = len(self._rxbuf) - self._rxpos
+            if until is not None:
+                end = self._rxbuf.find(until, self._rxpos)
+                if end >= 0:
+                    end += len(until)
+                    break
+                needed = 1
+            elif available >= n:
+                end = self._rxpos + n
+                break
+            else:
+                needed = n - available
+
+            if not self._fill(needed):
+                end = len(self._rxbuf)
+                break
+
+        start = self._rxpos
+        data = bytes(self._rxbuf[start:end])
+        self._consume(end)
+
+        if not data:
+            raise ReadTimeoutError()
+
+        if self.debug:
+            print("read:", file=sys.stderr)
+            print("\n".join(hexdump.dumpgen(data)), file=sys.stderr)
+        return data
+
+    def _fill(self, needed=1):
+        """Read everything the port has received into the receive
+        buffer, waiting for at least <needed> bytes. Return False if
+        the port timed out."""
+
+        data = self._port.read(max(self._port.in_waiting, needed))
+        if not data:
+            return False
+
+        self._rxbuf += data
+        return True
+
+    def _consume(self, end):
+        """Discard the receive buffer up to <end>.
+
+        Consumed data is only removed from the front of the buffer once
+        there is enough of it to be worth moving the rest."""
+
+        if end >= len(self._rxbuf):
+            self._reset_rxbuf()
+        elif end > self.rxbuf_compact_size:
+            del self._rxbuf[:end]
+            self._rxpos = 0
+        else:
+            self._rxpos = end
+
+    def _reset_rxbuf(self):
+        self._rxbuf = bytearray()
+        self._rxpos = 0
+
+    def read_line(self):
+        """Read a carriage-return terminated line from the radio."""
+
+        return self.read_bytes(until=b"\r")[:-1]
+
+    def send_command_raw(self, command, *args):
+        self.write_bytes(command)
+        if args:
+            args_encoded = b" " + b",".join(args)
+            self.write_bytes(args_encoded)
+        self.write_bytes(b"\r")
+        return self.read_line()
+
+    def encode_command(self, *command):
+        """Convert a command and its arguments into a CR-terminated frame"""
+
+        command_encoded = [str(arg).encode("ascii") for arg in command]
+        frame = command_encoded[0]
+        if command_encoded[1:]:
+            frame += b" " + b",".join(command_encoded[1:])
+
+        return frame + b"\r"
+
+    def parse_response(self, command, res):
+        """Convert a response line into a list of values.
+
+        Raise UnknownCommandError or InvalidCommandError if the radio
+        rejected the command, and UnexpectedResponseError if the response
+        does not belong to the command."""
+
+        if res == "?":
+            raise UnknownCommandError(command[0])
+        elif res == "N":
+            raise InvalidCommandError(command[0])
+        elif not res.startswith(command[0]):
+            raise UnexpectedResponseError(command[0])
+
+        return res[3:].split(",")
+
+    def send_command(self, *command):
+        """Send a command to the radio.
+
+        Convert the given command and arguments to bytes and send them to the
+        radio.  Read a response, convert it into a string, and split it on
+        commas.
+
+            >>> radio.send_command('FV', 0)
+            ['0', '1.00', '2.10', 'A', '1']
+
+        All arguments are first converted to strings, so
+        send_command('FV', 0) and send_command('FV', '0') are
+        equivalent.
+
+        If the radio was created with cache_results=True, responses to
+        queries are answered from self.results when possible (see
+        ResultCache)."""
+
+        if self.results is None:
+            return self._send_command(*command)
+
+        res = self.results.get(command)
+        if res is None:
+            self.results.sending(command)
+            res = self._send_command(*command)
+            self.results.update(command, res)
+
+        return res
+
+    def _send_command(self, *command):
+        LOG.debug("sending command: %s", command)
+
+        command_encoded = [str(arg).encode("ascii") for arg in command]
+        nbytes = len(self.encode_command(*command)) + self.cat_response_bytes
+        with self.timed("cat", nbytes):
+            res = self.send_command_raw(*command_encoded).decode("ascii")
+
+        return self.parse_response(command, res)
+
+    def send_commands(self, commands, window=None, return_exceptions=False):
+        """Send a sequence of commands with several commands in flight.
+
+        This writes up to <window> commands (default pipeline_window)
+        before waiting for a response, and then matches the
+        CR-terminated responses to the commands in the order in which
+        they were sent.  It yields one result per command:
+
+            >>> list(radio.send_commands([('ME', '000'), ('MN', '000')]))
+            [['000', '0145430000', ...], ['000', 'TEST']]
+
+        If return_exceptions is True, errors reported by the radio
+        (UnknownCommandError, InvalidCommandError) are yielded in
+        place of the result for the failing command; otherwise they are
+        raised once the remaining in-flight responses have been read.
+
+        Each response is allowed the timeout for a CAT command plus the
+        time it takes to send the commands ahead of it (see timed). If a
+        response times out, the latency estimate is doubled, the channel
+        is resynced and any commands that were still in flight are
+        re-sent one at a time, after which the remaining commands are
+        sent without pipelining."""
+
+        window = window or self.pipeline_window
+        commands = iter(commands)
+        estimator = self._latency["cat"]
+
+        # The commands in flight, as (command, frame size, time sent,
+        # bytes in flight when it was sent)
+        pending = collections.deque()
+        in_flight = 0
+        answered = 0
+
+        try:
+            while True:
+                for command in commands:
+                    LOG.debug("sending command (pipelined): %s", command)
+                    if self.results is not None:
+                        self.results.sending(command)
+                    frame = self.encode_command(*command)
+                    self.write_bytes(frame)
+                    in_flight += len(frame)
+                    pending.append((command, len(frame), time.monotonic(), in_flight))
+                    if len(pending) >= window:
+                        break
+
+                if not pending:
+                    break
+
+                command, size, sent, queued = pending[0]
+                if self.adaptive_timeout:
+                    self.set_port_timeout(
+                        self.exchange_timeout("cat", queued + self.cat_response_bytes)
+                    )
+
+                try:
+                    res = self.read_line().decode("ascii")
+                except ReadTimeoutError:
+                    if self.adaptive_timeout:
+                        estimator.backoff()
+                    if window == 1:
+                        raise
+
+                    LOG.warning(
+                        "timeout with %d commands in flight "
+                        "(continuing without pipelining)",
+                        len(pending),
+                    )
+                    self.resync()
+                    window = 1
+                    commands = itertools.chain([item[0] for item in pending], commands)
+                    pending.clear()
+                    in_flight = 0
+                    continue
+
+                # Measure from when the radio could start on this
+                # command: when it was sent, or when the radio finished
+                # answering the previous one
+                now = time.monotonic()
+                if self.adaptive_timeout:
+                    if sent > answered:
+                        start, nbytes = sent, queued + len(res) + 1
+                    else:
+                        start, nbytes = answered, len(res) + 1
+                    estimator.update(max(now - start - self.wire_time(nbytes), 0))
+                answered = now
+                in_flight -= size
+
+                pending.popleft()
+                try:
+                    res = self.parse_response(command, res)
+                    if self.results is not None:
+                        self.results.update(command, res)
+                    yield res
+                except (UnknownCommandError, InvalidCommandError) as err:
+                    if not return_exceptions:
+                        raise
+                    yield err
+        finally:
+            # Don't leave unread responses on the wire if we are
+            # exiting early.
+            while pending:
+                pending.popleft()
+                try:
+                    self.read_line()
+                except ReadTimeoutError:
+                    break
+
+    # ----------------------------------------------------------------------
+
+    def close(self):
+        """Close the serial port"""
+        self._port.close()
+        self._reset_rxbuf()
+
+    def reopen(self):
+        """Close and re-open the serial port"""
+        self._port.close()
+        self._reset_rxbuf()
+        self._port.open()
+
+    def clear(self):
+        """Clear the communication channel.
+
+        Ensure the radio is in a known state by attempting to exit
+        programming mode, complete any partially entered command, and
+        read any remaining output."""
+
+        self.write_bytes(b"E\r")
+        self.drain_input()
+
+        with self.timed("cat", len(b"\r?\r")):
+            self.write_bytes(b"\r")
+            res = self.read_line()
+        if res != b"?":
+            raise UnexpectedResponseError()
+
+    def resync(self):
+        """Bring the communication channel back to a known state.
+
+        This discards any buffered input and sends resync_probe, which
+        completes any partially entered command and then asks for the
+        radio id. If an ID response arrives within resync_timeout, the
+        channel is in sync; otherwise this falls back to clear()."""
+
+        if self.probe():
+            return
+
+        LOG.info("no response to resync probe, clearing channel")
+        self.clear()
+
+    def probe(self):
+        """Send resync_probe and wait for the radio to answer it.
+
+        Returns True if an ID response followed the response to the
+        leading CR, and False if it did not arrive within
+        resync_timeout or the radio is in programming mode."""
+
+        if self._programming_mode:
+            return False
+
+        self._port.reset_input_buffer()
+        self._reset_rxbuf()
+
+        timeout = self.resync_timeout
+        if self.adaptive_timeout:
+            timeout = min(timeout, self._latency["cat"].timeout)
+        self.set_port_timeout(timeout)
+
+        self.write_bytes(self.resync_probe)
+        deadline = time.monotonic() + self.resync_timeout
+        lines = 0
+        while time.monotonic() < deadline:
+            try:
+                res = self.read_line()
+            except ReadTimeoutError:
+                break
+
+            lines += 1
+            if lines > 1 and res.startswith(b"ID "):
+                return True
+
+        return False
+
+    def detect_speed(self, speeds=PORT_SPEED):
+        """Find the speed at which the radio is talking.
+
+        This sends the resync probe at the current speed and then at
+        each of the other <speeds>, and leaves the serial port at the
+        first speed at which the radio answers. Returns that speed, or
+        None (with the port back at its original speed) if the radio
+        did not answer at all."""
+
+        original = str(self.speed)
+        candidates = [original] + [speed for speed in speeds if speed != original]
+
+        for speed in candidates:
+            if speed != str(self.speed):
+                self.set_speed(speed)
+
+            LOG.debug("looking for radio at %s bps", speed)
+            if self.probe():
+                LOG.info("radio is at %s bps", speed)
+                return speed
+
+        self.set_speed(original)
+        return None
+
+    def wait_ready(self):
+        """Wait up to settle_time for the radio to answer the resync
+        probe (e.g. after it resets). Return True if it did."""
+
+        deadline = time.monotonic() + self.settle_time
+        while True:
+            if self.probe():
+                return True
+
+            if time.monotonic() >= deadline:
+                return False
+
+            time.sleep(0.1)
+
+    def drain_input(self):
+        """Read and discard data from the radio until a read times out"""
+
+        if self.adaptive_timeout:
+            self.set_port_timeout(self._latency["cat"].timeout)
+
+        while True:
+            try:
+                self.read_bytes(1024)
+            except ReadTimeoutError:
+                break
+
+    def _run(self, steps):
+        """Run an operation (see operation), returning its result"""
+
+        send, value = steps.send, None
+        while True:
+            try:
+                method, args = send(value)
+            except StopIteration as stop:
+                return stop.value
+
+            try:
+                value, send = getattr(self, method)(*args), steps.send
+            except Exception as err:
+                value, send = err, steps.throw
+
+    def check_id(self):
+        res = self.radio_id()
+        LOG.debug("check_id: wanted %s, got %s", self.expected_id, res)
+        if res != self.expected_id:
+            raise UnknownDeviceError(res)
+
+    def capabilities(self, cache=None, refresh=False):
+        """Return the facts about this radio that never change:
+
+            >>> radio.capabilities()
+            {'serial': {'serial': '12345', 'extra': '321'}, 'id': 'TM-V71',
+             'model_class': 'TMV71', 'memory_max': 127, 'firmware': {...},
+             'type': {...}, 'port': '/dev/ttyUSB0'}
+
+        model_class names the class in this module that matches the
+        radio id (see MODELS), and memory_max comes from that class.
+
+        If <cache> (a tmv71.cache.JSONCache or anything else with get,
+        set and delete methods) is given, the result is stored under the
+        radio serial number. The serial number is always read from the
+        radio, which validates the cached entry; the ID, TY and FV
+        commands are only sent if there is no entry for this serial
+        number or refresh is True."""
+
+        serial = dict(self.radio_serial())
+
+        if cache is not None and not refresh:
+            caps = cache.get(serial["serial"])
+            if caps is not None and caps.get("serial") == serial:
+                LOG.debug("using cached capabilities for %s", serial["serial"])
+                if caps.get("port") != self.port:
+                    caps["port"] = self.port
+                    cache.set(serial["serial"], caps)
+                return caps
+
+        radio_id = self.radio_id()
+        model = MODELS.get(radio_id)
+        caps = {
+            "serial": serial,
+            "id": radio_id,
+            "model_class": None if model is None else model.__name__,
+            "memory_max": (model or self).memory_max,
+            "firmware": dict(self.radio_firmware()),
+            "type": dict(self.radio_type()),
+            "port": self.port,
+        }
+
+        if cache is not None:
+            cache.set(serial["serial"], caps)
+
+        return caps
+
+    def forget_capabilities(self, cache):
+        """Remove this radio from a capability cache (see capabilities)"""
+
+        cache.delete(self.radio_serial()["serial"])
+
+    @contextmanager
+    def ptt(self):
+        """A context manager that ensures ptt is released"""
+
+        try:
+            self.set_ptt(True)
+            yield
+        finally:
+            self.set_ptt(False)
+
+    def send_dtmf(self, tones, fast=False):
+        """Send a series of DTMF tones.
+
+        This will send each tone for <delay> seconds (default 0.250).
+        When sending tones there are no "spaces" between tones. This
+        appears to be a limitation of the underlying `DT` command.
+        """
+
+        delay = self.dtmf_tone_fast if fast else self.dtmf_tone_slow
+
+        time.sleep(delay)
+        for tone in tones:
+            self.send_command("DT", 0, "{:X}".format(DTMF_TONES.index(tone.upper())))
+            time.sleep(delay)
+
+    def set_channel_entry(self, channel, settings):
+        """Write a channel, and return its new state as an ME entry.
+
+        The radio only acknowledges the ME command, so the new state is
+        decoded from what was sent (and the name the radio echoed),
+        without reading the channel back. Set verify_policy to read it
+        back anyway; a warning is logged if the radio holds something
+        different from what was written."""
+
+        entry = super().set_channel_entry(channel, settings)
+
+        if self._should_verify():
+            if self.results is not None:
+                self.results.discard(("ME", "{:03d}".format(channel)))
+                self.results.discard(("MN", "{:03d}".format(channel)))
+
+            written, entry = entry, self.get_channel_entry(channel)
+            if entry != written:
+                LOG.warning("channel %d does not match what was written", channel)
+
+        self.update_mirror(channel, entry)
+        return entry
+
+    def _should_verify(self):
+        self._writes += 1
+        if self.verify_policy == "always":
+            return True
+        elif self.verify_policy == "sampled":
+            return (self._writes - 1) % self.verify_interval == 0
+        elif self.verify_policy == "never":
+            return False
+
+        raise ValueError("unknown verify policy: {}".format(self.verify_policy))
+
+    def delete_channel_entry(self, channel):
+        res = super().delete_channel_entry(channel)
+        self.update_mirror(channel, None)
+        return res
+
+    def set_channel_name(self, channel, name):
+        res = super().set_channel_name(channel, name)
+        if self.mirror is not None:
+            self.mirror.set_name(int(channel), res)
+        return res
+
+    def update_mirror(self, channel, entry):
+        """Record the contents of a channel (None if it is deleted) in
+        the channel mirror, if there is one.
+
+        If the entry cannot be stored in the mirror the channel is
+        forgotten, so that the mirror never holds stale data."""
+
+        if self.mirror is None:
+            return
+
+        try:
+            if entry is None:
+                self.mirror.delete(channel)
+            else:
+                self.mirror.set(channel, entry)
+        except (ValueError, TypeError, KeyError) as err:
+            LOG.warning("forgetting channel %d in mirror: %s", channel, err)
+            self.mirror.forget(channel)
+
+    # ----------------------------------------------------------------------
+
+    @contextmanager
+    def turbo(self, speed="57600"):
+        """Run the enclosed code with the radio and the serial port
+        switched to <speed>:
+
+            with radio.turbo() as original, radio.programming_mode():
+                radio.memory_dump(fd, port_speed=original)
+
+        The radio talks at the speed of the serial port, so that is
+        taken to be its current speed, and the radio is left alone if
+        it is already at <speed>. Otherwise the radio speed is changed
+        in programming mode, which resets the radio, so this must be
+        used outside of programming_mode. The original speed is
+        restored afterwards, even if the enclosed code fails.
+
+        The context manager returns the original speed, which is what
+        a memory dump taken at <speed> should record (see memory_dump)."""
+
+        if self._programming_mode:
+            raise RadioError("cannot change speed in programming mode")
+
+        original = str(self.speed)
+        if original == speed:
+            yield original
+            return
+
+        LOG.info("switching radio to %s bps", speed)
+        with self.programming_mode():
+            self.set_port_speed(speed)
+
+        self.set_speed(speed)
+        if not self.wait_ready():
+            self.set_speed(original)
+            raise ReadTimeoutError()
+
+        try:
+            yield original
+        finally:
+            self._restore_speed(speed, original)
+
+    def _restore_speed(self, speed, original):
+        LOG.info("restoring radio to %s bps", original)
+
+        # A memory restore may have already changed the radio speed, so
+        # look for the radio at both speeds.
+        for current in (speed, original):
+            self.set_speed(current)
+            if self.wait_ready():
+                break
+
+            try:
+                self.clear()
+            except CommunicationError:
+                continue
+            break
+        else:
+            raise ReadTimeoutError()
+
+        if current != original:
+            with self.programming_mode():
+                self.set_port_speed(original)
+
+            self.set_speed(original)
+            if not self.wait_ready():
+                raise ReadTimeoutError()
+
+    # ----------------------------------------------------------------------
+
+    @contextmanager
+    def programming_mode(self):
+        """Wrap code that interacts with the radio in programming mode.
+
+        You must enclose calls that require programming mode with this
+        context manager.  For example:
+
+            with radio.programming_mode():
+                radio.read_block(0, 0)
+
+        Failure to use the context manager will result in
+        WrongModeError exception.
+
+        If the radio is already in programming mode this does nothing,
+        so that several operations can share a single programming mode
+        session (and a single radio reset)."""
+
+        if self._programming_mode:
+            yield
+            return
+
+        self.enter_programming_mode()
+        try:
+            yield
+        finally:
+            self.exit_programming_mode()
+
+    def enter_programming_mode(self):
+        LOG.debug("entering programming mode")
+        self.set_port_timeout(self.timeout)
+        self.write_bytes(b"0M PROGRAM\r")
+        res = self.read_line()
+        if res != b"0M":
+            raise UnexpectedResponseError()
+        self._programming_mode = True
+
+    def exit_programming_mode(self):
+        LOG.debug("exiting programming mode")
+        self.set_port_timeout(self.timeout)
+        self.write_bytes(b"E")
+        self._programming_mode = False
+        for expected in [b"\x06", b"\r", b"\x00"]:
+            res = self.read_bytes(1)
+            if res != expected:
+                raise UnexpectedResponseError()
+
+    @pm
+    def read_block(self, address, size):
+        """Read data from the radio"""
+
+        LOG.debug("read address %d, size %d", address, size)
+
+        args = struct.pack(">HB", address, size)
+
+        # the request, the response header and data, and the acks
+        nbytes = 4 + 4 + (size if size else 256) + 2
+        with self.timed("read_block", nbytes):
+            self.write_bytes(b"R" + args)
+            res = self.read_bytes(4)
+            if res != b"W" + args:
+                raise UnexpectedResponseError(res)
+
+            data = self.read_bytes(size if size else 256)
+            self.write_bytes(bytes([6]))
+            self.check_ack()
+
+        if self.mirror is not None:
+            self.mirror.update_memory(address, data)
+        return data
+
+    @pm
+    def write_block(self, address, data):
+        """Write data to the radio"""
+
+        size = len(data)
+        if size > 256:
+            raise ValueError("write_block cannot write more than 256 bytes")
+
+        LOG.debug("write address %d, size %d", address, size)
+        if self.results is not None:
+            self.results.invalidate()
+        if size == 256:
+            size = 0
+
+        with self.timed("write_block", 4 + len(data) + 1):
+            self.write_bytes(struct.pack(">BHB", ord("W"), address, size))
+            self.write_bytes(bytes(data))
+            self.check_ack()
+
+        if self.mirror is not None:
+            self.mirror.update_memory(address, data)
+
+    def check_ack(self):
+        """Validate the response to programming mode commands."""
+
+        res = self.read_bytes(1)
+        if res == b"\x15":
+            LOG.warning("radio is in error state (continuing)")
+        elif res != b"\x06":
+            raise UnexpectedResponseError()
+
+    @pm
+    def memory_dump(self, fd, resume=False, retries=0, port_speed=None):
+        """Read data from the radio and write it to a file-like object.
+
+        If fd is a regular file opened for both reading and writing
+        (e.g. mode "w+b"), the file is preallocated and blocks are read
+        directly into a memory map of it. The blocks that have been
+        read so far are recorded in a sidecar file (<name>.blocks),
+        which is removed once the dump is complete. If resume is True
+        and the sidecar file exists, only the blocks that are missing
+        from the file are read.
+
+        A block that fails with a communication error is retried up to
+        <retries> times before giving up.
+
+        If port_speed is given, it is recorded in the dump in place of
+        the radio's current port speed, so that a dump taken in turbo
+        mode restores the radio to its usual speed."""
+
+        if not is_mappable(fd):
+            if resume:
+                raise ValueError("cannot resume a dump that is not written to a file")
+
+            for block in range(self.memory_max):
+                LOG.debug("reading block %d", block)
+                fd.write(self._read_dump_block(block, retries, port_speed))
+            return
+
+        size = self.memory_max * 256
+        done_path = "{}.blocks".format(fd.name)
+        done = image.Bitmap(self.memory_max)
+
+        if resume and os.path.exists(done_path):
+            with open(done_path, "rb") as done_fd:
+                done = image.Bitmap(self.memory_max, done_fd.read())
+            LOG.info("resuming dump (%d of %d blocks done)", done.count(), len(done))
+
+        def save(done_fd):
+            done_fd.seek(0)
+            done_fd.write(bytes(done))
+            done_fd.flush()
+
+        fd.truncate(size)
+        with open(done_path, "wb") as done_fd, mmap.mmap(fd.fileno(), size) as data:
+            save(done_fd)
+            for block in range(self.memory_max):
+                if done[block]:
+                    continue
+
+                LOG.debug("reading block %d", block)
+                addr = block * 256
+                end = addr + 256
+                data[addr:end] = self._read_dump_block(block, retries, port_speed)
+
+                done[block] = True
+                save(done_fd)
+
+        os.unlink(done_path)
+
+    def _read_dump_block(self, block, retries, port_speed):
+        address = block * 256
+        data = self._read_block_with_retries(address, 0, retries)
+
+        offset = M_OFFSET_PORT_SPEED - address
+        if port_speed is not None and 0 <= offset < len(data):
+            data = bytearray(data)
+            data[offset] = PORT_SPEED.index(port_speed)
+
+        return data
+
+    def _read_block_with_retries(self, address, size, retries):
+        for attempt in range(retries + 1):
+            try:
+                return self.read_block(address, size)
+            except CommunicationError as err:
+                if attempt == retries:
+                    raise
+
+                LOG.warning(
+                    "failed to read address 0x%04X (%s), retrying", address, err
+                )
+                self.drain_input()
+
+    @pm
+    def memory_restore(self, fd, force=False, differential=False, current=None):
+        """Read data from a file-like object and write it to the radio.
+
+        This command is similar to the behavior of the MCP-2A "Write
+        data to the receiver" command"; in particular, it initially
+        writes 0xFF to address 0 before proceeding to load the data
+        from the input file descriptor to the radio. This will cause
+        the radio to reset to defaults if the write operation is
+        interrupted.
+
+        If differential is True, compare each block with the data
+        already in the radio and only write the blocks that differ. The
+        current contents of the radio are read back block by block,
+        unless a trusted image of the radio memory is provided in
+        <current>. Returns the list of blocks that were written, or
+        None for a full restore."""
+
+        magiclen = len(self.memory_magic)
+
+        # Check that radio state seems sane
+        data = self.read_block(0, magiclen)
+        if data != self.memory_magic:
+            if force:
+                LOG.warning("Radio does not contain expected " "data (continuing)")
+            else:
+                raise ValueError("radio does not contain expected data")
+
+        # Check that input data seems sane
+        data = fd.read(magiclen)
+        if data != self.memory_magic:
+            if force:
+                LOG.warning("Input does not contain expected " "data (continuing)")
+            else:
+                raise ValueError("input does not contain expected data")
+
+        if differential:
+            return self._memory_restore_differential(fd, current)
+
+        self.write_block(0, b"\xff")
+
+        fd.seek(magiclen)
+        self.write_block(magiclen, fd.read(256 - magiclen))
+
+        for block in range(1, self.memory_max):
+            addr = block * 256
+            LOG.debug("writing block %d", block)
+            data = fd.read(256)
+            if not data:
+                raise EOFError("Ran out of data in memory_restore")
+            self.write_block(addr, data)
 
         self.write_block(0, self.memory_magic)
 
+    def _memory_restore_differential(self, fd, current=None):
+        magiclen = len(self.memory_magic)
+
+        fd.seek(0)
+        data = fd.read(self.memory_max * 256)
+        if len(data) < self.memory_max * 256:
+            raise EOFError("Ran out of data in memory_restore")
+
+        if current is not None and len(current) < self.memory_max * 256:
+            raise ValueError("current memory image is too short")
+
+        changed = []
+        for block in range(self.memory_max):
+            # The magic bytes at the start of block 0 are always
+            # rewritten at the end of the restore.
+            addr = block * 256 if block else magiclen
+            end = (block + 1) * 256
+
+            if current is not None:
+                old = current[addr:end]
+            else:
+                LOG.debug("reading block %d", block)
+                old = self.read_block(addr, (end - addr) % 256)
+
+            if old != data[addr:end]:
+                changed.append(block)
+
+        if not changed:
+            LOG.info("radio memory is already up to date")
+            return changed
+
+        self.write_block(0, b"\xff")
+
+        for block in changed:
+            addr = block * 256 if block else magiclen
+            end = (block + 1) * 256
+            LOG.debug("writing block %d", block)
+            self.write_block(addr, data[addr:end])
+
+        self.write_block(0, self.memory_magic)
+
+        return changed
+
     # ----------------------------------------------------------------------
 
-    def import_channels(self, fd, selected=None, ignore_errors=False, sync=False):
+    def import_channels(
+        self,
+        fd,
+        selected=None,
+        ignore_errors=False,
+        sync=False,
+        window=None,
+        occupancy=None,
+    ):
         """Import channels from a CSV document.
 
         - fd: A file-like object
@@ -638,70 +1825,608 @@ class TMV71:
           trying to import subsequent channels
         - sync: delete channels in the radio that are not present
           in the input.
+        - window: number of commands to keep in flight (see
+          send_commands)
+        - occupancy: the channels that are in use (see
+          channel_occupancy). With sync, only these channels are
+          deleted.
         """
 
         selected = selected if selected else range(1000)
-        fields = schema.ME.export_fields
+        channelmap = read_channels_csv(fd)
 
-        reader = csv.DictReader(fd, fields)
-        channelmap = {}
-        for row in reader:
-            # skip the header row if we find one
-            if row["channel"] == "channel":
+        plan = []
+        for channel in selected:
+            if channel in channelmap:
+                plan.append((channel, "update", channelmap[channel]))
+            elif not sync:
                 continue
+            elif occupancy is not None and not occupancy[channel]:
+                LOG.debug("channel %d is already deleted", channel)
+                self.update_mirror(channel, None)
+            else:
+                plan.append((channel, "delete", None))
 
-            # a deleted channel has no rx_freq
-            if not row["rx_freq"]:
-                continue
+        self.apply_import(plan, ignore_errors=ignore_errors, window=window)
 
-            channelmap[int(row["channel"])] = row
+    def plan_import(
+        self, fd, selected=None, sync=False, window=None, occupancy=None, method=None
+    ):
+        """Compare a CSV document with the channels in the radio.
 
-        for channel in selected:
-            if channel not in channelmap:
-                if sync:
-                    LOG.info("deleting channel %d", channel)
-                    self.delete_channel_entry(channel)
-            else:
-                LOG.info("setting information for channel %d", channel)
-                try:
-                    self.set_channel_entry(channel, channelmap[channel])
-                except InvalidCommandError:
-                    if ignore_errors:
-                        LOG.warning("Unable to set channel %d", channel)
-                    else:
-                        raise
+        Returns a list of (channel, action, entry) tuples, where action
+        is one of "create", "update", "delete" or "unchanged" and entry
+        is the row from the CSV document (None for "delete"). Channels
+        that are deleted in both the radio and the document are not
+        included. Pass the result to apply_import.
+
+        The current channels are read with read_channels (see that
+        method for window, occupancy and method), and are compared
+        with the rows after normalizing both (see normalize_channel),
+        so "145.43" and "145.430" are the same frequency. Without sync,
+        only the channels in the document are read. The other arguments
+        are the same as for import_channels."""
+
+        selected = selected if selected else range(1000)
+        channelmap = read_channels_csv(fd)
+
+        channels = [c for c in selected if sync or c in channelmap]
+        if not channels:
+            return []
+
+        current = self.read_channels(
+            channels, window=window, occupancy=occupancy, method=method
+        )
+
+        plan = []
+        with closing(current):
+            for channel, entry in current:
+                row = channelmap.get(channel)
+                if row is None:
+                    if entry is not None and sync:
+                        plan.append((channel, "delete", None))
+                elif entry is None:
+                    plan.append((channel, "create", row))
+                elif channels_equal(channel, entry, row):
+                    plan.append((channel, "unchanged", row))
+                else:
+                    plan.append((channel, "update", row))
+
+        return plan
+
+    def apply_import(self, plan, ignore_errors=False, window=None):
+        """Carry out a plan from plan_import, sending commands only for
+        the channels that have changed.
+
+        See import_channels for ignore_errors and window."""
+
+        encoded = prefetch(self._encode_import(plan), self.prefetch_size)
+        in_flight = collections.deque()
+
+        def commands():
+            for channel, action, settings, frames in encoded:
+                if isinstance(frames, Exception):
+                    if not ignore_errors:
+                        raise frames
+                    LOG.warning("Unable to set channel %d: %s", channel, frames)
+                    if self.mirror is not None:
+                        self.mirror.forget(channel)
+                    continue
+
+                in_flight.append((channel, action, settings, len(frames)))
+                yield from frames
+
+        results = self.send_commands(commands(), window=window, return_exceptions=True)
+        responses = []
+        with closing(encoded), closing(results):
+            try:
+                for res in results:
+                    responses.append(res)
+                    channel, action, settings, count = in_flight[0]
+                    if len(responses) < count:
+                        continue
+
+                    in_flight.popleft()
+                    self._apply_import_result(
+                        channel, action, settings, responses, ignore_errors
+                    )
+                    responses = []
+            except BaseException:
+                # We don't know what happened to the channels that were
+                # still in flight
+                if self.mirror is not None:
+                    for channel, *_ in in_flight:
+                        self.mirror.forget(channel)
+                raise
+
+    def _encode_import(self, plan):
+        """Yield (channel, action, entry, commands) for the changes in an
+        import plan. If an entry cannot be encoded, commands is the
+        exception.
+
+        This runs in the prefetch thread of apply_import, so that the
+        rows are validated and encoded while we wait for the radio."""
+
+        for channel, action, settings in plan:
+            if action == "unchanged":
+                continue
 
-    def export_channels(self, fd, selected=None, skip_deleted=False):
+            if action == "delete":
+                yield channel, action, settings, channel_delete_commands(channel)
+                continue
+
+            try:
+                frames = channel_write_commands(channel, settings)
+            except (ValueError, TypeError, KeyError) as err:
+                frames = err
+
+            yield channel, action, settings, frames
+
+    def _apply_import_result(self, channel, action, settings, responses, ignore_errors):
+        if action == "delete":
+            LOG.info("deleting channel %d", channel)
+            if not isinstance(responses[0], UnknownCommandError):
+                self.update_mirror(channel, None)
+            return
+
+        LOG.info("setting information for channel %d", channel)
+        ok = True
+        for res in responses:
+            if isinstance(res, UnknownCommandError):
+                raise res
+            elif isinstance(res, InvalidCommandError):
+                ok = False
+                if ignore_errors:
+                    LOG.warning("Unable to set channel %d", channel)
+                else:
+                    raise res
+
+        if ok:
+            self.update_mirror(channel, settings)
+        elif self.mirror is not None:
+            self.mirror.forget(channel)
+
+    def export_channels(
+        self,
+        fd,
+        selected=None,
+        skip_deleted=False,
+        window=None,
+        occupancy=None,
+        method=None,
+        format="csv",
+    ):
         """Export channels to a CSV document
 
         - fd: A file-like object
         - selected: A list of channels to export. If this is None
           (or empty), try to export all channels.
         - skip_deleted: do not emit entries for deleted channels.
+        - window: number of commands to keep in flight (see
+          send_commands)
+        - occupancy: the channels that are in use (see
+          channel_occupancy). Only these channels are read from the
+          radio; the others are exported as deleted.
+        - method: how to read the channels (see read_channels)
+        - format: a key of CHANNEL_WRITERS ("csv" or "jsonl")
         """
 
-        selected = selected if selected else range(1000)
-        fields = schema.ME.export_fields
+        channels = self.iter_channels(
+            selected,
+            skip_deleted=skip_deleted,
+            window=window,
+            occupancy=occupancy,
+            method=method,
+        )
+        with closing(channels):
+            CHANNEL_WRITERS[format](fd, channels)
+
+    def iter_channels(
+        self,
+        selected=None,
+        skip_deleted=False,
+        window=None,
+        occupancy=None,
+        method=None,
+    ):
+        """Yield (channel, entry) for the selected channels (by default,
+        all channels) as they are read from the radio. The entry is an
+        ME entry, or None for a deleted channel unless skip_deleted is
+        True.
+
+        The generator is lazy: when reading with CAT commands, no more
+        than <window> commands are sent ahead of the channel you are
+        processing, so a slow consumer slows down the radio rather than
+        building up a backlog. Close the generator (or use
+        contextlib.closing) if you stop early.
+
+        See export_channels for the other arguments."""
+
+        channels = self.read_channels(
+            selected, window=window, occupancy=occupancy, method=method
+        )
+        with closing(channels):
+            for channel, entry in channels:
+                if entry is None and skip_deleted:
+                    continue
+                yield channel, entry
+
+    def plan_transfer(self, commands, blocks, window=None):
+        """Return "cat" if sending <commands> CAT commands is expected to
+        be faster than reading <blocks> blocks in programming mode,
+        otherwise "memory" (see TransferPlanner)"""
+
+        return TransferPlanner(self, window).choose(commands, blocks)
+
+    def read_channels(self, selected=None, window=None, occupancy=None, method=None):
+        """Yield (channel, entry) for the selected channels (by default,
+        all channels). The entry is None for deleted channels.
+
+        The channels are read with the ME and MN commands if method is
+        "cat", or from the channel tables in programming mode if method
+        is "memory". If method is None, plan_transfer picks whichever
+        should be faster, so small requests use CAT commands and large
+        ones use block reads.
+
+        See export_channels for the other arguments; occupancy is not
+        needed when reading from memory."""
+
+        selected = selected if selected else range(image.CHANNEL_COUNT)
+        blocks = image.region_blocks(
+            region for c in selected for region in image.channel_regions(c)
+        )
+
+        if method is None:
+            wanted = [c for c in selected if occupancy is None or occupancy[c]]
+            method = self.plan_transfer(2 * len(wanted), len(blocks), window)
 
-        writer = csv.DictWriter(fd, fields)
-        writer.writeheader()
+        if method == "cat":
+            yield from self._read_channels(selected, window=window, occupancy=occupancy)
+        elif method == "memory":
+            with self.programming_mode():
+                img = image.RadioImage.from_radio(self, blocks)
+            yield from image.iter_channels(img.data, selected)
+        else:
+            raise ValueError("unknown transfer method: {}".format(method))
+
+    def _read_channels(self, selected, window=None, occupancy=None):
+        """Yield (channel, entry) for the selected channels using the
+        ME and MN commands. The entry is None for deleted channels.
+
+        If occupancy is given, channels that are not in use are not
+        read from the radio."""
+
+        commands = []
         for channel in selected:
-            LOG.info("getting information for channel %d", channel)
+            if occupancy is not None and not occupancy[channel]:
+                continue
+            commands.extend(channel_commands(channel))
+
+        results = self.send_commands(commands, window=window, return_exceptions=True)
+        with closing(results):
+            for channel in selected:
+                if occupancy is not None and not occupancy[channel]:
+                    self.update_mirror(channel, None)
+                    yield channel, None
+                    continue
+
+                LOG.info("getting information for channel %d", channel)
+                entry = decode_channel(next(results), next(results))
+                if entry is None:
+                    LOG.debug("channel %d does not exist", channel)
+
+                self.update_mirror(channel, entry)
+                yield channel, entry
 
+    @pm
+    def import_channels_to_memory(
+        self, fd, selected=None, ignore_errors=False, sync=False
+    ):
+        """Import channels from a CSV document by writing them to memory.
+
+        This accepts the same arguments as import_channels, but rather
+        than sending ME and MN commands for each channel it encodes the
+        channels into the memory layout, reads the affected blocks,
+        and writes back only the blocks that have changed. Channels
+        written this way are not validated by the radio.
+
+        Returns the number of blocks written."""
+
+        selected = selected if selected else range(1000)
+        channelmap = read_channels_csv(fd)
+
+        channels = [c for c in selected if sync or c in channelmap]
+        blocks = image.region_blocks(
+            region for c in channels for region in image.channel_regions(c)
+        )
+        img = image.RadioImage.from_radio(self, blocks)
+
+        for channel in channels:
+            if channel not in channelmap:
+                LOG.info("deleting channel %d", channel)
+                img.delete_channel(channel)
+                continue
+
+            LOG.info("setting information for channel %d", channel)
             try:
-                channel_config = self.get_channel_entry(channel)
+                img.set_channel(channel, channelmap[channel])
+            except (ValueError, TypeError):
+                if ignore_errors:
+                    LOG.warning("Unable to set channel %d", channel)
+                else:
+                    raise
+
+        return len(img.commit(self))
+
+    @pm
+    def read_channel_image(self):
+        """Read the channel tables from radio memory.
+
+        Returns a memory image in which only the blocks that hold
+        channel records, extended flags and names have been read from
+        the radio; everything else is filled with 0xFF. Pass the result
+        to export_channels_from_image."""
+
+        return image.RadioImage.from_radio(self, image.CHANNEL_BLOCKS).data
+
+    @pm
+    def channel_occupancy(self):
+        """Return an image.Bitmap with a bit set for each channel that is
+        in use.
+
+        Only the blocks that hold the channel records are read, which
+        is much faster than asking for every channel with the ME
+        command when most channels are empty. Pass the result as the
+        occupancy argument of export_channels or import_channels to
+        skip the channels that are not in use."""
+
+        img = image.RadioImage.from_radio(self, image.CHANNEL_RECORD_BLOCKS)
+        return image.channel_occupancy(img.data)
+
+
+def prefetch(iterable, size):
+    """Iterate over <iterable> in a background thread, keeping up to
+    <size> items ready, and yield the items in order.
+
+    This lets CPU-bound work (such as encoding commands) run while the
+    consumer is blocked waiting for the radio. Exceptions raised by the
+    iterable are re-raised by the consumer, and closing the generator
+    stops the thread."""
+
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except BaseException as err:
+            put((done, err))
+        else:
+            put((done, None))
+
+    thread = threading.Thread(target=produce, name="tmv71-prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, err = items.get()
+            if item is done:
+                if err is not None:
+                    raise err
+                return
+
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def is_mappable(fd):
+    """Return True if fd is a regular file that can be memory mapped for
+    writing"""
+
+    try:
+        fd.fileno()
+    except (AttributeError, OSError):
+        return False
+
+    return isinstance(fd.name, str) and "+" in fd.mode
+
+
+def read_channels_csv(fd):
+    """Read channels from a CSV document.
+
+    Returns a dictionary that maps channel numbers to rows. Deleted
+    channels are not included."""
+
+    fields = schema.ME.export_fields
+
+    reader = csv.DictReader(fd, fields)
+    channelmap = {}
+    for row in reader:
+        # skip the header row if we find one
+        if row["channel"] == "channel":
+            continue
+
+        # a deleted channel has no rx_freq
+        if not row["rx_freq"]:
+            continue
+
+        channelmap[int(row["channel"])] = row
+
+    return channelmap
+
+
+def channel_commands(channel):
+    """Return the ME and MN commands that read a channel"""
+
+    channel = "{:03d}".format(channel)
+    return [("ME", channel), ("MN", channel)]
+
+
+def channel_write_commands(channel, settings):
+    """Return the ME and MN commands that write <settings> (an ME entry
+    or a row from read_channels_csv) to a channel"""
+
+    return [
+        ("ME", schema.ME_no_name.to_csv(settings)),
+        ("MN", "{:03d}".format(channel), settings["name"]),
+    ]
+
+
+def channel_delete_commands(channel):
+    """Return the commands that delete a channel"""
+
+    return [("ME", "{:03d}".format(channel), "")]
+
+
+def decode_channel(res, name):
+    """Convert the results of the channel_commands for a channel (as
+    returned by send_commands with return_exceptions=True) into an ME
+    entry, or None if the channel is deleted"""
+
+    if isinstance(res, InvalidCommandError):
+        return None
+
+    for err in (res, name):
+        if isinstance(err, Exception):
+            raise err
+
+    return schema.ME.from_tuple(res + [name[1]])
+
+
+def normalize_channel(channel, entry):
+    """Return a tuple describing a channel in the form the radio stores
+    it: frequencies in integer Hz, tones as indexes into the tone
+    tables, and the name. Only the tone selected by the admit field is
+    included, since that is the only one a CSV document describes.
+
+    <entry> may be an ME entry from the radio or a row from a CSV
+    document."""
+
+    fields = [name for name in schema.ME.declared_fields if name != "name"]
+    values = dict(zip(fields, schema.ME_no_name.to_tuple(dict(entry, channel=channel))))
 
-                # csv.DictWriter complains about unknown fields
-                channel_config = {k: channel_config[k] for k in fields}
+    for status, tone in (
+        ("tone_status", "tone_freq"),
+        ("ctcss_status", "ctcss_freq"),
+        ("dcs_status", "dcs_code"),
+    ):
+        if values[status] != "1":
+            del values[tone]
 
-                writer.writerow(channel_config)
-            except InvalidCommandError:
-                LOG.debug("channel %d does not exist", channel)
-                if not skip_deleted:
-                    writer.writerow({"channel": channel})
+    return tuple(sorted(values.items())) + (("name", entry.get("name") or ""),)
+
+
+def channels_equal(channel, a, b):
+    """Return True if two entries describe the same channel (see
+    normalize_channel). Entries that cannot be normalized are never
+    equal."""
+
+    try:
+        return normalize_channel(channel, a) == normalize_channel(channel, b)
+    except (ValueError, TypeError, KeyError):
+        return False
+
+
+def summarize_import(plan):
+    """Count the actions in a plan from TMV71.plan_import"""
+
+    summary = {"create": 0, "update": 0, "delete": 0, "unchanged": 0}
+    for _, action, _ in plan:
+        summary[action] += 1
+
+    return summary
+
+
+def write_channels_csv(fd, channels, skip_deleted=False):
+    """Write (channel, entry) pairs to a CSV document.
+
+    Deleted channels (those with an entry of None) are written as a
+    row containing only the channel number unless skip_deleted is
+    True."""
+
+    fields = schema.ME.export_fields
+
+    writer = csv.DictWriter(fd, fields)
+    writer.writeheader()
+    for channel, channel_config in channels:
+        if channel_config is None:
+            if not skip_deleted:
+                writer.writerow({"channel": channel})
+            continue
+
+        # csv.DictWriter complains about unknown fields
+        channel_config = {k: channel_config[k] for k in fields}
+
+        writer.writerow(channel_config)
+
+
+def write_channels_jsonl(fd, channels, skip_deleted=False):
+    """Write (channel, entry) pairs as JSON Lines: one JSON object per
+    channel, with the same fields as a CSV export.
+
+    Each line is written as soon as its channel arrives, so the output
+    can be processed before the export has finished."""
+
+    fields = schema.ME.export_fields
+
+    for channel, channel_config in channels:
+        if channel_config is None:
+            if skip_deleted:
+                continue
+            record = {"channel": channel}
+        else:
+            record = {k: channel_config[k] for k in fields}
+
+        fd.write(json.dumps(record) + "\n")
+
+
+# Functions that write (channel, entry) pairs to a file, by format
+CHANNEL_WRITERS = {
+    "csv": write_channels_csv,
+    "jsonl": write_channels_jsonl,
+}
+
+
+def export_channels_from_image(
+    fd, data, selected=None, skip_deleted=False, format="csv"
+):
+    """Export channels from a memory image to a CSV document
+
+    - fd: A file-like object
+    - data: A memory image, either from TMV71.read_channel_image or
+      from a memory dump
+    - selected: A list of channels to export. If this is None
+      (or empty), export all channels.
+    - skip_deleted: do not emit entries for deleted channels.
+    - format: a key of CHANNEL_WRITERS ("csv" or "jsonl")
+
+    This produces the same output as TMV71.export_channels without
+    sending any commands to the radio."""
+
+    CHANNEL_WRITERS[format](
+        fd, image.iter_channels(data, selected), skip_deleted=skip_deleted
+    )
 
 
 class TMD710(TMV71):
     expected_id = "TM-D710"
     memory_magic = struct.pack("BB", 0x0, 0x4D)
     memory_max = 0xFF
+
+
+# Radio classes by radio id
+MODELS = {cls.expected_id: cls for cls in (TMV71, TMD710)}
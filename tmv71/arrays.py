@@ -0,0 +1,193 @@
+"""NumPy views of the channel tables in a memory image.
+
+This module decodes the same channel, extended flag and name tables
+as memory.Memory, but instead of building an object for every channel
+it maps each table onto a NumPy structured array without copying the
+underlying data. Conversions (frequencies, steps, tones, DCS codes)
+are applied to whole columns at once, which makes it practical to
+analyse large numbers of memory dumps:
+
+    from tmv71.arrays import ChannelTable
+
+    table = ChannelTable.from_file('my_dump_file.bin')
+    print(table.rx_freq[table.occupied])
+
+This module requires NumPy (pip install tm-v71-tools[numpy]).
+"""
+
+import numpy as np
+
+from tmv71 import image
+from tmv71 import schema
+
+# The layout of the channel record (common_vfo_fields in memory.ksy)
+CHANNEL_DTYPE = np.dtype(
+    [
+        ("rx_freq_raw", "<u4"),
+        ("rx_step_raw", "u1"),
+        ("mod", "u1"),
+        ("flags", "u1"),
+        ("tone_frequency_raw", "u1"),
+        ("ctcss_frequency_raw", "u1"),
+        ("dcs_code_raw", "u1"),
+        ("tx_offset_raw", "<u4"),
+        ("tx_step_raw", "u1"),
+        ("padding", "u1"),
+    ]
+)
+
+# The layout of channel_extended_flags in memory.ksy
+CHANNEL_FLAGS_DTYPE = np.dtype([("band", "u1"), ("flags", "u1")])
+
+CHANNEL_NAME_DTYPE = np.dtype("S{}".format(image.CHANNEL_NAME_SIZE))
+
+
+def lookup_table(values):
+    """Build a 256 entry lookup table for a list of values.
+
+    Raw values that have no corresponding entry map to NaN."""
+
+    table = np.full(256, np.nan)
+    table[: len(values)] = values
+    return table
+
+
+STEP_SIZE = lookup_table(schema.STEP_SIZE)
+TONE_FREQUENCY = lookup_table(schema.TONE_FREQUENCY)
+DCS_CODE = lookup_table(schema.DCS_CODE)
+
+# Maps memory modulation values to indexes into schema.MODE
+MODE = np.full(256, -1)
+MODE[: len(image.MODULATION)] = [schema.MODE.index(m) for m in image.MODULATION]
+
+
+class ChannelTable:
+    """Vectorized access to the channel tables in a memory image.
+
+    The records, flags and names attributes are structured arrays
+    that share memory with the image passed to the constructor (which
+    may be a bytes object, a bytearray, an mmap, or anything else that
+    supports the buffer protocol). The remaining attributes are
+    computed from those arrays; values for deleted channels are NaN
+    (for floating point columns) or meaningless."""
+
+    def __init__(self, data):
+        if len(data) < image.CHANNEL_NAME_OFFSET + (
+            image.CHANNEL_NAME_SIZE * image.CHANNEL_COUNT
+        ):
+            raise ValueError("memory image is too short to contain channel data")
+
+        self.records = np.frombuffer(
+            data,
+            dtype=CHANNEL_DTYPE,
+            count=image.CHANNEL_COUNT,
+            offset=image.CHANNEL_OFFSET,
+        )
+        self.flags = np.frombuffer(
+            data,
+            dtype=CHANNEL_FLAGS_DTYPE,
+            count=image.CHANNEL_COUNT,
+            offset=image.CHANNEL_FLAGS_OFFSET,
+        )
+        self.names = np.frombuffer(
+            data,
+            dtype=CHANNEL_NAME_DTYPE,
+            count=image.CHANNEL_COUNT,
+            offset=image.CHANNEL_NAME_OFFSET,
+        )
+
+    @classmethod
+    def from_file(cls, path):
+        """Create a ChannelTable from a memory-mapped memory dump"""
+
+        return cls(np.memmap(path, dtype=np.uint8, mode="r"))
+
+    def __len__(self):
+        return image.CHANNEL_COUNT
+
+    @property
+    def deleted(self):
+        return self.records["rx_freq_raw"] == image.DELETED_FREQ
+
+    @property
+    def occupied(self):
+        return ~self.deleted
+
+    @property
+    def rx_freq(self):
+        """Receive frequency in MHz"""
+
+        return np.where(self.deleted, np.nan, self.records["rx_freq_raw"] / 1e6)
+
+    @property
+    def rx_step(self):
+        return STEP_SIZE[self.records["rx_step_raw"]]
+
+    @property
+    def tx_step(self):
+        raw = self.records["tx_step_raw"]
+        return STEP_SIZE[np.where(raw == 0xFF, 0, raw)]
+
+    @property
+    def admit(self):
+        """The admit bits (tone=4, ctcss=2, dcs=1)"""
+
+        return (self.records["flags"] >> 4) & 0x7
+
+    @property
+    def reverse(self):
+        return ((self.records["flags"] >> 3) & 0x1).astype(bool)
+
+    @property
+    def split(self):
+        return ((self.records["flags"] >> 2) & 0x1).astype(bool)
+
+    @property
+    def shift(self):
+        """Shift direction, as an index into schema.SHIFT_DIRECTION"""
+
+        return np.where(self.split, image.SHIFT_SPLIT, self.records["flags"] & 0x3)
+
+    @property
+    def tone_freq(self):
+        return TONE_FREQUENCY[self.records["tone_frequency_raw"]]
+
+    @property
+    def ctcss_freq(self):
+        return TONE_FREQUENCY[self.records["ctcss_frequency_raw"]]
+
+    @property
+    def dcs_code(self):
+        return DCS_CODE[self.records["dcs_code_raw"]]
+
+    @property
+    def offset(self):
+        """Transmit offset in MHz (0 for split channels)"""
+
+        offset = np.where(self.split, 0, self.records["tx_offset_raw"]) / 1e6
+        return np.where(self.deleted, np.nan, offset)
+
+    @property
+    def tx_freq(self):
+        """Transmit frequency in MHz for split channels (0 otherwise)"""
+
+        tx_freq = np.where(self.split, self.records["tx_offset_raw"], 0) / 1e6
+        return np.where(self.deleted, np.nan, tx_freq)
+
+    @property
+    def mode(self):
+        """Modulation, as an index into schema.MODE"""
+
+        return MODE[self.records["mod"]]
+
+    @property
+    def lockout(self):
+        return (self.flags["flags"] & 0x1).astype(bool) & self.occupied
+
+    @property
+    def name(self):
+        """Channel names as an array of strings"""
+
+        raw = self.names.view(np.uint8).reshape(-1, image.CHANNEL_NAME_SIZE)
+        raw = np.where(raw == 0xFF, 0, raw).astype(np.uint8)
+        return np.char.decode(raw.view(CHANNEL_NAME_DTYPE).ravel(), "ascii")
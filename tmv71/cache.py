@@ -0,0 +1,82 @@
+"""Remember what we have learned about the radio between runs.
+
+Each cache is a small JSON document in CACHE_DIR ($XDG_CACHE_HOME/tmv71,
+or ~/.cache/tmv71). Caches only ever hold information that can be
+discovered again from the radio, so a missing or corrupt cache file is
+treated as empty.
+"""
+
+import json
+import logging
+import os
+import tempfile
+
+LOG = logging.getLogger(__name__)
+
+CACHE_DIR = os.path.join(
+    os.path.expanduser(os.environ.get("XDG_CACHE_HOME", "~/.cache")), "tmv71"
+)
+
+
+class JSONCache:
+    """A dictionary stored in the JSON document <name>.json in <directory>.
+
+    Changes are written to disk immediately."""
+
+    def __init__(self, name, directory=None):
+        self.path = os.path.join(directory or CACHE_DIR, "{}.json".format(name))
+        self._data = None
+
+    def __repr__(self):
+        return "<JSONCache {}>".format(self.path)
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self.load()
+
+        return self._data
+
+    def load(self):
+        try:
+            with open(self.path) as fd:
+                data = json.load(fd)
+        except (OSError, ValueError) as err:
+            if not isinstance(err, FileNotFoundError):
+                LOG.warning("ignoring cache %s: %s", self.path, err)
+            return {}
+
+        if not isinstance(data, dict):
+            LOG.warning("ignoring cache %s: not a JSON object", self.path)
+            return {}
+
+        return data
+
+    def save(self):
+        """Write the cache to disk, replacing the old file atomically"""
+
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as tmp:
+                json.dump(self.data, tmp, indent=2)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        if self.data.get(key) == value:
+            return
+
+        self.data[key] = value
+        self.save()
+
+    def delete(self, key):
+        if self.data.pop(key, None) is not None:
+            self.save()
@@ -1,4 +1,5 @@
 import click
+import contextlib
 import enum
 import functools
 import hexdump
@@ -12,6 +13,9 @@ import time
 
 from tmv71 import __version__
 from tmv71 import api
+from tmv71 import cache
+from tmv71 import daemon
+from tmv71 import mirror
 from tmv71 import schema
 
 TMV71_CONFIG = os.path.expanduser(
@@ -127,29 +131,125 @@ def apply_options_from_schema(model, **kwargs):
     return _apply_options
 
 
-def clear_first(f):
+def clear_channel(ctx):
     """Clear the communication channel.
 
-    This decorator will use the TMV71.clear() method to attempt to put the
-    radio in a known state before running a command.  The top-level option
+    This will use the TMV71.resync() method to attempt to put the radio in
+    a known state before running a command.  The top-level option
     --no-clear (-K) will skip this step (or you can set TMV71_NO_CLEAR=1 in
     your environment), and --clear-retries (-R, or TMV71_CLEAR_RETRIES)
-    controls how many times it will retry before failing with an error."""
+    controls how many times it will retry before failing with an error.
+
+    If the radio does not answer at the current port speed, the other
+    port speeds are tried before falling back to clearing the channel
+    (see ApplicationContext.find_radio)."""
+
+    if not ctx.settings.no_clear:
+        LOG.info("clearing communication channel")
+        if ctx.find_radio():
+            return
+
+        for i in range(ctx.settings.clear_retries + 1):
+            try:
+                ctx.api.resync()
+            except api.CommunicationError:
+                LOG.info("no response from the radio (try %d)", i)
+                ctx.api.reopen()
+            else:
+                break
+        else:
+            raise click.ClickException("failed to communicate with the radio")
+
+
+def clear_first(f):
+    """Clear the communication channel before running a command.
+
+    See clear_channel for details."""
 
     @functools.wraps(f)
     def _(ctx, *args, **kwargs):
-        if not ctx.settings.no_clear:
-            LOG.info("clearing communication channel")
-            for i in range(ctx.settings.clear_retries + 1):
-                try:
-                    ctx.api.clear()
-                except api.CommunicationError:
-                    LOG.info("no response from the radio (try %d)", i)
-                    ctx.api.reopen()
-                else:
-                    break
-            else:
-                raise click.ClickException("failed to communicate with the radio")
+        clear_channel(ctx)
+        return f(ctx, *args, **kwargs)
+
+    return _
+
+
+def turbo_option(f):
+    """Add a --turbo option to a command that transfers a lot of data"""
+
+    return click.option(
+        "--turbo",
+        is_flag=True,
+        help="Switch the radio to 57600 bps for the transfer "
+        "(this will briefly reset the radio)",
+    )(f)
+
+
+def turbo_session(ctx, turbo):
+    """Return a context manager that runs the enclosed code at high
+    speed if turbo is True (see TMV71.turbo)"""
+
+    if turbo:
+        return ctx.api.turbo()
+
+    return contextlib.nullcontext()
+
+
+def probe_option(f):
+    """Add a --probe option to a command that works on many channels"""
+
+    return click.option(
+        "-p",
+        "--probe",
+        is_flag=True,
+        help="Read which channels are in use from memory first, and skip "
+        "the empty ones (this will briefly reset the radio)",
+    )(f)
+
+
+def method_option(f):
+    """Add a --method option to a command that reads many channels"""
+
+    return click.option(
+        "--method",
+        type=click.Choice(["auto", "cat", "memory"]),
+        help="Read channels with CAT commands (the default), or from memory "
+        "in programming mode (this will briefly reset the radio); with auto, "
+        "use whichever should be faster",
+    )(f)
+
+
+def transfer_method(method):
+    """Return the method argument for TMV71.read_channels for the value
+    of a --method option"""
+
+    if method is None:
+        return "cat"
+
+    return None if method == "auto" else method
+
+
+def channel_occupancy(ctx, probe):
+    """Return the channels that are in use (see TMV71.channel_occupancy)
+    if probe is True, otherwise None"""
+
+    if not probe:
+        return None
+
+    with ctx.api.programming_mode():
+        occupancy = ctx.api.channel_occupancy()
+
+    LOG.info("%d channels in use", occupancy.count())
+    return occupancy
+
+
+def mirrored(f):
+    """Keep the channel mirror up to date with the channels read and
+    written by a command (see ApplicationContext.open_mirror)"""
+
+    @functools.wraps(f)
+    def _(ctx, *args, **kwargs):
+        ctx.open_mirror()
         return f(ctx, *args, **kwargs)
 
     return _
@@ -159,8 +259,11 @@ class ApplicationSettings:
     no_clear = False
     clear_retries = 0
     port = "/dev/ttyS0"
-    speed = 9600
+    speed = None
     verbose = 0
+    socket = daemon.DEFAULT_SOCKET
+    no_daemon = False
+    no_cache = False
 
 
 SETTINGS = ApplicationSettings()
@@ -171,23 +274,143 @@ class ApplicationContext:
 
     def __init__(self, settings):
         self.settings = settings
-        self.init_api()
+        self._api = None
+        self.speeds = cache.JSONCache("speeds")
+        self.capabilities = cache.JSONCache("capabilities")
+        self._mirror = None
+
+    @property
+    def api(self):
+        """The radio api, which opens the serial port on first use"""
+
+        if self._api is None:
+            self.init_api()
+
+        return self._api
 
     def init_api(self):
-        self.api = api.TMV71(
+        if not self.settings.no_daemon:
+            self._api = daemon.connect(
+                self.settings.socket,
+                debug=(self.settings.verbose > 2),
+                port=self.settings.port,
+            )
+            if self._api is not None:
+                LOG.info("using daemon on %s", self.settings.socket)
+                return
+
+        self._api = self.open_radio()
+
+    def close(self):
+        if self._mirror is not None:
+            self._mirror.save()
+
+        if self._api is not None:
+            self._api.close()
+            self._api = None
+
+    def open_radio(self):
+        """Open the serial port, bypassing the daemon.
+
+        The port is opened at the configured speed. If no speed is
+        configured, it is opened at the last speed at which the radio
+        answered on this port, if we know it, and otherwise at 9600 bps.
+
+        If the capabilities cache knows which radio is on this port, the
+        api class for that model is used without asking the radio to
+        identify itself."""
+
+        speed = self.settings.speed
+        if speed is None and not self.settings.no_cache:
+            speed = self.speeds.get(self.settings.port)
+
+        model = api.TMV71
+        serial, caps = self.cached_capabilities()
+        if caps is not None:
+            model = api.MODELS.get(caps.get("id"), api.TMV71)
+            LOG.info("using cached capabilities for %s (%s)", serial, model.__name__)
+
+        return model(
             port=self.settings.port,
-            speed=self.settings.speed,
+            speed=speed or 9600,
             debug=(self.settings.verbose > 2),
         )
 
+    def find_radio(self):
+        """Make sure the radio is answering, changing the port speed if
+        necessary. Return True if the radio answered.
+
+        The daemon keeps track of the state of its own session, so this
+        does nothing (and returns False) when using the daemon."""
+
+        if isinstance(self.api, daemon.RemoteTMV71):
+            return False
+
+        if self.api.detect_speed() is None:
+            return False
+
+        self.remember_speed(self.api.speed)
+        return True
+
+    def remember_speed(self, speed):
+        """Record the speed at which the radio answers on this port"""
+
+        if not self.settings.no_cache:
+            self.speeds.set(self.settings.port, str(speed))
+
+    def open_mirror(self, offline=False):
+        """Return the channel mirror for the radio, or None if caching
+        is disabled.
+
+        The mirror is attached to the api so that it sees every channel
+        that we read or write, unless offline is True. The radio is only
+        asked for its serial number if there is no radio on this port in
+        the capabilities cache."""
+
+        if self.settings.no_cache:
+            return None
+
+        if self._mirror is None:
+            serial = self.cached_serial()
+            if serial is None:
+                caps = self.api.capabilities(cache=self.capabilities)
+                serial = caps["serial"]["serial"]
+
+            LOG.info("using channel mirror for %s", serial)
+            self._mirror = mirror.ChannelMirror.open(serial)
 
-def safe_main():
+        if not offline:
+            self.api.mirror = self._mirror
+
+        return self._mirror
+
+    def cached_serial(self):
+        """Return the serial number of the radio last seen on this
+        port according to the capabilities cache, or None"""
+
+        return self.cached_capabilities()[0]
+
+    def cached_capabilities(self):
+        """Return (serial, capabilities) for the radio last seen on this
+        port according to the capabilities cache, or (None, None)"""
+
+        if self.settings.no_cache:
+            return None, None
+
+        for serial, caps in self.capabilities.data.items():
+            if isinstance(caps, dict) and caps.get("port") == self.settings.port:
+                return serial, caps
+
+        return None, None
+
+
+def safe_main(args=None):
     """Wrap commands to catch and report expected exceptions"""
 
     res = 1
 
     try:
-        main()
+        main(args=args)
     except Exception as e:
         if SETTINGS.verbose > 1:
             raise
@@ -199,6 +422,12 @@ def safe_main():
     sys.exit(res)
 
 
+def safe_daemon_main():
+    """Entry point for tmv71d, which is the same as `tmv71 daemon`"""
+
+    safe_main(sys.argv[1:] + ["daemon"])
+
+
 @click.group(context_settings=dict(auto_envvar_prefix="TMV71"))
 @click.option(
     "-f",
@@ -227,6 +456,23 @@ def safe_main():
     type=int,
     help="Number of times to retry clear operation " "before failing",
 )
+@click.option(
+    "-S",
+    "--socket",
+    help="Path to the daemon socket",
+)
+@click.option(
+    "--no-daemon",
+    is_flag=True,
+    default=None,
+    help="Open the serial port even if the daemon is running",
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    default=None,
+    help="Do not remember the port speed and other radio details between runs",
+)
 @click.option(
     "-v",
     "--verbose",
@@ -262,6 +508,7 @@ def main(ctx, config_file, no_config, **kwargs):
     logging.basicConfig(level=loglevel)
 
     ctx.obj = ApplicationContext(SETTINGS)
+    ctx.call_on_close(ctx.obj.close)
 
 
 @main.command()
@@ -270,6 +517,24 @@ def version():
     print("{}".format(__version__))
 
 
+@main.command("daemon")
+@click.pass_obj
+def run_daemon(ctx):
+    """Keep the radio session open and serve requests.
+
+    This opens the serial port once and accepts requests from other
+    tmv71 commands over a Unix socket (--socket), so that they do not
+    have to open the port and clear the communication channel every
+    time they run. Other commands use the daemon automatically when it
+    is running and serving the same port, unless you pass --no-daemon."""
+
+    server = daemon.Daemon(ctx.open_radio(), ctx.settings.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        LOG.info("exiting")
+
+
 @main.command()
 @click.argument("message", default=None, required=False)
 @click.pass_obj
@@ -534,13 +799,19 @@ def port_speed(ctx, speed):
 
     Valid port speeds are 9600, 19200, 38400, and 57600."""
 
+    changed = False
     with ctx.api.programming_mode():
         if speed is None:
             LOG.info("getting port speed")
             speed = ctx.api.get_port_speed()
         else:
-            LOG.info("setting port speed to %d bps", speed)
+            LOG.info("setting port speed to %s bps", speed)
             ctx.api.set_port_speed(speed)
+            changed = True
+
+    if changed:
+        ctx.api.set_speed(speed)
+        ctx.remember_speed(speed)
 
     print(speed)
 
@@ -654,12 +925,21 @@ def channel_tune(ctx, band, channel):
 @channel.command()
 @apply_options_from_schema(schema.ME)
 @click.option("-n", "--name")
+@click.option(
+    "--verify",
+    is_flag=True,
+    help="Read the channel back from the radio after changing it",
+)
 @click.argument("channel", type=int)
 @formatted
 @click.pass_obj
 @clear_first
-def entry(ctx, channel, name, **kwargs):
-    """View or edit memory channels."""
+@mirrored
+def entry(ctx, channel, name, verify, **kwargs):
+    """View or edit memory channels.
+
+    After a change, the new settings are shown without reading the
+    channel again, unless --verify is given."""
 
     res = ctx.api.get_channel_entry(channel)
 
@@ -671,14 +951,17 @@ def entry(ctx, channel, name, **kwargs):
         set_radio = True
         res[k] = v
 
-    if name is not None:
+    if name is not None and not set_radio:
         LOG.info("setting name for channel %s", channel)
-        ctx.api.set_channel_name(channel, name)
+        res["name"] = ctx.api.set_channel_name(channel, name)
+    elif name is not None:
+        res["name"] = name
 
     if set_radio:
         LOG.info("configuring channel %s", channel)
+        if verify:
+            ctx.api.verify_policy = "always"
         res = ctx.api.set_channel_entry(channel, res)
-        res = ctx.api.get_channel_entry(channel)
 
     return res
 
@@ -694,15 +977,74 @@ def entry(ctx, channel, name, **kwargs):
 @click.option(
     "-s", "--skip-deleted", is_flag=True, help="Do not export deleted channels"
 )
+@click.option(
+    "-d",
+    "--dump",
+    type=click.File("rb"),
+    help="Read channels from a memory dump instead of the radio",
+)
+@click.option(
+    "-f",
+    "--format",
+    "export_format",
+    type=click.Choice(sorted(api.CHANNEL_WRITERS)),
+    default="csv",
+    help="Write a CSV document, or one JSON object per line",
+)
+@method_option
+@probe_option
+@turbo_option
 @click.pass_obj
-@clear_first
-def export_channels(ctx, output, channels, skip_deleted):
-    """Export channels to a CSV document"""
+def export_channels(
+    ctx,
+    output,
+    channels,
+    skip_deleted,
+    dump,
+    export_format,
+    method,
+    probe,
+    turbo,
+):
+    """Export channels to a CSV document (or JSON Lines, with --format)
+
+    Channels are read with CAT commands unless --method is given. With
+    --method auto, small exports use CAT commands and large ones read
+    the channel tables from memory, which will briefly reset the
+    radio."""
 
     selected = resolve_range(channels)
 
-    with output:
-        ctx.api.export_channels(output, selected=selected, skip_deleted=skip_deleted)
+    if dump:
+        if probe or turbo or method is not None:
+            raise click.UsageError(
+                "--dump cannot be used with --probe, --turbo or --method"
+            )
+
+        with dump:
+            data = dump.read()
+
+        with output:
+            api.export_channels_from_image(
+                output,
+                data,
+                selected=selected,
+                skip_deleted=skip_deleted,
+                format=export_format,
+            )
+        return
+
+    clear_channel(ctx)
+    ctx.open_mirror()
+    with output, turbo_session(ctx, turbo):
+        ctx.api.export_channels(
+            output,
+            selected=selected,
+            skip_deleted=skip_deleted,
+            occupancy=channel_occupancy(ctx, probe),
+            method=transfer_method(method),
+            format=export_format,
+        )
 
 
 @channel.command("import")
@@ -726,15 +1068,98 @@ def export_channels(ctx, output, channels, skip_deleted):
     is_flag=True,
     help="Continue to import channels if there is an error",
 )
+@click.option(
+    "-m",
+    "--to-memory",
+    is_flag=True,
+    help="Write the channel tables directly to memory in programming mode "
+    "(this will briefly reset the radio)",
+)
+@click.option(
+    "-D",
+    "--diff",
+    is_flag=True,
+    help="Read the channels from the radio first, and only write the ones "
+    "that have changed",
+)
+@click.option(
+    "-n",
+    "--dry-run",
+    is_flag=True,
+    help="Show what would change without writing anything (implies --diff)",
+)
+@method_option
+@probe_option
+@turbo_option
 @click.pass_obj
 @clear_first
-def import_channels(ctx, input, sync, channels, ignore_errors):
-    """Import channels from a CSV document"""
+@mirrored
+def import_channels(
+    ctx,
+    input,
+    sync,
+    channels,
+    ignore_errors,
+    to_memory,
+    diff,
+    dry_run,
+    method,
+    probe,
+    turbo,
+):
+    """Import channels from a CSV document
+
+    With --sync and --probe, only the channels that are in use are
+    deleted.
+
+    With --diff, the channels are compared with the radio (reading them
+    as selected by --method, see channel export), and only the channels
+    that need to be created, updated or deleted are written. Add
+    --dry-run to print the changes instead of making them."""
 
     selected = resolve_range(channels)
-
-    with input:
-        ctx.api.import_channels(input, selected=selected, ignore_errors=ignore_errors)
+    diff = diff or dry_run
+    if diff and to_memory:
+        raise click.UsageError("--diff cannot be used with --to-memory")
+    if method is not None and not diff:
+        raise click.UsageError("--method requires --diff or --dry-run")
+
+    with input, turbo_session(ctx, turbo):
+        if to_memory:
+            with ctx.api.programming_mode():
+                written = ctx.api.import_channels_to_memory(
+                    input, selected=selected, ignore_errors=ignore_errors, sync=sync
+                )
+            LOG.info("wrote %d blocks", written)
+        elif diff:
+            plan = ctx.api.plan_import(
+                input,
+                selected=selected,
+                sync=sync,
+                occupancy=channel_occupancy(ctx, probe),
+                method=transfer_method(method),
+            )
+            summary = api.summarize_import(plan)
+            if dry_run:
+                for channel, action, row in plan:
+                    if action != "unchanged":
+                        name = row["name"] if row else ""
+                        print("{} {:03d} {}".format(action, channel, name).rstrip())
+                print(
+                    "{create} to create, {update} to update, {delete} to delete, "
+                    "{unchanged} unchanged".format(**summary)
+                )
+            else:
+                LOG.info("import plan: %s", summary)
+                ctx.api.apply_import(plan, ignore_errors=ignore_errors)
+        else:
+            ctx.api.import_channels(
+                input,
+                selected=selected,
+                ignore_errors=ignore_errors,
+                sync=sync,
+                occupancy=channel_occupancy(ctx, probe and sync),
+            )
 
 
 @channel.command("delete")
@@ -744,18 +1169,104 @@ def import_channels(ctx, input, sync, channels, ignore_errors):
     multiple=True,
     help="Specify a single chanel (-c 1) or " "a range of channels (-c 1:10)",
 )
+@probe_option
 @click.pass_obj
 @clear_first
-def delete_channels(ctx, channels):
+@mirrored
+def delete_channels(ctx, channels, probe):
     """Delete a channel or range of channels"""
 
     selected = resolve_range(channels)
 
+    occupancy = channel_occupancy(ctx, probe)
+    if occupancy is not None:
+        selected = [c for c in selected if occupancy[c]]
+
     for channel in selected:
         LOG.info("deleting channel %d", channel)
         ctx.api.delete_channel_entry(channel)
 
 
+@channel.group("mirror")
+def channel_mirror():
+    """Commands for the local copy of the channel tables.
+
+    The mirror is kept up to date by the channel and memory commands
+    (unless --no-cache is given), and is stored per radio serial number
+    in the tmv71 cache directory."""
+    pass
+
+
+def require_mirror(ctx, offline=False):
+    res = ctx.open_mirror(offline=offline)
+    if res is None:
+        raise click.ClickException("the channel mirror is disabled by --no-cache")
+
+    return res
+
+
+@channel_mirror.command("refresh")
+@turbo_option
+@click.pass_obj
+@clear_first
+def mirror_refresh(ctx, turbo):
+    """Read all of the channel tables from the radio into the mirror.
+
+    This uses a single programming mode session (and will briefly
+    reset the radio)."""
+
+    channel_mirror = require_mirror(ctx)
+    with turbo_session(ctx, turbo):
+        channel_mirror.refresh(ctx.api)
+
+
+@channel_mirror.command("show")
+@click.argument("channel", type=int)
+@formatted
+@click.pass_obj
+def mirror_show(ctx, channel):
+    """Show a channel from the mirror without reading it from the radio.
+
+    The "updated" key is the time at which the channel was last read
+    from or written to the radio."""
+
+    channel_mirror = require_mirror(ctx, offline=True)
+    try:
+        res, updated = channel_mirror.get(channel)
+    except ValueError as err:
+        raise click.BadParameter(str(err))
+    except KeyError:
+        raise click.ClickException(
+            "channel {} is not in the mirror (see channel mirror refresh)".format(
+                channel
+            )
+        )
+
+    res = dict(res) if res is not None else {"channel": channel, "deleted": True}
+    res["updated"] = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(updated))
+    return res
+
+
+@channel_mirror.command("status")
+@formatted
+@click.pass_obj
+def mirror_status(ctx):
+    """Describe the mirror for this radio"""
+
+    channel_mirror = require_mirror(ctx, offline=True)
+    refreshed = channel_mirror.refreshed
+    return {
+        "serial": channel_mirror.serial,
+        "path": channel_mirror.path,
+        "known": channel_mirror.known(),
+        "refreshed": (
+            time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(refreshed))
+            if refreshed
+            else ""
+        ),
+    }
+
+
 # ----------------------------------------------------------------------
 
 
@@ -807,6 +1318,68 @@ def serial(ctx):
     return ctx.api.radio_serial()
 
 
+@info.command()
+@click.option(
+    "--samples",
+    "-n",
+    type=int,
+    default=5,
+    help="Number of ID commands to send before reporting",
+)
+@formatted
+@click.pass_obj
+@clear_first
+def latency(ctx, samples):
+    """Return the measured round-trip time of radio operations.
+
+    Sends a few ID commands to measure the CAT command latency, then
+    reports the estimate for each class of operation (times are in
+    seconds)."""
+
+    for _ in range(samples):
+        ctx.api.radio_id()
+
+    return {
+        "{}_{}".format(name, key): value
+        for name, estimate in ctx.api.latency().items()
+        for key, value in estimate.items()
+    }
+
+
+@info.command()
+@click.option(
+    "--refresh",
+    is_flag=True,
+    help="Ask the radio again instead of using the cached values",
+)
+@click.option("--forget", is_flag=True, help="Remove the radio from the cache")
+@formatted
+@click.pass_obj
+@clear_first
+def capabilities(ctx, refresh, forget):
+    """Return the radio model, memory size, firmware and type.
+
+    These are cached (keyed by the radio serial number), so after the
+    first run only the serial number is read from the radio."""
+
+    radio_cache = None if ctx.settings.no_cache else ctx.capabilities
+    if forget:
+        if radio_cache is not None:
+            ctx.api.forget_capabilities(radio_cache)
+        return {}
+
+    caps = ctx.api.capabilities(cache=radio_cache, refresh=refresh)
+
+    res = {}
+    for k, v in caps.items():
+        if isinstance(v, dict):
+            res.update(("{}_{}".format(k, sk), sv) for sk, sv in v.items())
+        else:
+            res[k] = v
+
+    return res
+
+
 # ----------------------------------------------------------------------
 
 
@@ -883,40 +1456,96 @@ def memory():
 
 
 @memory.command()
-@click.option("-o", "--output", type=click.File("wb"), default=sys.stdout.buffer)
+@click.option(
+    "-o", "--output", type=click.Path(dir_okay=False, allow_dash=True), default="-"
+)
+@click.option(
+    "-r",
+    "--resume",
+    is_flag=True,
+    help="Continue an interrupted dump, reading only missing blocks",
+)
+@click.option(
+    "--retries",
+    type=int,
+    default=0,
+    help="Number of times to retry a block that fails",
+)
+@turbo_option
 @click.pass_obj
 @clear_first
-def dump(ctx, output):
-    """Read entire radio memory and write it to a file."""
+def dump(ctx, output, resume, retries, turbo):
+    """Read entire radio memory and write it to a file.
 
-    LOG.info('read from radio to file "%s"', output.name)
-    try:
-        with output, ctx.api.programming_mode():
-            try:
-                ctx.api.memory_dump(output)
-            except api.CommunicationError as err:
-                raise click.ClickException(str(err))
-    except Exception:
-        if output is not sys.stdout.buffer:
-            LOG.warning("removing output file %s", output.name)
-            os.unlink(output.name)
-        raise
+    When writing to a file, the blocks that have been read are recorded
+    in <output>.blocks. If the dump fails, run the same command again
+    with --resume to read only the missing blocks."""
+
+    if output == "-":
+        if resume:
+            raise click.UsageError("--resume requires an output file")
+        fd = sys.stdout.buffer
+    else:
+        fd = open(output, "r+b" if resume and os.path.exists(output) else "w+b")
+
+    LOG.info('read from radio to file "%s"', output)
+    with fd:
+        try:
+            with turbo_session(ctx, turbo) as original, ctx.api.programming_mode():
+                ctx.api.memory_dump(
+                    fd, resume=resume, retries=retries, port_speed=original
+                )
+        except api.CommunicationError as err:
+            if fd is not sys.stdout.buffer:
+                LOG.warning("use --resume to continue the dump")
+            raise click.ClickException(str(err))
 
 
 @memory.command()
 @click.option("-i", "--input", type=click.File("rb"), default=sys.stdin)
+@click.option(
+    "-D",
+    "--diff",
+    "differential",
+    is_flag=True,
+    help="Only write blocks that differ from the current radio memory",
+)
+@click.option(
+    "-C",
+    "--current",
+    type=click.File("rb"),
+    help="A memory dump known to match the radio (implies --diff)",
+)
+@turbo_option
 @click.pass_obj
 @clear_first
-def restore(ctx, input):
-    """Read memory dump from a file and write it to the radio."""
+@mirrored
+def restore(ctx, input, differential, current, turbo):
+    """Read memory dump from a file and write it to the radio.
+
+    With --diff, each block is read back from the radio and only the
+    blocks that have changed are written. If you have a dump that is
+    known to match the current contents of the radio, pass it with
+    --current to skip reading from the radio."""
+
+    if current:
+        with current:
+            current = current.read()
+        differential = True
 
     LOG.info('write to radio from file "%s"', input.name)
-    with input, ctx.api.programming_mode():
+    with input:
         try:
-            ctx.api.memory_restore(input)
+            with turbo_session(ctx, turbo), ctx.api.programming_mode():
+                changed = ctx.api.memory_restore(
+                    input, differential=differential, current=current
+                )
         except api.CommunicationError as err:
             raise click.ClickException(str(err))
 
+    if differential:
+        LOG.info("wrote %d blocks", len(changed))
+
 
 def flexint(v):
     """Convert strings to integer values.
@@ -0,0 +1,416 @@
+"""Share a single radio session between many clients.
+
+Opening the serial port and clearing the communication channel takes
+longer than most radio commands, so a script that runs tmv71 many
+times spends most of its time on setup. The daemon opens the port
+once, keeps the TMV71 session warm, and accepts requests from clients
+over a Unix socket:
+
+    tmv71d -p /dev/ttyUSB0
+
+The CLI uses the daemon automatically when its socket exists, belongs
+to the current user and the daemon is serving the port the CLI would
+otherwise open (see the --socket and --no-daemon options).
+
+Clients use RemoteTMV71, which implements the low level TMV71
+primitives (send_command, send_commands, programming mode, read_block,
+write_block and drain_input) as requests to the daemon; everything
+else in the TMV71 API is built on those and works unchanged.
+
+Requests and responses are JSON documents, one per line. A request
+looks like:
+
+    {"method": "send_command", "args": ["ID"]}
+
+and the response is either {"result": ...} or {"error": {"type": ...,
+"args": [...]}}. Byte strings are encoded as {"__bytes__": <base64>}.
+The daemon serves one client at a time, so commands from different
+clients are never interleaved.
+"""
+
+import base64
+import json
+import logging
+import os
+import socket
+import socketserver
+import tempfile
+
+from tmv71 import api
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = os.path.join(
+    os.environ.get("XDG_RUNTIME_DIR", tempfile.gettempdir()),
+    "tmv71-{}.sock".format(os.getuid()),
+)
+
+# Exceptions that are re-raised in the client with their original type
+ERRORS = {
+    cls.__name__: cls
+    for cls in (
+        api.RadioError,
+        api.CommunicationError,
+        api.UnknownDeviceError,
+        api.UnknownCommandError,
+        api.InvalidCommandError,
+        api.UnexpectedResponseError,
+        api.ReadTimeoutError,
+        api.WrongModeError,
+        ValueError,
+        EOFError,
+    )
+}
+
+
+class DaemonError(api.RadioError):
+    pass
+
+
+def encode(value):
+    """Convert a value into something that can be serialized as JSON"""
+
+    if isinstance(value, (bytes, bytearray)):
+        return {"__bytes__": base64.b64encode(value).decode("ascii")}
+    elif isinstance(value, Exception):
+        return {"__error__": encode_error(value)}
+    elif isinstance(value, (list, tuple)):
+        return [encode(v) for v in value]
+    elif isinstance(value, dict):
+        return {k: encode(v) for k, v in value.items()}
+
+    return value
+
+
+def decode(value):
+    """Reverse the conversion performed by encode"""
+
+    if isinstance(value, dict):
+        if "__bytes__" in value:
+            return base64.b64decode(value["__bytes__"])
+        elif "__error__" in value:
+            return decode_error(value["__error__"])
+
+        return {k: decode(v) for k, v in value.items()}
+    elif isinstance(value, list):
+        return [decode(v) for v in value]
+
+    return value
+
+
+def encode_error(err):
+    name = type(err).__name__
+    if name not in ERRORS:
+        return {"type": "DaemonError", "args": [str(err)]}
+
+    return {"type": name, "args": encode(list(err.args))}
+
+
+def decode_error(spec):
+    cls = ERRORS.get(spec["type"], DaemonError)
+    return cls(*decode(spec["args"]))
+
+
+class Daemon:
+    """Serve requests for <radio> on the Unix socket at <path>"""
+
+    methods = [
+        "clear",
+        "reopen",
+        "drain_input",
+        "send_command",
+        "send_commands",
+        "enter_programming_mode",
+        "exit_programming_mode",
+        "read_block",
+        "write_block",
+        "latency",
+        "probe",
+        "set_speed",
+    ]
+
+    def __init__(self, radio, path=DEFAULT_SOCKET):
+        self.radio = radio
+        self.path = path
+        self.server = None
+
+        # Set when a command fails in a way that may have left the
+        # radio in an unknown state. The next clear request will only
+        # clear the communication channel if this is True.
+        self.needs_clear = True
+
+    def serve_forever(self):
+        if is_running(self.path):
+            raise DaemonError("daemon is already running on {}".format(self.path))
+
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                daemon.handle_connection(self.rfile, self.wfile)
+
+        # Create the socket with the right permissions, rather than
+        # changing them after it has been bound
+        umask = os.umask(0o177)
+        try:
+            self.server = socketserver.UnixStreamServer(self.path, Handler)
+        finally:
+            os.umask(umask)
+        LOG.info("listening on %s", self.path)
+
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            os.unlink(self.path)
+
+    def shutdown(self):
+        self.server.shutdown()
+
+    def handle_connection(self, rfile, wfile):
+        LOG.debug("client connected")
+        try:
+            for line in rfile:
+                response = self.handle_request(json.loads(line.decode("utf-8")))
+                wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+                wfile.flush()
+        finally:
+            LOG.debug("client disconnected")
+            if self.radio._programming_mode:
+                LOG.warning("client left the radio in programming mode")
+                try:
+                    self.radio.exit_programming_mode()
+                except api.RadioError:
+                    self.needs_clear = True
+
+    def handle_request(self, request):
+        method = request.get("method")
+        args = decode(request.get("args", []))
+        kwargs = decode(request.get("kwargs", {}))
+
+        LOG.debug("request: %s %s %s", method, args, kwargs)
+
+        try:
+            if method == "hello":
+                result = self.hello()
+            elif method == "clear":
+                result = self.clear()
+            elif method in self.methods:
+                result = getattr(self.radio, method)(*args, **kwargs)
+                if method == "send_commands":
+                    result = list(result)
+            else:
+                raise DaemonError("unknown method: {}".format(method))
+        except Exception as err:
+            LOG.info("%s failed: %s", method, err)
+            if isinstance(err, api.CommunicationError):
+                self.needs_clear = True
+            return {"error": encode_error(err)}
+
+        return {"result": encode(result)}
+
+    def hello(self):
+        return {
+            "port": self.radio.port,
+            "speed": self.radio.speed,
+            "expected_id": self.radio.expected_id,
+            "memory_max": self.radio.memory_max,
+            "memory_magic": self.radio.memory_magic,
+        }
+
+    def clear(self):
+        """Clear the communication channel, if required"""
+
+        if self.needs_clear:
+            self.radio.resync()
+            self.needs_clear = False
+
+
+class RemoteTMV71(api.TMV71):
+    """A TMV71 that sends commands to the radio via the daemon"""
+
+    def __init__(self, path=DEFAULT_SOCKET, debug=False, cache_results=False):
+        self.path = path
+        self.debug = debug
+        if cache_results:
+            self.results = api.ResultCache()
+        self._programming_mode = False
+        self._ptt = False
+
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(path)
+        self._rfile = self._sock.makefile("rb")
+
+        info = self.call("hello")
+        self.port = info["port"]
+        self.speed = info["speed"]
+        self.expected_id = info["expected_id"]
+        self.memory_max = info["memory_max"]
+        self.memory_magic = info["memory_magic"]
+
+    def __repr__(self):
+        return "<RemoteTMV71 on {0.port} @ {0.speed} via {0.path}>".format(self)
+
+    def close(self):
+        self._rfile.close()
+        self._sock.close()
+
+    def call(self, method, *args, **kwargs):
+        """Send a request to the daemon and return the result"""
+
+        request = {"method": method, "args": encode(args), "kwargs": encode(kwargs)}
+        self._sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+
+        line = self._rfile.readline()
+        if not line:
+            raise DaemonError("connection to daemon closed")
+
+        response = json.loads(line.decode("utf-8"))
+        if "error" in response:
+            raise decode_error(response["error"])
+
+        return decode(response["result"])
+
+    def reopen(self):
+        self.call("reopen")
+
+    def clear(self):
+        """Ask the daemon to clear the communication channel.
+
+        The daemon keeps track of whether the channel is in a known
+        state, and only clears it after an error."""
+
+        self.call("clear")
+
+    resync = clear
+
+    def drain_input(self):
+        self.call("drain_input")
+
+    def latency(self):
+        """Return the daemon's round-trip time estimates"""
+
+        return self.call("latency")
+
+    def probe(self):
+        return self.call("probe")
+
+    def set_speed(self, speed):
+        self.call("set_speed", speed)
+        self.speed = int(speed)
+
+    def _send_command(self, *command):
+        LOG.debug("sending command: %s", command)
+        return self.call("send_command", *command)
+
+    def send_commands(self, commands, window=None, return_exceptions=False):
+        """See TMV71.send_commands. The daemon sends all of the
+        commands before returning any results."""
+
+        commands = [list(command) for command in commands]
+        if self.results is not None:
+            for command in commands:
+                self.results.sending(command)
+
+        results = self.call(
+            "send_commands",
+            commands,
+            window=window,
+            return_exceptions=return_exceptions,
+        )
+
+        if self.results is not None:
+            for command, res in zip(commands, results):
+                if not isinstance(res, Exception):
+                    self.results.update(command, res)
+
+        yield from results
+
+    def enter_programming_mode(self):
+        LOG.debug("entering programming mode")
+        self.call("enter_programming_mode")
+        self._programming_mode = True
+
+    def exit_programming_mode(self):
+        LOG.debug("exiting programming mode")
+        self._programming_mode = False
+        self.call("exit_programming_mode")
+
+    @api.pm
+    def read_block(self, address, size):
+        """Read data from the radio"""
+
+        data = self.call("read_block", address, size)
+        if self.mirror is not None:
+            self.mirror.update_memory(address, data)
+        return data
+
+    @api.pm
+    def write_block(self, address, data):
+        """Write data to the radio"""
+
+        if self.results is not None:
+            self.results.invalidate()
+        res = self.call("write_block", address, bytes(data))
+        if self.mirror is not None:
+            self.mirror.update_memory(address, data)
+        return res
+
+
+def is_running(path=DEFAULT_SOCKET):
+    """Return True if a daemon is accepting connections on <path>"""
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+    return True
+
+
+def is_trusted(path=DEFAULT_SOCKET):
+    """Return True if the socket at <path> belongs to the current user"""
+
+    try:
+        return os.stat(path).st_uid == os.getuid()
+    except OSError:
+        return False
+
+
+def same_port(a, b):
+    """Return True if the serial ports <a> and <b> are the same device"""
+
+    return os.path.realpath(a) == os.path.realpath(b)
+
+
+def connect(path=DEFAULT_SOCKET, debug=False, port=None):
+    """Return a RemoteTMV71 if a daemon is running on <path>, otherwise
+    None.
+
+    Sockets that belong to another user are ignored, and if <port> is
+    given, so is a daemon that is serving a different serial port."""
+
+    if not os.path.exists(path):
+        return None
+
+    if not is_trusted(path):
+        LOG.warning("ignoring %s: not owned by the current user", path)
+        return None
+
+    try:
+        remote = RemoteTMV71(path, debug=debug)
+    except OSError:
+        return None
+
+    if port is not None and not same_port(remote.port, port):
+        LOG.info("ignoring daemon on %s: it is serving %s", path, remote.port)
+        remote.close()
+        return None
+
+    return remote
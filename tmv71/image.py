@@ -0,0 +1,614 @@
+"""Encode and decode channels using the radio memory layout.
+
+The layout of radio memory is described in memory.ksy. Channels are
+stored in three separate tables:
+
+- 16 byte channel records starting at 0x1700
+- 2 byte extended flags (band and lockout) starting at 0xE00
+- 8 byte names, padded with 0xFF, starting at 0x5800
+
+The functions in this module translate between those tables and the
+tuples used by the ME command, so that channels read from (or written
+to) memory go through the same schema as channels read over the CAT
+interface.
+"""
+
+import struct
+
+from tmv71 import schema
+
+BLOCK_SIZE = 256
+
+CHANNEL_COUNT = 1000
+CHANNEL_OFFSET = 0x1700
+CHANNEL_SIZE = 16
+CHANNEL_FLAGS_OFFSET = 0xE00
+CHANNEL_FLAGS_SIZE = 2
+CHANNEL_NAME_OFFSET = 0x5800
+CHANNEL_NAME_SIZE = 8
+
+CHANNEL_REGIONS = [
+    (CHANNEL_FLAGS_OFFSET, CHANNEL_FLAGS_SIZE * CHANNEL_COUNT),
+    (CHANNEL_OFFSET, CHANNEL_SIZE * CHANNEL_COUNT),
+    (CHANNEL_NAME_OFFSET, CHANNEL_NAME_SIZE * CHANNEL_COUNT),
+]
+
+CHANNEL_STRUCT = struct.Struct("<IBBBBBBIBB")
+
+DELETED_FREQ = 0xFFFFFFFF
+
+# Channel band values stored in the extended flags
+BAND_VHF = 5
+BAND_UHF = 8
+
+# Memory stores modulation as fm=0, am=1, nfm=2 (see the modulation
+# enum in memory.ksy), which is not the order used by the ME command.
+MODULATION = ["FM", "AM", "NFM"]
+
+ADMIT_TONE = 4
+ADMIT_CTCSS = 2
+ADMIT_DCS = 1
+
+SHIFT_SPLIT = schema.SHIFT_DIRECTION.index("SPLIT")
+
+
+def region_blocks(regions):
+    """Return the sorted list of block numbers that cover the given
+    (address, size) regions."""
+
+    blocks = set()
+    for address, size in regions:
+        blocks.update(
+            range(address // BLOCK_SIZE, (address + size - 1) // BLOCK_SIZE + 1)
+        )
+
+    return sorted(blocks)
+
+
+CHANNEL_BLOCKS = region_blocks(CHANNEL_REGIONS)
+
+# The blocks that hold only the channel records, which is enough to
+# tell which channels are in use (see channel_occupancy)
+CHANNEL_RECORD_BLOCKS = region_blocks([(CHANNEL_OFFSET, CHANNEL_SIZE * CHANNEL_COUNT)])
+
+
+def channel_offsets(number):
+    """Return the addresses of the record, flags, and name for a channel"""
+
+    if not 0 <= number < CHANNEL_COUNT:
+        raise ValueError("invalid channel number: {}".format(number))
+
+    return (
+        CHANNEL_OFFSET + number * CHANNEL_SIZE,
+        CHANNEL_FLAGS_OFFSET + number * CHANNEL_FLAGS_SIZE,
+        CHANNEL_NAME_OFFSET + number * CHANNEL_NAME_SIZE,
+    )
+
+
+def channel_regions(number):
+    """Return the (address, size) regions that hold a channel"""
+
+    return list(
+        zip(
+            channel_offsets(number),
+            (CHANNEL_SIZE, CHANNEL_FLAGS_SIZE, CHANNEL_NAME_SIZE),
+        )
+    )
+
+
+def decode_name(data):
+    """Decode a 0xFF padded name"""
+
+    return bytes(data).split(b"\xff", 1)[0].decode("ascii")
+
+
+def encode_name(name, size=CHANNEL_NAME_SIZE):
+    """Encode a name, padding it to <size> bytes with 0xFF"""
+
+    data = (name or "").encode("ascii")
+    if len(data) > size:
+        raise ValueError("name {!r} is longer than {} characters".format(name, size))
+
+    return data.ljust(size, b"\xff")
+
+
+def record_to_tuple(number, record, flags):
+    """Convert a channel record and its extended flags to an ME tuple.
+
+    Returns None if the channel is deleted."""
+
+    (
+        rx_freq,
+        rx_step,
+        mod,
+        chflags,
+        tone,
+        ctcss,
+        dcs,
+        offset,
+        tx_step,
+        _padding,
+    ) = CHANNEL_STRUCT.unpack(record)
+
+    if rx_freq == DELETED_FREQ:
+        return None
+
+    admit = (chflags >> 4) & 0x7
+    reverse = (chflags >> 3) & 0x1
+    split = (chflags >> 2) & 0x1
+    shift = chflags & 0x3
+    tx_freq = 0
+
+    # Split channels store the transmit frequency in place of the
+    # offset.
+    if split:
+        shift = SHIFT_SPLIT
+        tx_freq, offset = offset, 0
+
+    return [
+        "{:03d}".format(number),
+        "{:010d}".format(rx_freq),
+        str(rx_step),
+        str(shift),
+        str(reverse),
+        str(int(bool(admit & ADMIT_TONE))),
+        str(int(bool(admit & ADMIT_CTCSS))),
+        str(int(bool(admit & ADMIT_DCS))),
+        "{:02d}".format(tone),
+        "{:02d}".format(ctcss),
+        "{:03d}".format(dcs),
+        "{:08d}".format(offset),
+        str(schema.MODE.index(MODULATION[mod])),
+        "{:010d}".format(tx_freq),
+        str(0 if tx_step == 0xFF else tx_step),
+        str(flags[1] & 0x1),
+    ]
+
+
+def tuple_to_record(values, record=None, flags=None):
+    """Convert an ME tuple to a channel record and extended flags.
+
+    If the existing record and flags are provided, bits that we do
+    not understand are preserved."""
+
+    values = [int(v) for v in values[:16]]
+    (
+        _channel,
+        rx_freq,
+        rx_step,
+        shift,
+        reverse,
+        tone_status,
+        ctcss_status,
+        dcs_status,
+        tone,
+        ctcss,
+        dcs,
+        offset,
+        mode,
+        tx_freq,
+        tx_step,
+        lockout,
+    ) = values
+
+    padding = 0
+    unknown = 0
+    ext_unknown = 0
+    if record is not None and CHANNEL_STRUCT.unpack(record)[0] != DELETED_FREQ:
+        padding = record[15]
+        unknown = record[6] & 0x80
+        if flags is not None:
+            ext_unknown = flags[1] & 0xFE
+
+    split = 0
+    if shift == SHIFT_SPLIT:
+        split, shift, offset = 1, 0, tx_freq
+
+    admit = (
+        (ADMIT_TONE if tone_status else 0)
+        | (ADMIT_CTCSS if ctcss_status else 0)
+        | (ADMIT_DCS if dcs_status else 0)
+    )
+    chflags = unknown | admit << 4 | reverse << 3 | split << 2 | shift
+
+    record = CHANNEL_STRUCT.pack(
+        rx_freq,
+        rx_step,
+        MODULATION.index(schema.MODE[mode]),
+        chflags,
+        tone,
+        ctcss,
+        dcs,
+        offset,
+        tx_step,
+        padding,
+    )
+    band = BAND_VHF if rx_freq < 300000000 else BAND_UHF
+    flags = bytes([band, ext_unknown | lockout])
+
+    return record, flags
+
+
+def decode_channel(data, number):
+    """Return the ME entry for a channel in a memory image, or None
+    if the channel is deleted."""
+
+    rec_addr, flags_addr, name_addr = channel_offsets(number)
+    rec_end = rec_addr + CHANNEL_SIZE
+    flags_end = flags_addr + CHANNEL_FLAGS_SIZE
+    name_end = name_addr + CHANNEL_NAME_SIZE
+
+    values = record_to_tuple(number, data[rec_addr:rec_end], data[flags_addr:flags_end])
+    if values is None:
+        return None
+
+    values.append(decode_name(data[name_addr:name_end]))
+    return schema.ME.from_tuple(values)
+
+
+def encode_channel(data, number, entry):
+    """Store an ME entry for a channel in a memory image.
+
+    The entry is encoded with the ME schema, so it accepts the same
+    values as TMV71.set_channel_entry (including rows read from a CSV
+    export)."""
+
+    entry = dict(entry, channel=number)
+    values = schema.ME_no_name.to_tuple(entry)
+
+    rec_addr, flags_addr, name_addr = channel_offsets(number)
+    rec_end = rec_addr + CHANNEL_SIZE
+    flags_end = flags_addr + CHANNEL_FLAGS_SIZE
+    name_end = name_addr + CHANNEL_NAME_SIZE
+
+    record, flags = tuple_to_record(
+        values, data[rec_addr:rec_end], data[flags_addr:flags_end]
+    )
+    name = encode_name(entry.get("name"))
+
+    data[rec_addr:rec_end] = record
+    data[flags_addr:flags_end] = flags
+    data[name_addr:name_end] = name
+
+
+def erase_channel(data, number):
+    """Mark a channel as deleted in a memory image"""
+
+    for address, size in channel_regions(number):
+        end = address + size
+        data[address:end] = b"\xff" * size
+
+
+def iter_channels(data, selected=None):
+    """Yield (channel, entry) for channels in a memory image.
+
+    The entry is None for deleted channels."""
+
+    if len(data) < CHANNEL_NAME_OFFSET + CHANNEL_NAME_SIZE * CHANNEL_COUNT:
+        raise ValueError("memory image is too short to contain channel data")
+
+    for number in selected if selected else range(CHANNEL_COUNT):
+        yield number, decode_channel(data, number)
+
+
+def channel_occupancy(data):
+    """Return a Bitmap with a bit set for each channel that is in use in
+    a memory image. A channel is deleted if its rx frequency is
+    0xFFFFFFFF (see the deleted instance in memory.ksy), so only the
+    channel records need to have been read."""
+
+    occupancy = Bitmap(CHANNEL_COUNT)
+    for number in range(CHANNEL_COUNT):
+        rx_freq = struct.unpack_from("<I", data, CHANNEL_OFFSET + number * CHANNEL_SIZE)
+        occupancy[number] = rx_freq[0] != DELETED_FREQ
+
+    return occupancy
+
+
+class Bitmap:
+    """A fixed size bitmap backed by a bytearray"""
+
+    def __init__(self, size, data=None):
+        self.size = size
+        if data is None:
+            self.data = bytearray((size + 7) // 8)
+        else:
+            if len(data) != (size + 7) // 8:
+                raise ValueError("bitmap data does not match size {}".format(size))
+            self.data = bytearray(data)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, bit):
+        if not 0 <= bit < self.size:
+            raise IndexError(bit)
+
+        return bool(self.data[bit >> 3] & (1 << (bit & 7)))
+
+    def __setitem__(self, bit, value):
+        if not 0 <= bit < self.size:
+            raise IndexError(bit)
+
+        if value:
+            self.data[bit >> 3] |= 1 << (bit & 7)
+        else:
+            self.data[bit >> 3] &= ~(1 << (bit & 7)) & 0xFF
+
+    def __bytes__(self):
+        return bytes(self.data)
+
+    def __repr__(self):
+        return "<Bitmap {}/{}>".format(self.count(), self.size)
+
+    def set_bits(self):
+        """Return the list of bits that are set"""
+
+        return [bit for bit in range(self.size) if self[bit]]
+
+    def count(self):
+        return sum(bin(byte).count("1") for byte in self.data)
+
+    def fill(self, value=True):
+        self.data[:] = (b"\xff" if value else b"\x00") * len(self.data)
+        if value and self.size % 8:
+            self.data[-1] = (1 << (self.size % 8)) - 1
+
+    def all(self):
+        return self.count() == self.size
+
+
+# Offsets and encodings of the settings described by the misc_settings
+# and program_memory types in memory.ksy. Each entry is
+# (offset, size, type, padding), where type is "u1", "bytes" or "str".
+MISC_SETTINGS = {
+    "crossband_repeat": (0x10, 1, "u1", None),
+    "wireless_remote": (0x11, 1, "u1", None),
+    "remote_id": (0x12, 3, "bytes", None),
+    "current_pm_channel": (0x16, 1, "u1", None),
+    "key_lock": (0x17, 1, "u1", None),
+    "repeater_hold": (0x1E, 1, "u1", None),
+    "repeater_idtx": (0x1F, 1, "u1", None),
+    "pc_port_speed": (0x21, 1, "u1", None),
+    "repeater_id": (0x170, 6, "str", 0xFF),
+}
+
+PROGRAM_MEMORY_OFFSET = 0x200
+PROGRAM_MEMORY_SIZE = 0x200
+PROGRAM_MEMORY_COUNT = 6
+
+PROGRAM_MEMORY_SETTINGS = {
+    "current_menu_item": (0x2E, 1, "u1", None),
+    "ptt_band": (0x32, 1, "u1", None),
+    "ctrl_band": (0x33, 1, "u1", None),
+    "power_on_message": (0xE0, 12, "str", 0x00),
+    "group_link": (0xF0, 10, "str", 0xFF),
+    "beep": (0x150, 1, "u1", None),
+    "beep_volume": (0x151, 1, "u1", None),
+    "data_band": (0x175, 1, "u1", None),
+    "data_speed": (0x176, 1, "u1", None),
+}
+
+
+def encode_setting(spec, value):
+    """Encode a setting value according to a MISC_SETTINGS or
+    PROGRAM_MEMORY_SETTINGS entry"""
+
+    _offset, size, kind, padding = spec
+
+    if kind == "u1":
+        return bytes([int(value)])
+    elif kind == "str":
+        data = value.encode("ascii")
+        if len(data) > size:
+            raise ValueError("{!r} is longer than {} characters".format(value, size))
+        return data.ljust(size, bytes([padding]))
+    else:
+        data = bytes(value)
+        if len(data) != size:
+            raise ValueError("value must be exactly {} bytes".format(size))
+        return data
+
+
+def decode_setting(spec, data):
+    _offset, size, kind, padding = spec
+
+    if kind == "u1":
+        return data[0]
+    elif kind == "str":
+        return bytes(data).split(bytes([padding]), 1)[0].decode("ascii")
+    else:
+        return bytes(data)
+
+
+class RadioImage:
+    """A writable image of radio memory.
+
+    A RadioImage keeps a copy of radio memory in a bytearray and
+    records which 256 byte blocks have been modified. Changes are only
+    sent to the radio when you call commit(), which writes the modified
+    blocks in a single programming mode session:
+
+        img = RadioImage.from_radio(radio, blocks=image.CHANNEL_BLOCKS)
+        img.set_channel(5, entry)
+        img.set_lockout(6, True)
+        img.commit(radio)
+
+    An image read from only some blocks of the radio can only be
+    modified within those blocks.
+    """
+
+    def __init__(self, data, loaded=None):
+        if len(data) % BLOCK_SIZE:
+            raise ValueError("image size must be a multiple of {}".format(BLOCK_SIZE))
+
+        self.data = bytearray(data)
+        nblocks = len(self.data) // BLOCK_SIZE
+        self.dirty = Bitmap(nblocks)
+        self.loaded = Bitmap(nblocks)
+
+        if loaded is None:
+            self.loaded.fill()
+        else:
+            for block in loaded:
+                self.loaded[block] = True
+
+    def __repr__(self):
+        return "<RadioImage {} bytes, {} dirty blocks>".format(
+            len(self.data), self.dirty.count()
+        )
+
+    def __len__(self):
+        return len(self.data)
+
+    def __bytes__(self):
+        return bytes(self.data)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self.data))
+            if step != 1:
+                raise ValueError("extended slices are not supported")
+            if len(value) != stop - start:
+                raise ValueError("cannot change the size of a RadioImage")
+            self.write(start, value)
+        else:
+            self.write(key, bytes([value]))
+
+    @classmethod
+    def from_file(cls, path):
+        """Create an image from a memory dump"""
+
+        with open(path, "rb") as fd:
+            return cls(fd.read())
+
+    @classmethod
+    def from_radio(cls, radio, blocks=None):
+        """Read an image from the radio.
+
+        Only the given blocks (by default, all blocks) are read. This
+        enters programming mode unless the radio is already in
+        programming mode."""
+
+        blocks = range(radio.memory_max) if blocks is None else blocks
+        data = bytearray(b"\xff" * (radio.memory_max * BLOCK_SIZE))
+
+        with radio.programming_mode():
+            for block in blocks:
+                addr, end = block * BLOCK_SIZE, (block + 1) * BLOCK_SIZE
+                data[addr:end] = radio.read_block(addr, 0)
+
+        return cls(data, loaded=blocks)
+
+    def write(self, address, data):
+        """Write data to the image, marking modified blocks as dirty"""
+
+        end = address + len(data)
+        if address < 0 or end > len(self.data):
+            raise ValueError("write outside of image: 0x{:04X}".format(address))
+
+        for block in range(address // BLOCK_SIZE, (end - 1) // BLOCK_SIZE + 1):
+            if not self.loaded[block]:
+                raise ValueError("block {} has not been loaded".format(block))
+
+        for block in range(address // BLOCK_SIZE, (end - 1) // BLOCK_SIZE + 1):
+            lo = max(address, block * BLOCK_SIZE)
+            hi = min(end, (block + 1) * BLOCK_SIZE)
+            chunk_start, chunk_end = lo - address, hi - address
+            chunk = bytes(data[chunk_start:chunk_end])
+            if self.data[lo:hi] != chunk:
+                self.data[lo:hi] = chunk
+                self.dirty[block] = True
+
+    def dirty_blocks(self):
+        return self.dirty.set_bits()
+
+    def commit(self, radio):
+        """Write dirty blocks to the radio.
+
+        All dirty blocks are written in a single programming mode
+        session (unless the radio is already in programming mode).
+        Returns the list of blocks that were written."""
+
+        blocks = self.dirty_blocks()
+        if not blocks:
+            return blocks
+
+        with radio.programming_mode():
+            for block in blocks:
+                addr, end = block * BLOCK_SIZE, (block + 1) * BLOCK_SIZE
+                radio.write_block(addr, self.data[addr:end])
+                self.dirty[block] = False
+
+        return blocks
+
+    # Channels
+
+    def get_channel(self, number):
+        """Return the ME entry for a channel, or None if it is deleted"""
+
+        return decode_channel(self.data, number)
+
+    def set_channel(self, number, entry):
+        encode_channel(self, number, entry)
+
+    def delete_channel(self, number):
+        erase_channel(self, number)
+
+    def get_channel_name(self, number):
+        _rec_addr, _flags_addr, name_addr = channel_offsets(number)
+        name_end = name_addr + CHANNEL_NAME_SIZE
+        return decode_name(self.data[name_addr:name_end])
+
+    def set_channel_name(self, number, name):
+        _rec_addr, _flags_addr, name_addr = channel_offsets(number)
+        self.write(name_addr, encode_name(name))
+
+    def get_lockout(self, number):
+        _rec_addr, flags_addr, _name_addr = channel_offsets(number)
+        return bool(self.data[flags_addr + 1] & 0x1)
+
+    def set_lockout(self, number, lockout):
+        _rec_addr, flags_addr, _name_addr = channel_offsets(number)
+        flags = self.data[flags_addr + 1]
+        if flags == 0xFF:
+            raise ValueError("channel {} is deleted".format(number))
+
+        flags = (flags & 0xFE) | (1 if lockout else 0)
+        self.write(flags_addr + 1, bytes([flags]))
+
+    # Settings
+
+    def _get_setting(self, base, spec):
+        address = base + spec[0]
+        end = address + spec[1]
+        return decode_setting(spec, self.data[address:end])
+
+    def _set_setting(self, base, spec, value):
+        self.write(base + spec[0], encode_setting(spec, value))
+
+    def get_misc_setting(self, name):
+        return self._get_setting(0, MISC_SETTINGS[name])
+
+    def set_misc_setting(self, name, value):
+        self._set_setting(0, MISC_SETTINGS[name], value)
+
+    def _program_memory_base(self, index):
+        if not 0 <= index < PROGRAM_MEMORY_COUNT:
+            raise ValueError("invalid program memory: {}".format(index))
+
+        return PROGRAM_MEMORY_OFFSET + index * PROGRAM_MEMORY_SIZE
+
+    def get_program_memory(self, index, name):
+        """Get a setting from program memory <index> (0 is the
+        current settings, 1-5 are the PM channels)"""
+
+        base = self._program_memory_base(index)
+        return self._get_setting(base, PROGRAM_MEMORY_SETTINGS[name])
+
+    def set_program_memory(self, index, name, value):
+        base = self._program_memory_base(index)
+        self._set_setting(base, PROGRAM_MEMORY_SETTINGS[name], value)
@@ -0,0 +1,303 @@
+"""Lazy, memory-mapped access to a memory dump.
+
+memory.Memory decodes the channel tables eagerly: touching `channels`,
+`channel_names` or `channel_extended_flags` builds 1000 objects, and
+every `program_memory` entry copies its 512 bytes into a new BytesIO.
+MappedMemory is a drop-in replacement that maps the dump with mmap
+and decodes individual entries only when they are indexed, reading
+directly from memoryview slices of the mapped file:
+
+    from tmv71.mapped import MappedMemory
+
+    with MappedMemory.from_file('my_dump_file.bin') as data:
+        channel = data.channels[742]
+        print(channel.name, channel.common.rx_freq)
+
+Decoded entries are small __slots__ records that expose the same
+attributes as their memory.Memory counterparts, and are cached so
+that indexing the same entry twice does not decode it again.
+"""
+
+import collections.abc
+import io
+import mmap
+
+from kaitaistruct import KaitaiStream
+
+from tmv71 import image
+from tmv71 import memory
+
+
+class ViewIO(io.RawIOBase):
+    """A read-only, seekable file-like object over a memoryview.
+
+    Unlike io.BytesIO, this does not copy the underlying buffer."""
+
+    def __init__(self, view):
+        self._view = memoryview(view).cast("B")
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buf):
+        start = self._pos
+        end = min(start + len(buf), len(self._view))
+        size = max(end - start, 0)
+        buf[:size] = self._view[start:end]
+        self._pos += size
+        return size
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence == io.SEEK_END:
+            pos += len(self._view)
+
+        if pos < 0:
+            raise ValueError("negative seek position {}".format(pos))
+
+        self._pos = pos
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+        super().close()
+
+
+class LazySequence(collections.abc.Sequence):
+    """A fixed-length sequence that decodes entries on first access"""
+
+    __slots__ = ("_decode", "_entries")
+
+    def __init__(self, count, decode):
+        self._decode = decode
+        self._entries = [None] * count
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        entry = self._entries[index]
+        if entry is None:
+            if index < 0:
+                index += len(self)
+            entry = self._entries[index] = self._decode(index)
+
+        return entry
+
+    def cached(self):
+        """Return the entries that have been decoded so far"""
+
+        return [entry for entry in self._entries if entry is not None]
+
+
+class ChannelFlags:
+    __slots__ = ("unknown", "admit", "reverse", "split", "shift")
+
+    def __init__(self, value):
+        self.unknown = bool(value & 0x80)
+        self.admit = memory.Memory.Admit((value >> 4) & 0x7)
+        self.reverse = bool(value & 0x08)
+        self.split = bool(value & 0x04)
+        self.shift = memory.Memory.ShiftDirection(value & 0x03)
+
+
+class CommonVfoFields:
+    __slots__ = (
+        "rx_freq_raw",
+        "rx_step_raw",
+        "mod",
+        "flags",
+        "tone_frequency_raw",
+        "ctcss_frequency_raw",
+        "dcs_code_raw",
+        "tx_offset_raw",
+        "tx_step_raw",
+        "padding",
+    )
+
+    def __init__(self, view, offset):
+        (
+            self.rx_freq_raw,
+            self.rx_step_raw,
+            mod,
+            flags,
+            self.tone_frequency_raw,
+            self.ctcss_frequency_raw,
+            self.dcs_code_raw,
+            self.tx_offset_raw,
+            self.tx_step_raw,
+            self.padding,
+        ) = image.CHANNEL_STRUCT.unpack_from(view, offset)
+        self.mod = memory.Memory.Modulation(mod)
+        self.flags = ChannelFlags(flags)
+
+    @property
+    def deleted(self):
+        return True if self.rx_freq_raw == image.DELETED_FREQ else None
+
+    @property
+    def rx_freq(self):
+        return self.rx_freq_raw / 1000000.0
+
+    @property
+    def tx_offset(self):
+        return self.tx_offset_raw / 1000000.0
+
+    @property
+    def rx_step(self):
+        return TABLES.step_size[self.rx_step_raw]
+
+    @property
+    def tx_step(self):
+        return 0 if self.tx_step_raw == 255 else self.tx_step_raw
+
+    @property
+    def tone_freq(self):
+        return TABLES.tone_frequency[self.tone_frequency_raw]
+
+    @property
+    def ctcss_freq(self):
+        return TABLES.tone_frequency[self.ctcss_frequency_raw]
+
+    @property
+    def dcs_code(self):
+        return TABLES.dcs_code[self.dcs_code_raw]
+
+
+class ExtendedFlagBits:
+    __slots__ = ("unknown", "lockout")
+
+    def __init__(self, value):
+        self.unknown = value >> 1
+        self.lockout = bool(value & 0x01)
+
+
+class ChannelExtendedFlags:
+    __slots__ = ("band", "flags")
+
+    def __init__(self, view, offset):
+        self.band = view[offset]
+        self.flags = ExtendedFlagBits(view[offset + 1])
+
+
+class Channel:
+    """A single channel, decoded from the channel record table.
+
+    The name and extended flags live in separate tables and are only
+    decoded when accessed."""
+
+    __slots__ = ("number", "common", "_root")
+
+    def __init__(self, number, root):
+        self.number = number
+        self.common = CommonVfoFields(
+            root._view, image.CHANNEL_OFFSET + number * image.CHANNEL_SIZE
+        )
+        self._root = root
+
+    @property
+    def name(self):
+        return self._root.channel_names[self.number]
+
+    @property
+    def extended_flags(self):
+        return self._root.channel_extended_flags[self.number]
+
+
+class MappedMemory(memory.Memory):
+    """A memory.Memory that decodes entries lazily from a buffer.
+
+    `data` may be anything that supports the buffer protocol (bytes,
+    a bytearray, an mmap). Use from_file or from_io to map a dump
+    from disk."""
+
+    def __init__(self, data, _parent=None, _root=None):
+        self._view = memoryview(data).cast("B")
+        self._mmap = None
+        super().__init__(KaitaiStream(ViewIO(self._view)), _parent, _root)
+
+        self._m_channels = LazySequence(image.CHANNEL_COUNT, self._decode_channel)
+        self._m_channel_names = LazySequence(image.CHANNEL_COUNT, self._decode_name)
+        self._m_channel_extended_flags = LazySequence(
+            image.CHANNEL_COUNT, self._decode_extended_flags
+        )
+        self._m_program_memory = LazySequence(
+            image.PROGRAM_MEMORY_COUNT, self._decode_program_memory
+        )
+
+    @classmethod
+    def from_io(cls, fd):
+        """Map an open file"""
+
+        data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        obj = cls(data)
+        obj._mmap = data
+        return obj
+
+    @classmethod
+    def from_file(cls, path):
+        """Map the file at `path`"""
+
+        with open(path, "rb") as fd:
+            return cls.from_io(fd)
+
+    @classmethod
+    def from_bytes(cls, buf):
+        return cls(buf)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Release the underlying buffer (and unmap the file, if any).
+
+        Entries that have already been decoded remain usable, but
+        entries that have not been accessed yet can no longer be
+        decoded."""
+
+        for entry in self._m_program_memory.cached():
+            entry._io.close()
+
+        self._io.close()
+        self._view.release()
+
+        if self._mmap is not None:
+            self._mmap.close()
+
+    def _decode_channel(self, number):
+        return Channel(number, self)
+
+    def _decode_name(self, number):
+        start = image.CHANNEL_NAME_OFFSET + number * image.CHANNEL_NAME_SIZE
+        end = start + image.CHANNEL_NAME_SIZE
+        return image.decode_name(self._view[start:end])
+
+    def _decode_extended_flags(self, number):
+        return ChannelExtendedFlags(
+            self._view,
+            image.CHANNEL_FLAGS_OFFSET + number * image.CHANNEL_FLAGS_SIZE,
+        )
+
+    def _decode_program_memory(self, number):
+        start = image.PROGRAM_MEMORY_OFFSET + number * image.PROGRAM_MEMORY_SIZE
+        end = start + image.PROGRAM_MEMORY_SIZE
+        stream = KaitaiStream(ViewIO(self._view[start:end]))
+        return self.ProgramMemory(number, stream, self, self._root)
+
+
+TABLES = memory.Memory.Tables(None)
@@ -0,0 +1,259 @@
+"""A persistent local copy of a radio's channel tables.
+
+A ChannelMirror keeps the channel records, extended flags and names of
+one radio (identified by the serial number returned by the AE command)
+in a file, so that questions like "what is in channel 5" can be
+answered without talking to the radio.
+
+When a mirror is attached to a TMV71 (radio.mirror = mirror), it is
+updated write-through: channels set or deleted with the ME and MN
+commands, and any channel data read or written in programming mode,
+are copied into the mirror. refresh() reads all of the channel tables
+in a single programming mode session.
+
+Each channel has a timestamp recording when its contents were last
+seen on (or written to) the radio; channels that have never been seen
+have no timestamp, and the mirror does not answer questions about them.
+
+The file contains a header followed by the timestamps and the three
+channel tables in the same layout as radio memory, so a mirror file
+is about 30KB.
+"""
+
+import logging
+import os
+import struct
+import tempfile
+import time
+
+from tmv71 import cache
+from tmv71 import image
+
+LOG = logging.getLogger(__name__)
+
+MAGIC = b"TMV71MIR"
+HEADER = struct.Struct("<8sd")
+TIMESTAMPS = struct.Struct("<{}I".format(image.CHANNEL_COUNT))
+
+# The extent of radio memory that holds channel data
+IMAGE_SIZE = image.CHANNEL_NAME_OFFSET + image.CHANNEL_NAME_SIZE * image.CHANNEL_COUNT
+
+FILE_SIZE = (
+    HEADER.size + TIMESTAMPS.size + sum(size for _, size in image.CHANNEL_REGIONS)
+)
+
+# (address, size, item size) for each of the channel tables
+TABLES = [
+    (address, size, size // image.CHANNEL_COUNT)
+    for address, size in image.CHANNEL_REGIONS
+]
+
+
+class ChannelMirror:
+    """The channel tables of the radio with serial number <serial>,
+    stored in <directory>/<serial>.bin (by default, in the mirror
+    directory under tmv71.cache.CACHE_DIR)"""
+
+    def __init__(self, serial, directory=None):
+        directory = directory or os.path.join(cache.CACHE_DIR, "mirror")
+        self.serial = serial
+        self.path = os.path.join(directory, "{}.bin".format(serial))
+        self.data = bytearray(b"\xff" * IMAGE_SIZE)
+        self.updated = [0] * image.CHANNEL_COUNT
+        self.refreshed = None
+        self.dirty = False
+
+        # Channels for which some, but not all, of the tables have been
+        # seen by update_memory, mapped to the addresses of those tables
+        self._pending = {}
+
+    def __repr__(self):
+        return "<ChannelMirror {} ({} of {} channels known)>".format(
+            self.serial, self.known(), image.CHANNEL_COUNT
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.save()
+
+    @classmethod
+    def open(cls, serial, directory=None):
+        """Return the mirror for <serial>, loading it from disk if it
+        exists"""
+
+        mirror = cls(serial, directory)
+        if mirror.exists():
+            mirror.load()
+
+        return mirror
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        with open(self.path, "rb") as fd:
+            data = fd.read()
+
+        try:
+            magic, refreshed = HEADER.unpack_from(data)
+            if magic != MAGIC:
+                raise ValueError("bad magic")
+            updated = TIMESTAMPS.unpack_from(data, HEADER.size)
+            if len(data) != FILE_SIZE:
+                raise ValueError("wrong size")
+        except (struct.error, ValueError) as err:
+            LOG.warning("ignoring mirror %s: %s", self.path, err)
+            return
+
+        offset = HEADER.size + TIMESTAMPS.size
+        for address, size in image.CHANNEL_REGIONS:
+            start, end = offset, offset + size
+            region_end = address + size
+            self.data[address:region_end] = data[start:end]
+            offset = end
+
+        self.refreshed = refreshed or None
+        self.updated = list(updated)
+        self.dirty = False
+
+    def save(self):
+        """Write the mirror to disk if it has changed"""
+
+        if not self.dirty:
+            return
+
+        parts = [
+            HEADER.pack(MAGIC, self.refreshed or 0),
+            TIMESTAMPS.pack(*self.updated),
+        ]
+        for address, size in image.CHANNEL_REGIONS:
+            end = address + size
+            parts.append(bytes(self.data[address:end]))
+
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                tmp.write(b"".join(parts))
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        self.dirty = False
+
+    def known(self):
+        """Return the number of channels with a timestamp"""
+
+        return sum(1 for ts in self.updated if ts)
+
+    def get(self, number):
+        """Return (entry, timestamp) for a channel, where entry is None
+        if the channel is deleted.
+
+        Raises KeyError if the channel has never been seen."""
+
+        image.channel_offsets(number)
+        if not self.updated[number]:
+            raise KeyError(number)
+
+        return image.decode_channel(self.data, number), self.updated[number]
+
+    def iter_channels(self, selected=None):
+        """Yield (channel, entry, timestamp) for the known channels"""
+
+        for number in selected if selected else range(image.CHANNEL_COUNT):
+            if self.updated[number]:
+                entry, ts = self.get(number)
+                yield number, entry, ts
+
+    def _touch(self, numbers, now=None):
+        now = int(now or time.time())
+        for number in numbers:
+            self.updated[number] = now
+        self.dirty = True
+
+    def set(self, number, entry):
+        """Record the contents of a channel"""
+
+        image.encode_channel(self.data, number, entry)
+        self._touch([number])
+
+    def delete(self, number):
+        """Record that a channel has been deleted"""
+
+        image.erase_channel(self.data, number)
+        self._touch([number])
+
+    def set_name(self, number, name):
+        """Record the name of a channel"""
+
+        address = image.channel_offsets(number)[2]
+        end = address + image.CHANNEL_NAME_SIZE
+        self.data[address:end] = image.encode_name(name)
+        self.dirty = True
+
+    def forget(self, number=None):
+        """Forget a channel (by default, all channels), so that it will
+        not be answered from the mirror until it is seen again"""
+
+        numbers = range(image.CHANNEL_COUNT) if number is None else [number]
+        for number in numbers:
+            self.updated[number] = 0
+        self.dirty = True
+
+    def update_memory(self, address, data):
+        """Copy the parts of a block of radio memory at <address> that
+        hold channel data into the mirror.
+
+        A channel is only marked as updated once all three of its
+        tables have been seen since it was last marked; until then its
+        previous timestamp is kept, and a channel that has never been
+        seen stays unknown."""
+
+        end = address + len(data)
+        for table, size, item_size in TABLES:
+            lo = max(address, table)
+            hi = min(end, table + size)
+            if lo >= hi:
+                continue
+
+            chunk_start, chunk_end = lo - address, hi - address
+            self.data[lo:hi] = data[chunk_start:chunk_end]
+            self.dirty = True
+
+            first = (lo - table) // item_size
+            last = (hi - 1 - table) // item_size
+            for number in range(first, last + 1):
+                self._pending.setdefault(number, set()).add(table)
+
+        complete = [
+            number
+            for number, tables in self._pending.items()
+            if len(tables) == len(TABLES)
+        ]
+        for number in complete:
+            del self._pending[number]
+        if complete:
+            self._touch(complete)
+
+    def refresh(self, radio):
+        """Read all of the channel tables from the radio in a single
+        programming mode session (unless the radio is already in
+        programming mode)"""
+
+        LOG.info("refreshing channel mirror for %s", self.serial)
+        with radio.programming_mode():
+            data = radio.read_channel_image()
+
+        now = time.time()
+        for address, size in image.CHANNEL_REGIONS:
+            end = address + size
+            self.data[address:end] = data[address:end]
+
+        self._pending = {}
+        self._touch(range(image.CHANNEL_COUNT), now)
+        self.refreshed = now
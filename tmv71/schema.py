@@ -1,7 +1,12 @@
-from marshmallow import Schema, post_load, pre_dump, validate
+import logging
+
+from marshmallow import Schema, ValidationError, missing, post_load, pre_dump, validate
+from marshmallow.decorators import POST_LOAD, PRE_DUMP
 from marshmallow.fields import Field, String, Float, Boolean, Integer
 from marshmallow.validate import OneOf, Range
 
+LOG = logging.getLogger(__name__)
+
 BANDS = ["A", "B"]
 BAND_MODE = ["VFO", "MEM", "CALL", "WX"]
 TX_POWER = ["HIGH", "MED", "LOW"]
@@ -211,19 +216,237 @@ class SchemaDict(dict):
         return [(k, self[k]) for k in self.schema._declared_fields]
 
 
+class CodecError(Exception):
+    """Raised by a compiled codec when it cannot handle a value"""
+
+
+# The errors a codec raises for values it cannot convert, which are
+# handed to marshmallow to report (see RadioSchema.from_tuple)
+CODEC_ERRORS = (CodecError, ValidationError, ValueError, TypeError, IndexError)
+
+
+class Codec:
+    """A compiled tuple <-> dict converter for a RadioSchema.
+
+    Loading and dumping through marshmallow looks up and calls several
+    methods for every field of every value. A Codec resolves all of that
+    once: each field becomes a single conversion function, and Indexed
+    fields get a dictionary that maps values back to their index
+    instead of scanning the list of values.
+
+    A codec only handles values that marshmallow would accept. Anything
+    else (a missing required field, a value that fails validation)
+    raises one of CODEC_ERRORS, and RadioSchema.from_tuple/to_tuple fall
+    back to marshmallow, which reports the error exactly as it always
+    has.
+
+    The pre_dump and post_load hooks are run with marshmallow's own
+    (private) hook runners, which is why requirements.txt pins
+    marshmallow to the 3.x series."""
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.can_load = not schema.exclude and schema.only is None
+
+        self.load_fields = []
+        self.dump_fields = []
+        for name in schema.declared_fields:
+            if name not in schema.fields:
+                continue
+
+            field = schema.fields[name]
+            if field.attribute is not None or field.data_key is not None:
+                raise TypeError("cannot compile field {}".format(name))
+
+            load, dump = self.compile_field(field)
+            self.load_fields.append(
+                (name, load, field.validators, field.required, field.missing)
+            )
+            self.dump_fields.append((name, dump, field.default))
+
+    @staticmethod
+    def compile_field(field):
+        """Return (load, dump) functions equivalent to the field's
+        _deserialize and _serialize methods"""
+
+        if isinstance(field, Indexed):
+            values, fmt, base, type_ = (
+                field.values,
+                field.fmt,
+                field.int_base,
+                field.type,
+            )
+            reverse = {}
+            for i, value in enumerate(values):
+                reverse.setdefault(value, i)
+
+            def load(value):
+                res = values[int(value, base)]
+                return res if type_ is None else type_(res)
+
+            def dump(value):
+                if type_ is not None:
+                    value = type_(value)
+                try:
+                    return fmt.format(reverse[value])
+                except (KeyError, TypeError):
+                    return fmt.format(values.index(value))
+
+        elif isinstance(field, RadioFloat):
+            fmt = "{:0" + str(field.length) + "d}"
+
+            def load(value):
+                return int(value) / 1000000.0
+
+            def dump(value):
+                value = 0 if value is None else float(value)
+                return fmt.format(int(value * 1000000))
+
+        elif isinstance(field, RadioBoolean):
+            truthy, falsy = field.truthy, field.falsy
+
+            def load(value):
+                if value in truthy:
+                    return True
+                elif value in falsy:
+                    return False
+                raise CodecError(value)
+
+            def dump(value):
+                return "1" if value in truthy else "0"
+
+        elif isinstance(field, FormattedInteger):
+            fmt = field.fmt
+
+            def load(value):
+                if value is True or value is False:
+                    raise CodecError(value)
+                return int(value)
+
+            def dump(value):
+                return fmt.format(int(value))
+
+        elif type(field) is String:
+
+            def load(value):
+                if isinstance(value, bytes):
+                    return value.decode("utf-8")
+                elif not isinstance(value, str):
+                    raise CodecError(value)
+                return value
+
+            def dump(value):
+                if isinstance(value, bytes):
+                    return value.decode("utf-8")
+                return None if value is None else str(value)
+
+        else:
+            raise TypeError("cannot compile {}".format(type(field).__name__))
+
+        return load, dump
+
+    def load(self, values):
+        if not self.can_load:
+            raise CodecError("schema has excluded fields")
+
+        data = {}
+        for i, (name, load, validators, required, default) in enumerate(
+            self.load_fields
+        ):
+            if i >= len(values):
+                if required:
+                    raise CodecError("missing {}".format(name))
+                if default is not missing:
+                    data[name] = default() if callable(default) else default
+                continue
+
+            value = values[i]
+            if value is None:
+                raise CodecError("{} is None".format(name))
+
+            value = load(value)
+            for validator in validators:
+                if validator(value) is False:
+                    raise CodecError("{} failed validation".format(name))
+
+            data[name] = value
+
+        return self.schema._invoke_load_processors(
+            POST_LOAD, data, many=False, original_data=values, partial=None
+        )
+
+    def dump(self, obj):
+        if type(obj) not in (dict, SchemaDict):
+            raise CodecError("cannot dump {}".format(type(obj).__name__))
+
+        obj = self.schema._invoke_dump_processors(PRE_DUMP, obj, many=False)
+
+        res = []
+        for name, dump, default in self.dump_fields:
+            value = obj.get(name, missing)
+            if value is missing:
+                value = default() if callable(default) else default
+                if value is missing:
+                    continue
+
+            res.append(dump(value))
+
+        return res
+
+
 class RadioSchema(Schema):
+    # Set to True to convert values with a compiled Codec (see Codec)
+    compiled = False
+
+    @property
+    def codec(self):
+        """The compiled codec for this schema, or None if the schema is
+        not compiled or has fields that a Codec cannot handle"""
+
+        if not self.compiled:
+            return None
+
+        try:
+            return self._codec
+        except AttributeError:
+            pass
+
+        try:
+            self._codec = Codec(self)
+        except TypeError as err:
+            LOG.debug("not compiling %s: %s", type(self).__name__, err)
+            self._codec = None
+
+        return self._codec
+
     def from_tuple(self, values):
         """Read in values from a tuple
 
         Order of items in tuple must match order of declared fields
         for this schema."""
 
+        codec = self.codec
+        if codec is not None:
+            try:
+                return codec.load(values)
+            except CODEC_ERRORS as err:
+                LOG.debug(
+                    "%s codec cannot load %r: %r", type(self).__name__, values, err
+                )
+
         data = self.load(dict(zip(self.declared_fields, values)))
         return data
 
     def to_tuple(self, obj, **kwargs):
         """Convert object to a tuple"""
 
+        codec = self.codec
+        if codec is not None and not kwargs:
+            try:
+                return codec.dump(obj)
+            except CODEC_ERRORS as err:
+                LOG.debug("%s codec cannot dump %r: %r", type(self).__name__, obj, err)
+
         data = self.dump(obj, **kwargs)
         return [data[f] for f in self.declared_fields if f in data]
 
@@ -303,6 +526,8 @@ class FormattedInteger(Integer):
 
 
 class ME_Schema(RadioSchema):
+    compiled = True
+
     channel = FormattedInteger("{:03d}", required=True)
     rx_freq = RadioFloat(required=True)
     rx_step = Indexed(STEP_SIZE, required=True, type=float)
@@ -376,6 +601,8 @@ class ME_Schema(RadioSchema):
 
 
 class FO_Schema(RadioSchema):
+    compiled = True
+
     band = FormattedInteger(required=True, validate=Range(0, 1))
     rx_freq = RadioFloat(required=True)
     rx_step = Indexed(values=STEP_SIZE, required=True, type=float)
@@ -392,6 +619,8 @@ class FO_Schema(RadioSchema):
 
 
 class CC_Schema(RadioSchema):
+    compiled = True
+
     index = FormattedInteger(required=True)
     rx_freq = RadioFloat(required=True)
     rx_step = Indexed(values=STEP_SIZE, required=True, type=float)
@@ -437,6 +666,8 @@ class FV_Schema(RadioSchema):
 
 # 0,4,0,1,0,4,1,0,10,0,0,0,0,0,0,2,0,0,0,0,2,0,1,0,0,8,0,0,00,02,14,0D,0C,15,0,0,0,0,0,4,1,1
 class MU_Schema(RadioSchema):
+    compiled = True
+
     beep = RadioBoolean(required=True)
     beep_volume = FormattedInteger(validate=validate.Range(min=0, max=7), required=True)
     external_speaker_mode = FormattedInteger(
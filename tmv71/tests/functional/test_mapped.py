@@ -0,0 +1,73 @@
+import pytest
+
+from tmv71 import mapped
+from tmv71 import memory
+
+
+@pytest.fixture
+def initial(request):
+    data = mapped.MappedMemory.from_file("dumps/initial.bin")
+    try:
+        yield data
+    finally:
+        data.close()
+
+
+@pytest.fixture
+def reference(request):
+    with open("dumps/initial.bin", "rb") as fd:
+        yield memory.Memory.from_io(fd)
+
+
+def test_lazy_channel(initial):
+    initial.channels[742]
+    assert len(initial.channels.cached()) == 1
+    assert initial.channel_names.cached() == []
+    assert initial.channel_extended_flags.cached() == []
+
+
+def test_channel_cached(initial):
+    assert initial.channels[10] is initial.channels[10]
+    assert initial.channels[-1] is initial.channels[999]
+
+
+@pytest.mark.parametrize("number", range(0, 1000, 37))
+def test_channels_match(initial, reference, number):
+    channel = initial.channels[number]
+    expected = reference.channels[number]
+
+    assert channel.name == expected.name
+    assert channel.common.deleted == expected.common.deleted
+    for attr in mapped.CommonVfoFields.__slots__:
+        if attr != "flags":
+            assert getattr(channel.common, attr) == getattr(expected.common, attr)
+    for attr in mapped.ChannelFlags.__slots__:
+        assert getattr(channel.common.flags, attr) == getattr(
+            expected.common.flags, attr
+        )
+    assert channel.extended_flags.band == expected.extended_flags.band
+    assert channel.extended_flags.flags.lockout == expected.extended_flags.flags.lockout
+
+
+def test_channel_slice(initial):
+    assert [c.number for c in initial.channels[10:13]] == [10, 11, 12]
+    assert len(initial.channels) == 1000
+
+
+def test_pm_settings(initial):
+    assert initial.program_memory[0].power_on_message == "HELLO !!"
+    assert initial.program_memory[0].band_masks[1].mask == [1, 1, 1, 1, 1]
+    assert (
+        initial.program_memory[0].bands[1].freq_band == memory.Memory.FreqBand.band_430
+    )
+
+
+def test_misc_settings(initial):
+    assert initial.misc_settings.remote_id == b"000"
+
+
+def test_from_bytes():
+    with open("dumps/initial.bin", "rb") as fd:
+        data = mapped.MappedMemory.from_bytes(fd.read())
+
+    assert data.program_memory[0].vfo_settings[0].list[1].rx_freq == 144.0
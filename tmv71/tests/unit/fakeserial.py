@@ -39,6 +39,13 @@ class FakeSerialPort:
         self.tx.write(data)
         self.tx.seek(pos)
 
+    @property
+    def in_waiting(self):
+        if self._producer:
+            return 0
+
+        return len(self.tx.getbuffer()) - self.tx.tell()
+
     def read(self, size=1):
         if self._exc is not None:
             exc = self._exc
@@ -77,6 +84,10 @@ class FakeSerialPort:
     open = mock.Mock()
     close = mock.Mock()
 
+    # Data passed to stuff stands for responses that have not arrived
+    # yet, so there is nothing to discard
+    reset_input_buffer = mock.Mock()
+
 
 def FakeSerialPortFactory(name, *args, **kwargs):
     return FakeSerialPort.ports.get(name, FakeSerialPort(name, *args, **kwargs))
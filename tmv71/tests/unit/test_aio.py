@@ -0,0 +1,247 @@
+import asyncio
+import io
+import os
+import pytest
+import struct
+
+from tmv71 import aio
+from tmv71 import api
+from tmv71 import schema
+
+ME_CSV = "005,0145430000,0,1,1,0,1,0,23,23,000,00600000,0,0000000000,0,0,TEST"
+
+
+class FakeRadio:
+    """The radio end of a pseudo-terminal.
+
+    Opening the port discards pending input, so data passed to stuff
+    is held until flush is called."""
+
+    def __init__(self):
+        self.master, self.slave = os.openpty()
+        self.port = os.ttyname(self.slave)
+        self.pending = b""
+        os.set_blocking(self.master, False)
+
+    def stuff(self, data):
+        self.pending += data
+
+    def flush(self):
+        os.write(self.master, self.pending)
+        self.pending = b""
+
+    def rx(self):
+        data = b""
+        while True:
+            try:
+                data += os.read(self.master, 4096)
+            except BlockingIOError:
+                return data
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+
+@pytest.fixture
+def fake():
+    fake = FakeRadio()
+    yield fake
+    fake.close()
+
+
+def run(fake, func, **kwargs):
+    async def main():
+        async with aio.AsyncTMV71(fake.port, timeout=0.2, **kwargs) as radio:
+            fake.flush()
+            return await func(radio)
+
+    return asyncio.run(main())
+
+
+def test_radio_id(fake):
+    fake.stuff(b"ID TM-V71\r")
+    assert run(fake, lambda radio: radio.radio_id()) == "TM-V71"
+    assert fake.rx() == b"ID\r"
+
+
+def test_check_id_failure(fake):
+    fake.stuff(b"ID DUMMY\r")
+    with pytest.raises(api.UnknownDeviceError):
+        run(fake, lambda radio: radio.check_id())
+
+
+def test_bandcommand(fake):
+    fake.stuff(b"AS 0,1\r")
+    assert run(fake, lambda radio: radio.get_band_reverse(0)) == 1
+    assert fake.rx() == b"AS 0\r"
+
+
+def test_unknown_command(fake):
+    fake.stuff(b"?\r")
+    with pytest.raises(api.UnknownCommandError):
+        run(fake, lambda radio: radio.send_command("XX"))
+
+
+def test_read_timeout(fake):
+    with pytest.raises(api.ReadTimeoutError):
+        run(fake, lambda radio: radio.radio_id())
+
+
+def test_send_commands(fake):
+    fake.stuff(b"ID TM-V71\rN\rAE 12345,321\r")
+    res = run(
+        fake,
+        lambda radio: radio.send_commands(
+            [("ID",), ("ME", "000"), ("AE",)], return_exceptions=True
+        ),
+    )
+    assert res[0] == ["TM-V71"]
+    assert isinstance(res[1], api.InvalidCommandError)
+    assert res[2] == ["12345", "321"]
+    assert fake.rx() == b"ID\rME 000\rAE\r"
+
+
+def test_read_block_no_pm(fake):
+    with pytest.raises(api.WrongModeError):
+        run(fake, lambda radio: radio.read_block(0, 4))
+
+
+def test_memory_dump(fake, monkeypatch):
+    monkeypatch.setattr(aio.AsyncTMV71, "memory_max", 2)
+    buf = io.BytesIO()
+
+    fake.stuff(b"0M\r")
+    for block in range(2):
+        fake.stuff(b"W" + struct.pack(">HB", block * 256, 0))
+        fake.stuff(bytes([block]) * 256 + b"\x06")
+    fake.stuff(b"\x06\r\x00")
+
+    async def dump(radio):
+        async with radio.programming_mode():
+            await radio.memory_dump(buf)
+        assert not radio._programming_mode
+
+    run(fake, dump)
+    assert buf.getvalue() == b"\x00" * 256 + b"\x01" * 256
+    assert fake.rx() == b"0M PROGRAM\rR\x00\x00\x00\x06R\x01\x00\x00\x06E"
+
+
+def test_export_channels(fake):
+    expected = (
+        "channel,rx_freq,rx_step,shift,reverse,admit,tone,offset,"
+        "mode,tx_freq,tx_step,lockout,name\r\n"
+        "0,145.43,5.0,UP,True,C,146.2,0.6,FM,0.0,5.0,False,TEST\r\n"
+    )
+    fake.stuff(
+        b"ME 000,0145430000,0,1,1,0,1,0,23,"
+        b"23,000,00600000,0,0000000000,0,0\r"
+        b"MN 000,TEST\r"
+        b"N\rN\r"
+    )
+
+    buf = io.StringIO()
+    run(
+        fake,
+        lambda radio: radio.export_channels(buf, selected=[0, 1], skip_deleted=True),
+    )
+    assert buf.getvalue() == expected
+
+
+def test_import_channels(fake):
+    expected = (
+        b"ME 000,0145430000,0,1,1,0,1,0,0,23,000,00600000,"
+        b"0,0000000000,0,0\rMN 000,TEST\r"
+    )
+    buf = io.StringIO(
+        "channel,rx_freq,rx_step,shift,reverse,admit,tone,offset,"
+        "mode,tx_freq,tx_step,lockout,name\r\n"
+        "0,145.43,5.0,UP,True,C,146.2,0.6,FM,0.0,5.0,False,TEST\r\n"
+    )
+    fake.stuff(
+        b"ME 000,0145430000,0,1,1,0,1,0,23,"
+        b"23,000,00600000,0,0000000000,0,0\r"
+        b"MN 000,TEST\r"
+    )
+    run(fake, lambda radio: radio.import_channels(buf, selected=[0]))
+    assert fake.rx() == expected
+
+
+def test_concurrent_radios():
+    fakes = [FakeRadio() for _ in range(3)]
+
+    async def main():
+        radios = [aio.AsyncTMV71(fake.port, timeout=0.5) for fake in fakes]
+        pending = [asyncio.ensure_future(radio.radio_id()) for radio in radios]
+
+        # answer the radios in reverse order
+        await asyncio.sleep(0.05)
+        for i, fake in reversed(list(enumerate(fakes))):
+            fake.stuff("ID RADIO{}\r".format(i).encode("ascii"))
+            fake.flush()
+            await asyncio.sleep(0.01)
+
+        try:
+            return await asyncio.gather(*pending)
+        finally:
+            for radio in radios:
+                radio.close()
+
+    try:
+        assert asyncio.run(main()) == ["RADIO0", "RADIO1", "RADIO2"]
+    finally:
+        for fake in fakes:
+            fake.close()
+
+
+def test_shared_radio(fake):
+    fake.stuff(b"ID TM-V71\rAE 12345,321\r")
+
+    async def both(radio):
+        return await asyncio.gather(radio.radio_id(), radio.send_command("AE"))
+
+    assert run(fake, both) == ["TM-V71", ["12345", "321"]]
+    assert fake.rx() == b"ID\rAE\r"
+
+
+def test_set_channel_entry(fake):
+    entry = dict(schema.ME.from_csv(ME_CSV))
+    fake.stuff(b"ME\rMN 005,TEST\r")
+    res = run(fake, lambda radio: radio.set_channel_entry(5, dict(entry, channel=0)))
+    assert res == entry
+    assert fake.rx().startswith(b"ME 005,")
+
+
+def test_programming_mode_tasks(fake):
+    for block in range(2):
+        fake.stuff(b"0M\r")
+        fake.stuff(b"W" + struct.pack(">HB", block * 256, 0))
+        fake.stuff(bytes([block]) * 256 + b"\x06")
+        fake.stuff(b"\x06\r\x00")
+
+    async def dump(radio, block):
+        # the second task starts while the first is in programming mode
+        await asyncio.sleep(0.01 * block)
+        async with radio.programming_mode():
+            await asyncio.sleep(0.02)
+            return await radio.read_block(block * 256, 0)
+
+    async def both(radio):
+        return await asyncio.gather(dump(radio, 0), dump(radio, 1))
+
+    # the second session waits for the first to finish
+    assert run(fake, both) == [b"\x00" * 256, b"\x01" * 256]
+    assert fake.rx() == (
+        b"0M PROGRAM\rR\x00\x00\x00\x06E" b"0M PROGRAM\rR\x01\x00\x00\x06E"
+    )
+
+
+def test_read_block_other_task(fake):
+    fake.stuff(b"0M\r\x06\r\x00")
+
+    async def other(radio):
+        async with radio.programming_mode():
+            await asyncio.ensure_future(radio.read_block(0, 0))
+
+    with pytest.raises(api.WrongModeError):
+        run(fake, other)
@@ -1,9 +1,13 @@
 import io
+import itertools
 import pytest
 import struct
 from unittest import mock
 
 from tmv71 import api
+from tmv71 import cache
+from tmv71 import image
+from tmv71 import schema
 
 
 @pytest.fixture
@@ -24,6 +28,42 @@ def test_clear(radio, serial):
     radio.clear()
 
 
+def test_resync(radio, serial):
+    serial.stuff(b"?\rID TM-V71\r")
+    radio.resync()
+    assert serial.rx.getvalue() == b"\rID\r"
+    assert serial.reset_input_buffer.called
+
+
+def test_resync_partial_command(radio, serial):
+    serial.stuff(b"N\rID TM-V71\r")
+    assert radio.probe()
+
+
+def test_resync_stale_response(radio, serial):
+    serial.stuff(b"ID TM-V71\r")
+    assert not radio.probe()
+
+
+def test_resync_falls_back_to_clear(radio, serial):
+    def responses():
+        # no response to the probe, then the responses to clear()
+        yield b""
+        yield b""
+        yield b"?\r"
+
+    with serial.tx_from_iter(responses()):
+        radio.resync()
+
+    assert serial.rx.getvalue() == b"\rID\rE\r\r"
+
+
+def test_resync_programming_mode(radio, serial):
+    radio._programming_mode = True
+    assert not radio.probe()
+    assert serial.rx.getvalue() == b""
+
+
 def test_radio_id(radio, serial):
     serial.stuff(b"ID DUMMY\r")
     check = radio.radio_id()
@@ -119,6 +159,139 @@ def test_set_port_speed(radio, serial):
     assert serial.rx.getvalue().endswith(b"W\x00\x21\x01\x03E")
 
 
+def bytewise(*responses):
+    """Deliver responses one byte at a time, then time out. An empty
+    response is a read timeout.
+
+    Reading from the port a byte at a time keeps the receive buffer
+    from reading ahead into responses that the radio would not have
+    sent yet."""
+
+    for response in responses:
+        if not response:
+            yield b""
+        for c in response:
+            yield bytes([c])
+
+    while True:
+        yield b""
+
+
+# The responses to setting the port speed in programming mode
+SPEED_CHANGE = b"0M\r\x06\x06\r\x00"
+
+PROBE_RESPONSE = b"?\rID TM-V71\r"
+
+
+def test_turbo(radio, serial):
+    radio.set_speed(9600)
+    responses = bytewise(
+        SPEED_CHANGE,
+        PROBE_RESPONSE,
+        b"ID TM-V71\r",
+        PROBE_RESPONSE,
+        SPEED_CHANGE,
+        PROBE_RESPONSE,
+    )
+
+    with serial.tx_from_iter(responses):
+        with radio.turbo() as original:
+            assert original == "9600"
+            assert radio.speed == serial.baudrate == 57600
+            radio.radio_id()
+
+    assert radio.speed == serial.baudrate == 9600
+    assert serial.rx.getvalue().startswith(b"0M PROGRAM\rW\x00\x21\x01\x03E")
+    assert serial.rx.getvalue().endswith(b"W\x00\x21\x01\x00E\rID\r")
+
+
+def test_turbo_already_fast(radio, serial):
+    radio.set_speed(57600)
+    with serial.tx_from_iter(bytewise()):
+        with radio.turbo() as original:
+            assert original == "57600"
+
+    # the radio is not reset
+    assert radio.speed == 57600
+    assert serial.rx.getvalue() == b""
+
+
+def test_turbo_restores_speed_on_failure(radio, serial):
+    radio.set_speed(9600)
+    responses = bytewise(
+        SPEED_CHANGE,
+        PROBE_RESPONSE,
+        PROBE_RESPONSE,
+        SPEED_CHANGE,
+        PROBE_RESPONSE,
+    )
+
+    with pytest.raises(api.ReadTimeoutError), serial.tx_from_iter(responses):
+        with radio.turbo():
+            raise api.ReadTimeoutError()
+
+    assert radio.speed == 9600
+
+
+def test_turbo_restore_after_speed_change(radio, serial, monkeypatch):
+    monkeypatch.setattr(radio, "settle_time", 0)
+    radio.set_speed(9600)
+
+    # the radio comes back at the original speed (e.g. after restoring
+    # a memory dump), so the probe and clear() at 57600 bps time out
+    responses = bytewise(SPEED_CHANGE, PROBE_RESPONSE, b"", b"", b"", PROBE_RESPONSE)
+    with serial.tx_from_iter(responses):
+        with radio.turbo():
+            pass
+
+    assert radio.speed == 9600
+
+
+def test_turbo_radio_not_found(radio, serial, monkeypatch):
+    monkeypatch.setattr(radio, "settle_time", 0)
+    radio.set_speed(9600)
+
+    with pytest.raises(api.ReadTimeoutError):
+        with serial.tx_from_iter(bytewise(SPEED_CHANGE)):
+            with radio.turbo():
+                pass
+
+    assert radio.speed == 9600
+
+
+def test_detect_speed(radio, serial):
+    radio.speed = 9600
+    responses = bytewise(b"", b"", PROBE_RESPONSE)
+    with serial.tx_from_iter(responses):
+        assert radio.detect_speed() == "38400"
+
+    assert radio.speed == serial.baudrate == 38400
+    assert serial.rx.getvalue() == b"\rID\r" * 3
+
+
+def test_detect_speed_current_first(radio, serial):
+    radio.speed = 57600
+    serial.stuff(PROBE_RESPONSE)
+    assert radio.detect_speed() == "57600"
+    assert serial.rx.getvalue() == b"\rID\r"
+
+
+def test_detect_speed_no_radio(radio, serial):
+    radio.set_speed(19200)
+    with serial.tx_from_iter(bytewise()):
+        assert radio.detect_speed() is None
+
+    assert radio.speed == serial.baudrate == 19200
+    assert serial.rx.getvalue() == b"\rID\r" * 4
+
+
+def test_turbo_programming_mode(radio, serial):
+    radio._programming_mode = True
+    with pytest.raises(api.RadioError):
+        with radio.turbo():
+            pass
+
+
 def test_get_channel_entry(radio, serial):
     serial.stuff(
         b"ME 000,0145430000,0,1,1,0,1,0,23,"
@@ -161,7 +334,8 @@ def test_set_channel_entry(radio, serial):
     entry = radio.get_channel_entry(0)
     assert entry == expected
     entry["lockout"] = True
-    radio.set_channel_entry(0, entry)
+    res = radio.set_channel_entry(0, entry)
+    assert res == dict(expected, lockout=True)
     assert serial.rx.getvalue().endswith(
         b"ME 000,0145430000,0,1,1,0,1,0,23,"
         b"23,000,00600000,0,0000000000,0,1\r"
@@ -189,6 +363,98 @@ def test_memory_dump(radio, serial):
     assert buf.tell() == (radio.memory_max * 256)
 
 
+def block_responses(blocks):
+    """Yield the responses to read_block for (address, fill) pairs. A
+    fill of None simulates a timeout."""
+
+    for addr, fill in blocks:
+        if fill is None:
+            yield b""
+            continue
+
+        yield b"W" + struct.pack(">HB", addr, 0)
+        yield bytes([fill]) * 256
+        yield b"\x06"
+
+
+def test_memory_dump_to_file(radio, serial, tmp_path):
+    radio.memory_max = 3
+    path = tmp_path / "dump.bin"
+
+    serial.stuff(b"0M\r")
+    with radio.programming_mode(), open(path, "w+b") as fd:
+        with serial.tx_from_iter(block_responses([(0, 1), (256, 2), (512, 3)])):
+            radio.memory_dump(fd)
+        serial.stuff(b"\x06\r\x00")
+
+    assert path.read_bytes() == b"\x01" * 256 + b"\x02" * 256 + b"\x03" * 256
+    assert not (tmp_path / "dump.bin.blocks").exists()
+
+
+def test_memory_dump_port_speed(radio, serial):
+    radio.memory_max = 1
+    data = bytearray(256)
+    data[api.M_OFFSET_PORT_SPEED] = 3
+
+    buf = io.BytesIO()
+    serial.stuff(b"0M\r")
+    with radio.programming_mode():
+        serial.stuff(b"W\x00\x00\x00" + bytes(data) + b"\x06")
+        radio.memory_dump(buf, port_speed="9600")
+        serial.stuff(b"\x06\r\x00")
+
+    data[api.M_OFFSET_PORT_SPEED] = 0
+    assert buf.getvalue() == bytes(data)
+
+
+def test_memory_dump_resume(radio, serial, tmp_path):
+    radio.memory_max = 3
+    path = tmp_path / "dump.bin"
+
+    serial.stuff(b"0M\r")
+    with radio.programming_mode():
+        with open(path, "w+b") as fd:
+            with serial.tx_from_iter(block_responses([(0, 1), (256, None)])):
+                with pytest.raises(api.ReadTimeoutError):
+                    radio.memory_dump(fd)
+
+        assert (tmp_path / "dump.bin.blocks").read_bytes() == b"\x01"
+
+        serial.clear()
+        with open(path, "r+b") as fd:
+            with serial.tx_from_iter(block_responses([(256, 2), (512, 3)])):
+                radio.memory_dump(fd, resume=True)
+        serial.stuff(b"\x06\r\x00")
+
+    assert serial.rx.getvalue().startswith(b"R\x01\x00\x00\x06R\x02\x00\x00")
+    assert path.read_bytes() == b"\x01" * 256 + b"\x02" * 256 + b"\x03" * 256
+    assert not (tmp_path / "dump.bin.blocks").exists()
+
+
+def test_memory_dump_retries(radio, serial):
+    radio.memory_max = 2
+    buf = io.BytesIO()
+
+    # the second block times out once; the extra None is the timeout
+    # that ends drain_input
+    responses = [(0, 1), (256, None), (256, None), (256, 2)]
+
+    serial.stuff(b"0M\r")
+    with radio.programming_mode():
+        with serial.tx_from_iter(block_responses(responses)):
+            radio.memory_dump(buf, retries=1)
+        serial.stuff(b"\x06\r\x00")
+
+    assert buf.getvalue() == b"\x01" * 256 + b"\x02" * 256
+
+
+def test_memory_dump_resume_stream(radio, serial):
+    serial.stuff(b"0M\r\x06\r\x00")
+    with radio.programming_mode():
+        with pytest.raises(ValueError):
+            radio.memory_dump(io.BytesIO(), resume=True)
+
+
 def test_memory_restore(radio, serial):
     serial.stuff(b"0M\rW\x00\x00" + struct.pack("B", len(radio.memory_magic)))
     serial.stuff(radio.memory_magic)
@@ -309,6 +575,129 @@ def test_read_bytes_timeout(radio, serial):
         radio.read_bytes(1)
 
 
+def test_read_line_buffered(radio, serial, monkeypatch):
+    read = mock.Mock(wraps=serial.read)
+    monkeypatch.setattr(serial, "read", read)
+
+    serial.stuff(b"ID TM-V71\rAE 12345,321\r")
+    assert radio.read_line() == b"ID TM-V71"
+    assert radio.read_line() == b"AE 12345,321"
+    assert read.call_count == 1
+
+
+def test_read_line_partial_frames(radio, serial):
+    with serial.tx_from_iter(iter([b"ID T", b"M-V71\rA", b"E 1,2\r", b""])):
+        assert radio.read_line() == b"ID TM-V71"
+        assert radio.read_line() == b"AE 1,2"
+        with pytest.raises(api.ReadTimeoutError):
+            radio.read_line()
+
+
+def test_read_bytes_from_buffer(radio, serial):
+    serial.stuff(b"W\x00\x00\x02\x00\x4b\x06")
+    assert radio.read_bytes(4) == b"W\x00\x00\x02"
+    assert radio.read_bytes(2) == b"\x00\x4b"
+    assert radio.read_bytes(1) == b"\x06"
+
+
+def test_read_bytes_waits_for_remainder(radio, serial, monkeypatch):
+    read = mock.Mock(wraps=serial.read)
+    monkeypatch.setattr(serial, "read", read)
+
+    # nothing has arrived yet, so ask the port for what is still missing
+    with serial.tx_from_iter(iter([b"W\x00", b"\x00\x02"])):
+        assert radio.read_bytes(4) == b"W\x00\x00\x02"
+    assert [c[0] for c in read.call_args_list] == [(4,), (2,)]
+
+
+def test_read_bytes_compacts_buffer(radio, serial, monkeypatch):
+    monkeypatch.setattr(radio, "rxbuf_compact_size", 4)
+    serial.stuff(b"A\rB\rC\rD\r")
+    assert [radio.read_line() for _ in range(4)] == [b"A", b"B", b"C", b"D"]
+    assert radio._rxbuf == bytearray()
+
+
+def test_latency_estimator():
+    est = api.LatencyEstimator(0.02, 0.5)
+    assert est.timeout == 0.5
+
+    for _ in range(20):
+        est.update(0.01)
+    assert est.mean == pytest.approx(0.01)
+    assert est.timeout == pytest.approx(0.02, abs=0.005)
+
+    est.update(1.0)
+    assert est.timeout == 0.5
+
+    est.backoff()
+    assert est.mean <= 0.5
+
+
+def test_adaptive_timeout(serial, monkeypatch):
+    radio = api.TMV71(port="dummy", speed=0, timeout=0.5)
+    clock = iter([0, 0.01, 1, 1.01])
+    monkeypatch.setattr(api.time, "monotonic", lambda: next(clock))
+
+    serial.stuff(b"ID TM-V71\rID TM-V71\r")
+    radio.radio_id()
+    assert radio._port_timeout == 0.5
+
+    radio.radio_id()
+    assert serial.timeout == radio._port_timeout == 0.03
+    assert radio.latency()["cat"]["samples"] == 2
+    assert radio.latency()["read_block"]["samples"] == 0
+
+
+def test_adaptive_timeout_backoff(serial):
+    radio = api.TMV71(port="dummy", speed=0, timeout=0.5)
+    radio._latency["cat"].update(0.01)
+
+    with pytest.raises(api.ReadTimeoutError):
+        radio.radio_id()
+    assert radio.latency()["cat"]["mean"] == 0.02
+    assert radio.latency()["cat"]["samples"] == 1
+
+
+def test_adaptive_timeout_wire_time(serial):
+    radio = api.TMV71(port="dummy", speed=9600, timeout=0.5)
+    for _ in range(20):
+        radio._latency["cat"].update(0.01)
+
+    # a channel entry and the longest response take about 140ms to send
+    # at 9600 bps, far longer than the radio takes to answer
+    values = ME_RESPONSE[3:-1].decode("ascii").split(",")
+    frame = radio.encode_command("ME", *values)
+    nbytes = len(frame) + radio.cat_response_bytes
+    assert radio.wire_time(nbytes) > 0.13
+    assert radio.exchange_timeout("cat", nbytes) == pytest.approx(
+        radio._latency["cat"].timeout + radio.wire_time(nbytes)
+    )
+
+    serial.stuff(b"ME\r")
+    radio.send_command("ME", *values)
+    assert serial.timeout > 0.15
+
+
+def test_write_block_fixed_timeout(serial):
+    radio = api.TMV71(port="dummy", speed=0, timeout=0.5)
+    for _ in range(20):
+        radio._latency["write_block"].update(0.01)
+
+    # fast writes so far do not shorten the timeout for the next one
+    serial.stuff(b"0M\r\x06\x06\r\x00")
+    with radio.programming_mode():
+        radio.write_block(0, b"\x00")
+        assert radio._port_timeout == 0.5
+    assert radio.latency()["write_block"]["samples"] == 21
+
+
+def test_fixed_timeout(serial):
+    radio = api.TMV71(port="dummy", speed=0, timeout=0.5, adaptive_timeout=False)
+    serial.stuff(b"ID TM-V71\r")
+    radio.radio_id()
+    assert radio.latency()["cat"]["samples"] == 0
+
+
 def test_unknown_command(radio, serial):
     serial.stuff(b"?\r")
     with pytest.raises(api.UnknownCommandError):
@@ -347,6 +736,205 @@ def test_radio_firmware(radio, serial):
     assert res == dict(unit=0, v1="1.0", v2="2.0", v3="A", v4="1")
 
 
+CAPABILITY_RESPONSES = b"AE 12345,321\rID TM-D710\rFV 0,1.0,2.0,A,1\rTY K,1,0,1,0\r"
+
+
+def test_capabilities(radio, serial):
+    serial.stuff(CAPABILITY_RESPONSES)
+    caps = radio.capabilities()
+
+    assert caps == {
+        "serial": {"serial": "12345", "extra": "321"},
+        "id": "TM-D710",
+        "model_class": "TMD710",
+        "memory_max": 0xFF,
+        "firmware": {"unit": 0, "v1": "1.0", "v2": "2.0", "v3": "A", "v4": "1"},
+        "type": {
+            "model": "K",
+            "mars_tx_expansion": 1,
+            "max_tx_expansion": 0,
+            "crossband": 1,
+            "skycommand": 0,
+        },
+        "port": "dummy",
+    }
+    assert api.MODELS[caps["id"]] is api.TMD710
+
+
+def test_capabilities_cached(radio, serial, tmp_path):
+    c = cache.JSONCache("capabilities", str(tmp_path))
+    serial.stuff(CAPABILITY_RESPONSES)
+    caps = radio.capabilities(cache=c)
+
+    serial.clear()
+    serial.stuff(b"AE 12345,321\r")
+    assert radio.capabilities(cache=c) == caps
+    assert serial.rx.getvalue() == b"AE\r"
+
+    # a different radio on the same port
+    serial.clear()
+    serial.stuff(b"AE 67890,321\rID TM-V71\rFV 0,1.0,2.0,A,1\rTY K,1,0,1,0\r")
+    assert radio.capabilities(cache=c)["memory_max"] == 0x7F
+    assert set(c.data) == {"12345", "67890"}
+
+
+def test_capabilities_refresh(radio, serial, tmp_path):
+    c = cache.JSONCache("capabilities", str(tmp_path))
+    serial.stuff(CAPABILITY_RESPONSES * 2)
+    radio.capabilities(cache=c)
+    radio.capabilities(cache=c, refresh=True)
+    assert serial.rx.getvalue() == b"AE\rID\rFV 0\rTY\r" * 2
+
+
+def test_forget_capabilities(radio, serial, tmp_path):
+    c = cache.JSONCache("capabilities", str(tmp_path))
+    serial.stuff(CAPABILITY_RESPONSES + b"AE 12345,321\r")
+    radio.capabilities(cache=c)
+    radio.forget_capabilities(c)
+    assert c.get("12345") is None
+
+
+def test_result_cache_key():
+    results = api.ResultCache()
+    assert results.key(("ME", "000")) == ("ME", "000")
+    assert results.key(("ME", "000,0145430000,0")) is None
+    assert results.key(("FO", 0)) == ("FO", "0")
+    assert results.key(("MN", 1, "TEST")) is None
+    assert results.key(("BY", 0)) is None
+    assert results.key(("XX",)) is None
+
+
+def test_result_cache_invalidation():
+    results = api.ResultCache()
+    for command in [("ME", "000"), ("MN", "000"), ("AS", "0"), ("AS", "1")]:
+        results.update(command, ["x"])
+
+    results.sending(("AS", "0", "1"))
+    assert results.get(("AS", "1")) is None
+    assert results.get(("ME", "000")) == ["x"]
+
+    results.sending(("BY", 0))
+    assert results.get(("MN", "000")) == ["x"]
+
+    results.sending(("ME", "000,0145430000"))
+    assert results.get(("MN", "000")) is None
+
+    results.update(("ME", "000"), ["x"])
+    results.sending(("SR",))
+    assert results.get(("ME", "000")) is None
+
+
+def test_cache_results(serial):
+    radio = api.TMV71(port="dummy", speed=0, timeout=0, cache_results=True)
+    serial.stuff(b"AS 0,1\rAS 0,0\rAS 0,0\r")
+
+    assert radio.get_band_reverse(0) == 1
+    assert radio.get_band_reverse(0) == 1
+    assert serial.rx.getvalue() == b"AS 0\r"
+
+    radio.set_band_reverse(0, 0)
+    assert radio.get_band_reverse(0) == 0
+    assert serial.rx.getvalue() == b"AS 0\rAS 0,0\rAS 0\r"
+    assert radio.results.hits == 1
+
+
+def test_cache_results_related(serial):
+    radio = api.TMV71(port="dummy", speed=0, timeout=0, cache_results=True)
+    radio.results.update(("FO", "0"), ["0", "0145430000"])
+    radio.results.update(("VM", "0"), ["0", "0"])
+
+    # setting reverse mode changes the VFO settings
+    serial.stuff(b"AS 0,1\r")
+    radio.set_band_reverse(0, 1)
+    assert radio.results.get(("FO", "0")) is None
+
+    # selecting a channel changes the band mode
+    serial.stuff(b"MR 0,005\r")
+    radio.set_channel(0, 5)
+    assert radio.results.get(("VM", "0")) is None
+
+
+def test_cache_results_pm_write(serial):
+    radio = api.TMV71(port="dummy", speed=0, timeout=0, cache_results=True)
+    serial.stuff(b"LK 1\r0M\r\x06\x06\r\x00LK 0\r")
+
+    assert radio.get_lock_state()
+    with radio.programming_mode():
+        radio.write_block(0x12, b"123")
+    assert not radio.get_lock_state()
+
+
+def test_cache_results_send_commands(serial):
+    radio = api.TMV71(port="dummy", speed=0, timeout=0, cache_results=True)
+    serial.stuff(b"ID TM-V71\rAE 12345,321\r")
+
+    list(radio.send_commands([("ID",), ("AE",)]))
+    assert radio.radio_id() == "TM-V71"
+    assert serial.rx.getvalue() == b"ID\rAE\r"
+
+
+ME_RESPONSE = b"ME 000,0145430000,0,1,1,0,1,0,23,23,000,00600000,0,0000000000,0,0\r"
+
+
+def test_cache_results_write_through(serial):
+    radio = api.TMV71(port="dummy", speed=0, timeout=0, cache_results=True)
+    serial.stuff(ME_RESPONSE + b"MN 000,TEST\rME\rMN 000,NEW\r")
+
+    entry = radio.get_channel_entry(0)
+    entry["lockout"] = True
+    entry["name"] = "NEW"
+    radio.set_channel_entry(0, entry)
+
+    res = radio.get_channel_entry(0)
+    assert res["lockout"]
+    assert res["name"] == "NEW"
+    assert serial.rx.getvalue().count(b"ME 000\r") == 1
+
+    # deleting a channel is not written through
+    serial.stuff(b"ME\r")
+    radio.delete_channel_entry(0)
+    assert radio.results.get(("ME", "000")) is None
+    assert radio.results.get(("MN", "000")) is None
+
+
+def test_cache_results_write_through_echo(serial):
+    radio = api.TMV71(port="dummy", speed=0, timeout=0, cache_results=True)
+
+    # the radio echoes the name it stored, not the one that was sent
+    serial.stuff(b"MN 000,NEW\r")
+    assert radio.set_channel_name(0, "new") == "NEW"
+    assert radio.get_channel_name(0) == "NEW"
+    assert serial.rx.getvalue() == b"MN 000,new\r"
+
+
+def test_set_channel_entry_verify(radio, serial, caplog):
+    radio.verify_policy = "always"
+    entry = schema.ME.from_csv(ME_RESPONSE.decode("ascii")[3:-1] + ",TEST")
+
+    # the radio holds a different frequency than the one we wrote
+    serial.stuff(b"ME\rMN 000,TEST\r")
+    serial.stuff(ME_RESPONSE.replace(b"0145430000", b"0145425000"))
+    serial.stuff(b"MN 000,TEST\r")
+    res = radio.set_channel_entry(0, entry)
+
+    assert res["rx_freq"] == 145.425
+    assert "does not match" in caplog.text
+
+
+def test_set_channel_entry_sampled(radio, serial):
+    radio.verify_policy = "sampled"
+    radio.verify_interval = 2
+    entry = schema.ME.from_csv(ME_RESPONSE.decode("ascii")[3:-1] + ",TEST")
+
+    serial.stuff(b"ME\rMN 000,TEST\r" + ME_RESPONSE + b"MN 000,TEST\r")
+    serial.stuff(b"ME\rMN 000,TEST\r")
+    radio.set_channel_entry(0, entry)
+    radio.set_channel_entry(0, entry)
+
+    # only the first write was read back
+    assert serial.rx.getvalue().count(b"ME 000\r") == 1
+
+
 def test_get_band_squelch(radio, serial):
     serial.stuff(b"SQ 0A\r")
     res = radio.get_band_squelch(0)
@@ -549,6 +1137,16 @@ def test_set_call_channel(radio, serial):
     assert s2 in serial.rx.getvalue()
 
 
+def test_set_call_channel_index(radio, serial):
+    s1 = b"CC 0,0146520000,0,0,0,0,0,0,08,08,000,00600000,0,0000000000,0\r"
+    s2 = b"CC 1,0146520000,0,0,0,0,0,0,08,08,000,00600000,0,0000000000,0\r"
+    serial.stuff(s1 + s2)
+
+    res = radio.set_call_channel(1, radio.get_call_channel(0))
+    assert res["index"] == 1
+    assert s2 in serial.rx.getvalue()
+
+
 def test_export_channels(radio, serial):
     expected = (
         "channel,rx_freq,rx_step,shift,reverse,admit,tone,offset,"
@@ -583,3 +1181,393 @@ def test_import_channels(radio, serial):
     )
     radio.import_channels(buf, selected=[0])
     assert serial.rx.getvalue() == expected
+
+
+def test_send_commands(radio, serial):
+    serial.stuff(b"ID TM-V71\rAE 12345,321\r")
+    res = list(radio.send_commands([("ID",), ("AE",)], window=2))
+    assert res == [["TM-V71"], ["12345", "321"]]
+    assert serial.rx.getvalue() == b"ID\rAE\r"
+
+
+def test_send_commands_error(radio, serial):
+    serial.stuff(b"ID TM-V71\rN\rAE 12345,321\r")
+    res = radio.send_commands([("ID",), ("ME", "000"), ("AE",)])
+    assert next(res) == ["TM-V71"]
+    with pytest.raises(api.InvalidCommandError) as err:
+        next(res)
+
+    assert str(err.value) == 'The radio was unable to execute the "ME" command'
+    assert serial.tx.read() == b""
+
+
+def test_send_commands_return_exceptions(radio, serial):
+    serial.stuff(b"?\rID TM-V71\r")
+    res = list(radio.send_commands([("XX",), ("ID",)], return_exceptions=True))
+    assert isinstance(res[0], api.UnknownCommandError)
+    assert res[1] == ["TM-V71"]
+
+
+def test_send_commands_timeout(radio, serial):
+    def responses():
+        yield from (bytes([c]) for c in b"ID TM-V71\r")
+        # timeout, then the response to the resync probe
+        yield b""
+        yield from (b"?\r", b"ID TM-V71\r")
+        yield from (bytes([c]) for c in b"AE 12345,321\r")
+
+    with serial.tx_from_iter(responses()):
+        res = list(radio.send_commands([("ID",), ("AE",)], window=2))
+
+    assert res == [["TM-V71"], ["12345", "321"]]
+    assert serial.rx.getvalue() == b"ID\rAE\r\rID\rAE\r"
+
+    # the timeout doubled the estimate, and both responses were measured
+    assert radio.latency()["cat"]["samples"] == 2
+
+
+def test_export_channels_deleted(radio, serial):
+    serial.stuff(
+        b"N\rN\r"
+        b"ME 001,0145430000,0,1,1,0,1,0,23,"
+        b"23,000,00600000,0,0000000000,0,0\r"
+        b"MN 001,TEST\r"
+    )
+
+    buf = io.StringIO()
+    radio.export_channels(buf, selected=[0, 1], skip_deleted=True)
+    assert buf.getvalue().splitlines()[1:] == [
+        "1,145.43,5.0,UP,True,C,146.2,0.6,FM,0.0,5.0,False,TEST"
+    ]
+    assert serial.rx.getvalue() == b"ME 000\rMN 000\rME 001\rMN 001\r"
+
+
+def test_iter_channels(radio, serial):
+    serial.stuff(
+        b"N\rN\r"
+        b"ME 001,0145430000,0,1,1,0,1,0,23,"
+        b"23,000,00600000,0,0000000000,0,0\r"
+        b"MN 001,TEST\r"
+    )
+
+    channels = radio.iter_channels([0, 1], skip_deleted=True, window=2)
+    channel, entry = next(channels)
+    assert channel == 1
+    assert entry["name"] == "TEST"
+    with pytest.raises(StopIteration):
+        next(channels)
+
+
+def test_iter_channels_lazy(radio, serial):
+    serial.stuff(b"N\rN\rN\r")
+
+    channels = radio.iter_channels(range(10), window=2)
+    assert next(channels) == (0, None)
+    # no more than <window> commands are sent ahead of the consumer
+    assert serial.rx.getvalue() == b"ME 000\rMN 000\rME 001\r"
+    channels.close()
+
+
+def test_export_channels_occupancy(radio, serial):
+    serial.stuff(
+        b"ME 001,0145430000,0,1,1,0,1,0,23,"
+        b"23,000,00600000,0,0000000000,0,0\r"
+        b"MN 001,TEST\r"
+    )
+    occupancy = image.Bitmap(image.CHANNEL_COUNT)
+    occupancy[1] = True
+
+    buf = io.StringIO()
+    radio.export_channels(buf, selected=[0, 1], occupancy=occupancy)
+    assert buf.getvalue().splitlines()[1:] == [
+        "0,,,,,,,,,,,,",
+        "1,145.43,5.0,UP,True,C,146.2,0.6,FM,0.0,5.0,False,TEST",
+    ]
+    assert serial.rx.getvalue() == b"ME 001\rMN 001\r"
+
+
+def test_import_channels_sync_occupancy(radio, serial):
+    buf = io.StringIO("channel,rx_freq\r\n")
+    occupancy = image.Bitmap(image.CHANNEL_COUNT)
+    occupancy[2] = True
+
+    serial.stuff(b"ME 002\r")
+    radio.import_channels(buf, selected=[0, 1, 2], sync=True, occupancy=occupancy)
+    assert serial.rx.getvalue() == b"ME 002,\r"
+
+
+def test_channel_occupancy(radio, serial):
+    blocks = [(block * 256, 0xFF) for block in image.CHANNEL_RECORD_BLOCKS]
+    # the first record block holds channels 0-15
+    blocks[0] = (blocks[0][0], 0)
+
+    serial.stuff(b"0M\r")
+    with radio.programming_mode():
+        with serial.tx_from_iter(block_responses(blocks)):
+            occupancy = radio.channel_occupancy()
+        serial.stuff(b"\x06\r\x00")
+
+    assert occupancy.set_bits() == list(range(16))
+
+
+def test_plan_transfer(radio):
+    radio.speed = 9600
+    assert radio.plan_transfer(commands=2, blocks=3) == "cat"
+    assert radio.plan_transfer(commands=2000, blocks=119) == "memory"
+
+    radio._programming_mode = True
+    assert radio.plan_transfer(commands=2, blocks=3) == "memory"
+
+
+def test_plan_transfer_uses_latency(radio):
+    radio.speed = 9600
+    planner = api.TransferPlanner(radio)
+    slow = planner.cat_cost(100)
+
+    radio._latency["cat"].update(0.5)
+    planner = api.TransferPlanner(radio)
+    assert planner.cat_cost(100) > slow
+
+
+def test_read_channels_from_memory(radio, serial):
+    serial.stuff(b"0M\r")
+    for block in (0x0E, 0x17, 0x58):
+        serial.stuff(b"W" + struct.pack(">HB", block * 256, 0))
+        serial.stuff(b"\xff" * 256 + b"\x06")
+    serial.stuff(b"\x06\r\x00")
+
+    res = list(radio.read_channels([0, 1], method="memory"))
+    assert res == [(0, None), (1, None)]
+    assert serial.rx.getvalue().startswith(b"0M PROGRAM\rR\x0e\x00\x00")
+
+
+IMPORT_CSV = (
+    "channel,rx_freq,rx_step,shift,reverse,admit,tone,offset,"
+    "mode,tx_freq,tx_step,lockout,name\r\n"
+    "0,145.430,5.0,UP,True,C,146.2,0.6,FM,0.0,5.0,False,TEST\r\n"
+    "1,145.43,5.0,UP,True,C,146.2,0.6,FM,0.0,5.0,False,NEW\r\n"
+    "2,145.43,5.0,UP,True,C,146.2,0.6,FM,0.0,5.0,False,RENAMED\r\n"
+)
+
+
+def test_plan_import(radio, serial):
+    serial.stuff(
+        b"ME 000,0145430000,0,1,1,0,1,0,23,23,000,00600000,0,0000000000,0,0\r"
+        b"MN 000,TEST\r"
+        b"N\rN\r"
+        b"ME 002,0145430000,0,1,1,0,1,0,23,23,000,00600000,0,0000000000,0,0\r"
+        b"MN 002,TEST\r"
+        b"ME 003,0145430000,0,1,1,0,1,0,23,23,000,00600000,0,0000000000,0,0\r"
+        b"MN 003,TEST\r"
+        b"N\rN\r"
+    )
+
+    plan = radio.plan_import(io.StringIO(IMPORT_CSV), selected=range(5), sync=True)
+    assert [(channel, action) for channel, action, _ in plan] == [
+        (0, "unchanged"),
+        (1, "create"),
+        (2, "update"),
+        (3, "delete"),
+    ]
+    assert api.summarize_import(plan) == {
+        "create": 1,
+        "update": 1,
+        "delete": 1,
+        "unchanged": 1,
+    }
+
+
+def test_plan_import_no_sync(radio, serial):
+    serial.stuff(
+        b"ME 000,0145430000,0,1,1,0,1,0,23,23,000,00600000,0,0000000000,0,0\r"
+        b"MN 000,TEST\r"
+        b"N\rN\r"
+        b"ME 002,0145430000,0,1,1,0,1,0,23,23,000,00600000,0,0000000000,0,0\r"
+        b"MN 002,TEST\r"
+    )
+
+    # only the channels in the document are read
+    plan = radio.plan_import(io.StringIO(IMPORT_CSV))
+    assert [(channel, action) for channel, action, _ in plan] == [
+        (0, "unchanged"),
+        (1, "create"),
+        (2, "update"),
+    ]
+    assert serial.rx.getvalue() == b"ME 000\rMN 000\rME 001\rMN 001\rME 002\rMN 002\r"
+
+    serial.clear()
+    assert radio.plan_import(io.StringIO(IMPORT_CSV), selected=[5, 6]) == []
+    assert serial.rx.getvalue() == b""
+
+
+def test_apply_import(radio, serial):
+    rows = api.read_channels_csv(io.StringIO(IMPORT_CSV))
+    plan = [(0, "unchanged", rows[0]), (1, "create", rows[1]), (3, "delete", None)]
+
+    serial.stuff(b"ME 001\rMN 001,NEW\rME 003\r")
+    radio.apply_import(plan)
+    rx = serial.rx.getvalue()
+    assert b"ME 000" not in rx
+    assert rx.startswith(b"ME 001,")
+    assert rx.endswith(b"MN 001,NEW\rME 003,\r")
+
+
+def test_apply_import_invalid_row(radio, serial):
+    rows = api.read_channels_csv(io.StringIO(IMPORT_CSV))
+    plan = [(0, "create", dict(rows[0], mode="XX")), (1, "create", rows[1])]
+
+    with pytest.raises(ValueError):
+        radio.apply_import(plan)
+    assert serial.rx.getvalue() == b""
+
+    serial.stuff(b"ME 001\rMN 001,NEW\r")
+    radio.apply_import(plan, ignore_errors=True)
+    assert serial.rx.getvalue().startswith(b"ME 001,")
+
+
+def test_prefetch():
+    assert list(api.prefetch(range(100), 4)) == list(range(100))
+
+    def fail():
+        yield 1
+        raise ValueError("boom")
+
+    items = api.prefetch(fail(), 4)
+    assert next(items) == 1
+    with pytest.raises(ValueError):
+        next(items)
+
+
+def test_prefetch_close():
+    produced = []
+
+    def produce():
+        for i in itertools.count():
+            produced.append(i)
+            yield i
+
+    items = api.prefetch(produce(), 2)
+    assert next(items) == 0
+    items.close()
+    count = len(produced)
+    assert count <= 5
+    assert len(produced) == count
+
+
+def test_channels_equal():
+    entry = schema.ME.from_csv(
+        "000,0145430000,0,1,1,0,1,0,23,23,000,00600000,0,0000000000,0,0,TEST"
+    )
+    row = api.read_channels_csv(io.StringIO(IMPORT_CSV))[0]
+    assert api.channels_equal(0, entry, row)
+
+    # only the selected tone matters
+    entry["tone_freq"] = 100.0
+    assert api.channels_equal(0, entry, row)
+
+    assert not api.channels_equal(0, entry, dict(row, tone="100.0"))
+    assert not api.channels_equal(0, entry, dict(row, rx_freq="x"))
+
+
+def test_import_channels_to_memory(radio, serial):
+    buf = io.StringIO(
+        "channel,rx_freq,rx_step,shift,reverse,admit,tone,offset,"
+        "mode,tx_freq,tx_step,lockout,name\r\n"
+        "0,145.43,5.0,UP,True,C,146.2,0.6,FM,0.0,5.0,False,TEST\r\n"
+    )
+
+    serial.stuff(b"0M\r")
+    for block in (0x0E, 0x17, 0x58):
+        serial.stuff(b"W" + struct.pack(">HB", block * 256, 0))
+        serial.stuff(b"\xff" * 256 + b"\x06")
+    serial.stuff(b"\x06" * 3)
+    serial.stuff(b"\x06\r\x00")
+
+    with radio.programming_mode():
+        written = radio.import_channels_to_memory(buf, selected=[0, 1])
+
+    assert written == 3
+    record, flags = image.tuple_to_record(
+        "000,0145430000,0,1,1,0,1,0,0,23,000,00600000,0,0000000000,0,0".split(",")
+    )
+    rx = serial.rx.getvalue()
+    assert b"W\x17\x00\x00" + record + b"\xff" * 240 in rx
+    assert b"W\x0e\x00\x00" + flags + b"\xff" * 254 in rx
+    assert b"W\x58\x00\x00TEST\xff\xff\xff\xff" in rx
+
+
+def test_import_channels_to_memory_unchanged(radio, serial):
+    buf = io.StringIO("")
+
+    serial.stuff(b"0M\r")
+    for block in (0x0E, 0x17, 0x58):
+        serial.stuff(b"W" + struct.pack(">HB", block * 256, 0))
+        serial.stuff(b"\xff" * 256 + b"\x06")
+    serial.stuff(b"\x06\r\x00")
+
+    with radio.programming_mode():
+        written = radio.import_channels_to_memory(buf, selected=[0], sync=True)
+
+    assert written == 0
+
+
+def test_memory_restore_differential(radio, serial):
+    fill_data = b"\x01\x02\x03\x04"
+    current = radio.memory_magic + fill_data * (0x7F00 // len(fill_data))
+    current = current[:0x7F00]
+    new = bytearray(current)
+    new[0x1700] = 0xAA
+
+    serial.stuff(b"0M\rW\x00\x00" + struct.pack("B", len(radio.memory_magic)))
+    serial.stuff(radio.memory_magic)
+    serial.stuff(b"\x06" * 4)
+    serial.stuff(b"\x06\r\x00")
+
+    with radio.programming_mode():
+        changed = radio.memory_restore(
+            io.BytesIO(new), differential=True, current=current
+        )
+
+    assert changed == [0x17]
+    assert serial.rx.getvalue().endswith(
+        b"W\x00\x00\x01\xff"
+        + b"W\x17\x00\x00"
+        + new[0x1700:0x1800]
+        + b"W\x00\x00\x02\x00KE"
+    )
+
+
+def test_memory_restore_differential_readback(radio, serial):
+    data = radio.memory_magic + b"\x00" * (0x7F00 - len(radio.memory_magic))
+
+    def responses():
+        yield from (b"0", b"M", b"\r")
+        yield b"W\x00\x00\x02"
+        yield radio.memory_magic
+        yield b"\x06"
+        yield b"W\x00\x02\xfe"
+        yield data[2:256]
+        yield b"\x06"
+        for block in range(1, radio.memory_max):
+            addr, end = block * 256, (block + 1) * 256
+            yield b"W" + struct.pack(">HB", addr, 0)
+            yield data[addr:end]
+            yield b"\x06"
+        yield from (b"\x06", b"\r", b"\x00")
+
+    with serial.tx_from_iter(responses()):
+        with radio.programming_mode():
+            changed = radio.memory_restore(io.BytesIO(data), differential=True)
+
+    assert changed == []
+    assert b"\x06W" not in serial.rx.getvalue()
+
+
+def test_programming_mode_nested(radio, serial):
+    serial.stuff(b"0M\r\x06\r\x00")
+    with radio.programming_mode():
+        with radio.programming_mode():
+            assert radio._programming_mode
+        assert radio._programming_mode
+    assert not radio._programming_mode
+    assert serial.rx.getvalue() == b"0M PROGRAM\rE"
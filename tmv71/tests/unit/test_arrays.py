@@ -0,0 +1,70 @@
+import pytest
+
+from tmv71 import image
+from tmv71 import schema
+
+np = pytest.importorskip("numpy")
+arrays = pytest.importorskip("tmv71.arrays")
+
+ME_TUPLES = [
+    "000,0145430000,0,1,1,0,1,0,23,23,000,00600000,0,0000000000,0,0",
+    "001,0446000000,3,2,0,1,0,0,08,08,000,05000000,1,0000000000,5,1",
+    "002,0147000000,0,3,0,0,0,1,00,00,012,00000000,2,0442000000,0,0",
+]
+
+
+@pytest.fixture
+def img():
+    img = image.RadioImage(b"\xff" * 0x7F00)
+    for i, values in enumerate(ME_TUPLES):
+        entry = schema.ME.from_tuple(values.split(",") + ["CH{}".format(i)])
+        img.set_channel(i * 100, entry)
+
+    return img
+
+
+@pytest.fixture
+def table(img):
+    return arrays.ChannelTable(bytes(img))
+
+
+def test_zero_copy(img):
+    data = bytearray(img.data)
+    table = arrays.ChannelTable(data)
+    data[image.CHANNEL_OFFSET] = 0
+    assert table.records["rx_freq_raw"][0] == 145430000 & ~0xFF
+
+
+def test_occupied(table):
+    assert list(np.flatnonzero(table.occupied)) == [0, 100, 200]
+    assert np.isnan(table.rx_freq[1])
+
+
+@pytest.mark.parametrize("channel", [0, 100, 200])
+def test_matches_decode_channel(img, table, channel):
+    entry = img.get_channel(channel)
+    assert table.rx_freq[channel] == entry["rx_freq"]
+    assert table.rx_step[channel] == entry["rx_step"]
+    assert table.tx_step[channel] == entry["tx_step"]
+    assert table.tone_freq[channel] == entry["tone_freq"]
+    assert table.ctcss_freq[channel] == entry["ctcss_freq"]
+    assert table.dcs_code[channel] == entry["dcs_code"]
+    assert table.offset[channel] == entry["offset"]
+    assert table.tx_freq[channel] == entry["tx_freq"]
+    assert table.reverse[channel] == entry["reverse"]
+    assert table.lockout[channel] == entry["lockout"]
+    assert schema.SHIFT_DIRECTION[table.shift[channel]] == entry["shift"]
+    assert schema.MODE[table.mode[channel]] == entry["mode"]
+    assert table.name[channel] == entry["name"]
+
+
+def test_short_image():
+    with pytest.raises(ValueError):
+        arrays.ChannelTable(b"\xff" * 256)
+
+
+def test_from_file(img, tmp_path):
+    path = tmp_path / "dump.bin"
+    path.write_bytes(bytes(img))
+    table = arrays.ChannelTable.from_file(str(path))
+    assert table.name[100] == "CH1"
@@ -0,0 +1,43 @@
+import json
+
+from tmv71 import cache
+
+
+def test_set_and_get(tmp_path):
+    c = cache.JSONCache("test", str(tmp_path))
+    assert c.get("a") is None
+    c.set("a", [1, 2])
+
+    assert cache.JSONCache("test", str(tmp_path)).get("a") == [1, 2]
+    with open(tmp_path / "test.json") as fd:
+        assert json.load(fd) == {"a": [1, 2]}
+
+
+def test_delete(tmp_path):
+    c = cache.JSONCache("test", str(tmp_path))
+    c.set("a", 1)
+    c.delete("a")
+    c.delete("b")
+
+    assert cache.JSONCache("test", str(tmp_path)).get("a") is None
+
+
+def test_creates_directory(tmp_path):
+    c = cache.JSONCache("test", str(tmp_path / "sub" / "dir"))
+    c.set("a", 1)
+    assert (tmp_path / "sub" / "dir" / "test.json").exists()
+
+
+def test_corrupt_cache(tmp_path):
+    (tmp_path / "test.json").write_text("not json")
+    c = cache.JSONCache("test", str(tmp_path))
+    assert c.get("a", "default") == "default"
+
+    c.set("a", 1)
+    assert cache.JSONCache("test", str(tmp_path)).get("a") == 1
+
+
+def test_default_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path))
+    cache.JSONCache("test").set("a", 1)
+    assert (tmp_path / "test.json").exists()
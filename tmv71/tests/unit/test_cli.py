@@ -2,10 +2,19 @@ import binascii
 import json
 import os
 import pytest
+import struct
 import tempfile
 
+from unittest import mock
+
 from click.testing import CliRunner
+from tmv71 import api
 from tmv71 import cli
+from tmv71 import image
+from tmv71 import mirror
+from tmv71 import schema
+
+ME_CSV = "005,0145430000,0,1,1,0,1,0,23,23,000,00600000,0,0000000000,0,0,TEST"
 
 
 @pytest.fixture
@@ -18,6 +27,8 @@ def environ():
     os.environ["TMV71_NO_CONFIG"] = "1"
     os.environ["TMV71_PORT"] = "dummy"
     os.environ["TMV71_NO_CLEAR"] = "1"
+    os.environ["TMV71_NO_DAEMON"] = "1"
+    os.environ["TMV71_NO_CACHE"] = "1"
 
 
 def test_main(runner):
@@ -61,6 +72,207 @@ def test_info_type_json(runner, serial, environ):
     assert res_decoded == expected
 
 
+def test_info_latency(runner, serial, environ):
+    serial.stuff(b"ID TM-V71\rID TM-V71\r")
+    res = runner.invoke(cli.main, ["info", "latency", "-n", "2", "-F", "json"])
+    assert res.exit_code == 0
+    res_decoded = json.loads(res.output)
+    assert res_decoded["cat_samples"] == 2
+    assert res_decoded["read_block_samples"] == 0
+    assert res_decoded["read_block_mean"] is None
+    assert serial.rx.getvalue() == b"ID\rID\r"
+
+
+def test_detect_speed(runner, serial, environ, monkeypatch, tmp_path):
+    monkeypatch.delenv("TMV71_NO_CLEAR")
+    monkeypatch.delenv("TMV71_NO_CACHE")
+    monkeypatch.setattr(cli.SETTINGS, "no_clear", False)
+    monkeypatch.setattr(cli.SETTINGS, "no_cache", False)
+    monkeypatch.setattr(cli.SETTINGS, "speed", 9600)
+    monkeypatch.setattr(cli.cache, "CACHE_DIR", str(tmp_path))
+
+    serial.raise_next_read(api.ReadTimeoutError)
+    serial.stuff(b"?\rID TM-V71\rID TM-V71\r")
+    res = runner.invoke(cli.main, ["info", "id"])
+    assert res.exit_code == 0
+    assert res.output == "TM-V71\n"
+    assert serial.rx.getvalue() == b"\rID\r\rID\rID\r"
+
+    with open(tmp_path / "speeds.json") as fd:
+        assert json.load(fd) == {"dummy": "19200"}
+
+    # the next command starts at the speed that worked
+    serial.clear()
+    serial.stuff(b"?\rID TM-V71\rID TM-V71\r")
+    res = runner.invoke(cli.main, ["info", "id"])
+    assert res.exit_code == 0
+    assert serial.baudrate == 19200
+    assert serial.rx.getvalue() == b"\rID\rID\r"
+
+
+def test_info_capabilities(runner, serial, environ, monkeypatch, tmp_path):
+    monkeypatch.delenv("TMV71_NO_CACHE")
+    monkeypatch.setattr(cli.SETTINGS, "no_cache", False)
+    monkeypatch.setattr(cli.cache, "CACHE_DIR", str(tmp_path))
+
+    responses = [
+        b"AE 12345,321\rID TM-V71\rFV 0,1.0,2.0,A,1\rTY K,1,0,1,0\r",
+        b"AE 12345,321\r",
+    ]
+    for response in responses:
+        serial.stuff(response)
+        res = runner.invoke(cli.main, ["info", "capabilities", "-F", "json"])
+        assert res.exit_code == 0
+        res_decoded = json.loads(res.output)
+        assert res_decoded["model_class"] == "TMV71"
+        assert res_decoded["firmware_v2"] == "2.0"
+        assert res_decoded["serial_serial"] == "12345"
+
+    assert serial.rx.getvalue() == b"AE\rID\rFV 0\rTY\rAE\r"
+
+
+@pytest.fixture
+def cached_settings(monkeypatch, tmp_path):
+    monkeypatch.setattr(cli.cache, "CACHE_DIR", str(tmp_path))
+    settings = cli.ApplicationSettings()
+    settings.port = "dummy"
+    settings.no_daemon = True
+    return settings
+
+
+def test_open_radio_cached_model(serial, cached_settings, tmp_path):
+    with open(tmp_path / "capabilities.json", "w") as fd:
+        json.dump({"12345": {"port": "dummy", "id": "TM-D710"}}, fd)
+
+    radio = cli.ApplicationContext(cached_settings).open_radio()
+    assert isinstance(radio, api.TMD710)
+    assert radio.memory_max == 0xFF
+    assert serial.rx.getvalue() == b""
+
+
+def test_open_mirror_records_capabilities(serial, cached_settings, tmp_path):
+    serial.stuff(b"AE 12345,321\rID TM-D710\rFV 0,1.0,2.0,A,1\rTY K,1,0,1,0\r")
+    cli.ApplicationContext(cached_settings).open_mirror()
+
+    with open(tmp_path / "capabilities.json") as fd:
+        caps = json.load(fd)
+    assert caps["12345"]["port"] == "dummy"
+
+    # the next session opens the port with the right model
+    radio = cli.ApplicationContext(cached_settings).open_radio()
+    assert isinstance(radio, api.TMD710)
+
+
+def test_channel_mirror_show(runner, serial, environ, monkeypatch, tmp_path):
+    monkeypatch.delenv("TMV71_NO_CACHE")
+    monkeypatch.setattr(cli.SETTINGS, "no_cache", False)
+    monkeypatch.setattr(cli.cache, "CACHE_DIR", str(tmp_path))
+
+    with open(tmp_path / "capabilities.json", "w") as fd:
+        json.dump({"12345": {"port": "dummy"}}, fd)
+
+    channels = mirror.ChannelMirror("12345")
+    channels.set(5, schema.ME.from_csv(ME_CSV))
+    channels.save()
+
+    res = runner.invoke(cli.main, ["channel", "mirror", "show", "5", "-F", "json"])
+    assert res.exit_code == 0
+    res_decoded = json.loads(res.output)
+    assert res_decoded["name"] == "TEST"
+    assert res_decoded["updated"]
+
+    res = runner.invoke(cli.main, ["channel", "mirror", "show", "6"])
+    assert res.exit_code != 0
+    assert "not in the mirror" in res.output
+
+    # the mirror is read without talking to the radio
+    assert serial.rx.getvalue() == b""
+
+
+def test_channel_mirror_no_cache(runner, serial, environ):
+    res = runner.invoke(cli.main, ["channel", "mirror", "status"])
+    assert res.exit_code != 0
+    assert "--no-cache" in res.output
+
+
+def test_channel_delete_probe(runner, serial, environ):
+    def responses():
+        yield b"0M\r"
+        for block in image.CHANNEL_RECORD_BLOCKS:
+            # only channel 1 is in use
+            data = bytearray(b"\xff" * 256)
+            if block * 256 == image.CHANNEL_OFFSET:
+                data[16:20] = bytes(4)
+            yield b"W" + struct.pack(">HB", block * 256, 0)
+            yield bytes(data)
+            yield b"\x06"
+        yield b"\x06\r\x00"
+        yield b"ME 001\r"
+
+    with serial.tx_from_iter(responses()):
+        res = runner.invoke(cli.main, ["channel", "delete", "-c", "0:2", "--probe"])
+
+    assert res.exit_code == 0
+    assert serial.rx.getvalue().endswith(b"E" + b"ME 001,\r")
+
+
+def test_channel_entry_set(runner, serial, environ):
+    serial.stuff(
+        b"ME 000,0145430000,0,1,1,0,1,0,23,23,000,00600000,0,0000000000,0,0\r"
+        b"MN 000,TEST\rME\rMN 000,TEST\r"
+    )
+    res = runner.invoke(cli.main, ["channel", "entry", "0", "--lockout", "-F", "json"])
+    assert res.exit_code == 0
+    assert json.loads(res.output)["lockout"] is True
+
+    # the channel is not read back after it is written
+    assert serial.rx.getvalue() == (
+        b"ME 000\rMN 000\r"
+        b"ME 000,0145430000,0,1,1,0,1,0,23,23,000,00600000,0,0000000000,0,1\r"
+        b"MN 000,TEST\r"
+    )
+
+
+def test_channel_entry_cached_serial(runner, serial, environ, monkeypatch, tmp_path):
+    monkeypatch.delenv("TMV71_NO_CACHE")
+    monkeypatch.setattr(cli.SETTINGS, "no_cache", False)
+    monkeypatch.setattr(cli.cache, "CACHE_DIR", str(tmp_path))
+    with open(tmp_path / "capabilities.json", "w") as fd:
+        json.dump({"12345": {"port": "dummy", "id": "TM-V71"}}, fd)
+
+    serial.stuff(
+        b"ME 000,0145430000,0,1,1,0,1,0,23,23,000,00600000,0,0000000000,0,0\r"
+        b"MN 000,TEST\rME\rMN 000,TEST\r"
+    )
+    res = runner.invoke(cli.main, ["channel", "entry", "0", "--lockout"])
+    assert res.exit_code == 0
+
+    # the radio is known, so it is not asked for its serial number
+    assert serial.rx.getvalue().startswith(b"ME 000\rMN 000\r")
+    assert b"AE" not in serial.rx.getvalue()
+    entry, _ = mirror.ChannelMirror.open("12345").get(0)
+    assert entry["lockout"] is True
+
+
+def test_channel_import_dry_run(runner, serial, environ, tmp_path):
+    path = tmp_path / "channels.csv"
+    path.write_text(
+        "channel,rx_freq,rx_step,shift,reverse,admit,tone,offset,"
+        "mode,tx_freq,tx_step,lockout,name\r\n"
+        "5,145.43,5.0,UP,True,C,146.2,0.6,FM,0.0,5.0,False,NEW\r\n"
+    )
+
+    serial.stuff(b"N\rN\r")
+    res = runner.invoke(
+        cli.main, ["channel", "import", "-i", str(path), "-c", "5", "--dry-run"]
+    )
+    assert res.exit_code == 0
+    assert res.output == (
+        "create 005 NEW\n1 to create, 0 to update, 0 to delete, 0 unchanged\n"
+    )
+    assert serial.rx.getvalue() == b"ME 005\rMN 005\r"
+
+
 def test_memory_read_block(runner, serial, environ):
     test_data = b"\x01\x02\x03\x04"
 
@@ -126,3 +338,132 @@ def test_band_select(runner, serial, environ):
     assert res.exit_code == 0
     data = json.loads(res.output)
     assert data == dict(ctrl=1, ptt=1, mode="dual")
+
+
+def test_channel_export_from_dump(runner, serial, environ):
+    with tempfile.NamedTemporaryFile() as dump, tempfile.NamedTemporaryFile() as out:
+        dump.write(b"\xff" * 0x7F00)
+        dump.flush()
+        res = runner.invoke(
+            cli.main,
+            ["channel", "export", "-d", dump.name, "-c", "0:1", "-o", out.name],
+        )
+        assert res.exit_code == 0
+
+        rows = out.read().decode("ascii").splitlines()
+
+    assert rows == [
+        "channel,rx_freq,rx_step,shift,reverse,admit,tone,offset,"
+        "mode,tx_freq,tx_step,lockout,name",
+        "0" + "," * 12,
+        "1" + "," * 12,
+    ]
+    assert serial.rx.getvalue() == b""
+
+
+@pytest.mark.parametrize(
+    "option", [["--probe"], ["--turbo"], ["--method", "memory"], ["--method", "cat"]]
+)
+def test_channel_export_dump_radio_options(runner, serial, environ, option):
+    with tempfile.NamedTemporaryFile() as dump:
+        res = runner.invoke(cli.main, ["channel", "export", "-d", dump.name] + option)
+        assert res.exit_code == 2
+        assert "cannot be used with" in res.output
+
+    assert serial.rx.getvalue() == b""
+
+
+@pytest.mark.parametrize(
+    "option,method",
+    [([], "cat"), (["--method", "auto"], None), (["--method", "memory"], "memory")],
+)
+def test_channel_export_method(runner, serial, environ, monkeypatch, option, method):
+    export = mock.Mock()
+    monkeypatch.setattr(api.TMV71, "export_channels", export)
+
+    # a plain export never resets the radio unless asked to
+    with tempfile.NamedTemporaryFile() as out:
+        res = runner.invoke(cli.main, ["channel", "export", "-o", out.name] + option)
+        assert res.exit_code == 0
+    assert export.call_args[1]["method"] == method
+
+
+def test_channel_import_method_requires_diff(runner, serial, environ):
+    res = runner.invoke(cli.main, ["channel", "import", "--method", "cat"], input="")
+    assert res.exit_code == 2
+    assert "--method requires --diff" in res.output
+    assert serial.rx.getvalue() == b""
+
+
+def test_channel_export_turbo(runner, serial, environ):
+    # the radio is already at 57600 bps, so it is not reset
+    serial.stuff(b"N\rN\r")
+    with tempfile.NamedTemporaryFile() as out:
+        res = runner.invoke(
+            cli.main,
+            ["-s", "57600", "channel", "export", "--turbo", "-s", "-c", "0"]
+            + ["-o", out.name],
+        )
+        assert res.exit_code == 0
+
+    assert serial.rx.getvalue() == b"ME 000\rMN 000\r"
+
+
+def test_port_speed_changes_port(runner, serial, environ):
+    serial.stuff(b"0M\r\x06\x06\r\x00")
+    res = runner.invoke(cli.main, ["port-speed", "57600"])
+    assert res.exit_code == 0
+
+    assert serial.baudrate == 57600
+
+
+def test_port_speed_remembered(runner, serial, environ, monkeypatch, tmp_path):
+    monkeypatch.delenv("TMV71_NO_CACHE")
+    monkeypatch.setattr(cli.SETTINGS, "no_cache", False)
+    monkeypatch.setattr(cli.SETTINGS, "speed", None)
+    monkeypatch.setattr(cli.cache, "CACHE_DIR", str(tmp_path))
+
+    serial.stuff(b"0M\r\x06\x06\r\x00")
+    res = runner.invoke(cli.main, ["port-speed", "38400"])
+    assert res.exit_code == 0
+
+    with open(tmp_path / "speeds.json") as fd:
+        assert json.load(fd) == {"dummy": "38400"}
+
+    # the next command starts at the new speed
+    opened = mock.Mock(wraps=api.serial.Serial)
+    monkeypatch.setattr(api.serial, "Serial", opened)
+    serial.clear()
+    serial.stuff(b"ID TM-V71\r")
+    res = runner.invoke(cli.main, ["info", "id"])
+    assert res.exit_code == 0
+    assert opened.call_args[1]["baudrate"] == 38400
+
+
+def test_speed_overrides_cache(runner, serial, environ, monkeypatch, tmp_path):
+    monkeypatch.delenv("TMV71_NO_CACHE")
+    monkeypatch.setattr(cli.SETTINGS, "no_cache", False)
+    monkeypatch.setattr(cli.SETTINGS, "speed", None)
+    monkeypatch.setattr(cli.cache, "CACHE_DIR", str(tmp_path))
+    with open(tmp_path / "speeds.json", "w") as fd:
+        json.dump({"dummy": "19200"}, fd)
+    opened = mock.Mock(wraps=api.serial.Serial)
+    monkeypatch.setattr(api.serial, "Serial", opened)
+
+    serial.stuff(b"ID TM-V71\r")
+    res = runner.invoke(cli.main, ["-s", "57600", "info", "id"])
+    assert res.exit_code == 0
+    assert opened.call_args[1]["baudrate"] == 57600
+
+    # without a speed the cached one is used
+    monkeypatch.setattr(cli.SETTINGS, "speed", None)
+    serial.stuff(b"ID TM-V71\r")
+    res = runner.invoke(cli.main, ["info", "id"])
+    assert res.exit_code == 0
+    assert opened.call_args[1]["baudrate"] == 19200
+
+
+def test_memory_dump_resume_stdout(runner, serial, environ):
+    res = runner.invoke(cli.main, ["memory", "dump", "--resume"])
+    assert res.exit_code == 2
+    assert serial.rx.getvalue() == b""
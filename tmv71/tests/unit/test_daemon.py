@@ -0,0 +1,193 @@
+import os
+import pytest
+import threading
+import time
+
+from click.testing import CliRunner
+from fakeserial import FakeSerialPortFactory
+from tmv71 import api
+from tmv71 import cli
+from tmv71 import daemon
+
+
+@pytest.fixture
+def sockpath(tmp_path):
+    return str(tmp_path / "tmv71.sock")
+
+
+@pytest.fixture
+def server(serial, sockpath):
+    radio = api.TMV71(port="dummy", speed=0, timeout=0)
+    server = daemon.Daemon(radio, sockpath)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+
+    for _ in range(100):
+        if daemon.is_running(sockpath):
+            break
+        time.sleep(0.01)
+
+    yield server
+
+    server.shutdown()
+    thread.join()
+
+
+@pytest.fixture
+def remote(server, sockpath):
+    remote = daemon.connect(sockpath)
+    yield remote
+    remote.close()
+
+
+def test_encode_roundtrip():
+    value = [b"\x00\xff", {"a": [1, "x"]}, api.InvalidCommandError("ME")]
+    res = daemon.decode(daemon.encode(value))
+    assert res[:2] == value[:2]
+    assert isinstance(res[2], api.InvalidCommandError)
+    assert str(res[2]) == str(value[2])
+
+
+def test_connect_no_daemon(sockpath):
+    assert daemon.connect(sockpath) is None
+    assert not daemon.is_running(sockpath)
+
+
+def test_socket_permissions(server, sockpath):
+    assert os.stat(sockpath).st_mode & 0o777 == 0o600
+
+
+def test_connect_other_port(server, sockpath):
+    assert daemon.connect(sockpath, port="other") is None
+
+    remote = daemon.connect(sockpath, port="dummy")
+    assert remote is not None
+    remote.close()
+
+
+def test_connect_untrusted(server, sockpath, monkeypatch):
+    monkeypatch.setattr(daemon.os, "getuid", lambda: os.stat(sockpath).st_uid + 1)
+    assert daemon.connect(sockpath) is None
+
+
+def test_hello(remote):
+    assert remote.port == "dummy"
+    assert remote.memory_max == api.TMV71.memory_max
+    assert remote.memory_magic == api.TMV71.memory_magic
+
+
+def test_send_command(remote, serial):
+    serial.stuff(b"ID TM-V71\r")
+    assert remote.radio_id() == "TM-V71"
+    assert serial.rx.getvalue() == b"ID\r"
+
+
+def test_send_command_error(remote, server, serial):
+    serial.stuff(b"N\r")
+    with pytest.raises(api.InvalidCommandError):
+        remote.send_command("ME", "000")
+
+    server.needs_clear = False
+    serial.stuff(b"ID TM-V71\r")
+    remote.check_id()
+
+
+def test_latency(remote, serial):
+    serial.stuff(b"ID TM-V71\r")
+    remote.radio_id()
+    assert remote.latency()["cat"]["samples"] == 1
+
+
+def test_cache_results(server, sockpath, serial):
+    remote = daemon.RemoteTMV71(sockpath, cache_results=True)
+    try:
+        serial.stuff(b"ID TM-V71\r")
+        assert remote.radio_id() == remote.radio_id() == "TM-V71"
+        assert serial.rx.getvalue() == b"ID\r"
+    finally:
+        remote.close()
+
+
+def test_send_commands(remote, serial):
+    serial.stuff(b"ID TM-V71\r?\r")
+    res = list(remote.send_commands([("ID",), ("XX",)], return_exceptions=True))
+    assert res[0] == ["TM-V71"]
+    assert isinstance(res[1], api.UnknownCommandError)
+
+
+def test_clear_only_when_needed(remote, server, serial):
+    serial.stuff(b"?\rID TM-V71\r")
+    remote.clear()
+    assert serial.rx.getvalue() == b"\rID\r"
+
+    remote.clear()
+    assert serial.rx.getvalue() == b"\rID\r"
+
+    with pytest.raises(api.ReadTimeoutError):
+        remote.send_command("ID")
+    assert server.needs_clear
+
+
+def test_programming_mode(remote, serial):
+    serial.stuff(b"0M\r")
+    serial.stuff(b"W\x00\x00\x02\x00\x4b\x06")
+    serial.stuff(b"\x06\r\x00")
+
+    with remote.programming_mode():
+        assert remote.read_block(0, 2) == b"\x00\x4b"
+
+    assert not remote._programming_mode
+    assert serial.rx.getvalue() == b"0M PROGRAM\rR\x00\x00\x02\x06E"
+
+
+def test_disconnect_in_programming_mode(server, sockpath, serial):
+    serial.stuff(b"0M\r\x06\r\x00")
+    remote = daemon.connect(sockpath)
+    remote.enter_programming_mode()
+    remote.close()
+
+    for _ in range(100):
+        if not server.radio._programming_mode:
+            break
+        time.sleep(0.01)
+
+    assert not server.radio._programming_mode
+    assert serial.rx.getvalue() == b"0M PROGRAM\rE"
+
+
+def test_cli_uses_daemon(server, sockpath, serial, monkeypatch):
+    monkeypatch.setenv("TMV71_NO_CONFIG", "1")
+    monkeypatch.setenv("TMV71_PORT", "dummy")
+    monkeypatch.setenv("TMV71_SOCKET", sockpath)
+    monkeypatch.delenv("TMV71_NO_DAEMON", raising=False)
+    monkeypatch.delenv("TMV71_NO_CLEAR", raising=False)
+    monkeypatch.setattr(cli.SETTINGS, "no_daemon", False)
+    monkeypatch.setattr(cli.SETTINGS, "no_clear", False)
+
+    serial.stuff(b"?\rID DUMMY\rID DUMMY\rID DUMMY\r")
+    runner = CliRunner()
+    for _ in range(2):
+        res = runner.invoke(cli.main, ["info", "id"])
+        assert res.exit_code == 0
+        assert res.output == "DUMMY\n"
+
+    # the channel was only cleared once
+    assert serial.rx.getvalue() == b"\rID\rID\rID\r"
+
+
+def test_cli_other_port(server, sockpath, serial, monkeypatch):
+    monkeypatch.setenv("TMV71_NO_CONFIG", "1")
+    monkeypatch.setenv("TMV71_PORT", "other")
+    monkeypatch.setenv("TMV71_SOCKET", sockpath)
+    monkeypatch.setenv("TMV71_NO_CLEAR", "1")
+    monkeypatch.setenv("TMV71_NO_CACHE", "1")
+    monkeypatch.delenv("TMV71_NO_DAEMON", raising=False)
+    monkeypatch.setattr(cli.SETTINGS, "no_daemon", False)
+
+    other = FakeSerialPortFactory("other", register=True)
+    other.clear()
+    other.stuff(b"ID OTHER\r")
+    res = CliRunner().invoke(cli.main, ["info", "id"])
+    assert res.exit_code == 0
+    assert res.output == "OTHER\n"
+    assert serial.rx.getvalue() == b""
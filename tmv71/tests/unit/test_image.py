@@ -0,0 +1,181 @@
+import io
+import json
+import pytest
+from unittest import mock
+
+from tmv71 import api
+from tmv71 import image
+from tmv71 import schema
+
+ME_TUPLE = "000,0145430000,0,1,1,0,1,0,23,23,000,00600000,0,0000000000,0,0".split(",")
+
+
+@pytest.fixture
+def data():
+    return bytearray(b"\xff" * (api.TMV71.memory_max * 256))
+
+
+def put_channel(data, number, values, name):
+    rec_addr, flags_addr, name_addr = image.channel_offsets(number)
+    values = ["{:03d}".format(number)] + list(values[1:])
+    record, flags = image.tuple_to_record(values)
+    rec_end = rec_addr + image.CHANNEL_SIZE
+    flags_end = flags_addr + image.CHANNEL_FLAGS_SIZE
+    name_end = name_addr + image.CHANNEL_NAME_SIZE
+    data[rec_addr:rec_end] = record
+    data[flags_addr:flags_end] = flags
+    data[name_addr:name_end] = image.encode_name(name)
+
+
+def test_channel_blocks():
+    assert image.CHANNEL_BLOCKS[0] == 0x0E
+    assert image.CHANNEL_BLOCKS[-1] == 0x77
+    assert 0x16 not in image.CHANNEL_BLOCKS
+
+
+def test_record_roundtrip():
+    record, flags = image.tuple_to_record(ME_TUPLE)
+    assert len(record) == image.CHANNEL_SIZE
+    assert flags == bytes([image.BAND_VHF, 0])
+    assert image.record_to_tuple(0, record, flags) == ME_TUPLE
+
+
+def test_record_split():
+    values = list(ME_TUPLE)
+    values[3] = str(schema.SHIFT_DIRECTION.index("SPLIT"))
+    values[11] = "00000000"
+    values[13] = "0440000000"
+    record, flags = image.tuple_to_record(values)
+    assert image.record_to_tuple(0, record, flags) == values
+
+
+def test_decode_deleted(data):
+    assert image.decode_channel(data, 0) is None
+
+
+def test_decode_channel(data):
+    put_channel(data, 5, ME_TUPLE, "TEST")
+    entry = image.decode_channel(data, 5)
+    expected = schema.ME.from_tuple(["005"] + ME_TUPLE[1:] + ["TEST"])
+    assert entry == expected
+
+
+def test_encode_name_too_long():
+    with pytest.raises(ValueError):
+        image.encode_name("TOOLONGNAME")
+
+
+def test_export_channels_from_image(data):
+    put_channel(data, 1, ME_TUPLE, "TEST")
+    buf = io.StringIO()
+    api.export_channels_from_image(buf, data, selected=[0, 1])
+    assert buf.getvalue() == (
+        "channel,rx_freq,rx_step,shift,reverse,admit,tone,offset,"
+        "mode,tx_freq,tx_step,lockout,name\r\n"
+        "0,,,,,,,,,,,,\r\n"
+        "1,145.43,5.0,UP,True,C,146.2,0.6,FM,0.0,5.0,False,TEST\r\n"
+    )
+
+
+def test_export_channels_from_image_jsonl(data):
+    put_channel(data, 1, ME_TUPLE, "TEST")
+    buf = io.StringIO()
+    api.export_channels_from_image(buf, data, selected=[0, 1], format="jsonl")
+    lines = [json.loads(line) for line in buf.getvalue().splitlines()]
+    assert lines[0] == {"channel": 0}
+    assert lines[1]["name"] == "TEST"
+    assert lines[1]["rx_freq"] == 145.43
+    assert set(lines[1]) == set(schema.ME.export_fields)
+
+
+def test_export_channels_from_image_short():
+    with pytest.raises(ValueError):
+        api.export_channels_from_image(io.StringIO(), b"\xff" * 256)
+
+
+def test_channel_occupancy(data):
+    put_channel(data, 5, ME_TUPLE, "TEST")
+    put_channel(data, 999, ME_TUPLE, "")
+    occupancy = image.channel_occupancy(data)
+    assert occupancy.set_bits() == [5, 999]
+
+
+def test_bitmap():
+    bitmap = image.Bitmap(10)
+    bitmap[0] = bitmap[9] = True
+    assert bitmap.set_bits() == [0, 9]
+    assert bitmap.count() == 2
+    bitmap[0] = False
+    assert bitmap.set_bits() == [9]
+    bitmap.fill()
+    assert bitmap.all()
+    assert bytes(bitmap) == b"\xff\x03"
+
+    with pytest.raises(IndexError):
+        bitmap[10]
+
+
+def test_radio_image_dirty(data):
+    img = image.RadioImage(data)
+    assert img.dirty_blocks() == []
+
+    img.set_channel_name(0, "TEST")
+    assert img.get_channel_name(0) == "TEST"
+    assert img.dirty_blocks() == [0x58]
+
+    # writing the same data does not mark the block dirty
+    img2 = image.RadioImage(img.data)
+    img2.set_channel_name(0, "TEST")
+    assert img2.dirty_blocks() == []
+
+
+def test_radio_image_channel(data):
+    img = image.RadioImage(data)
+    entry = schema.ME.from_tuple(ME_TUPLE + ["TEST"])
+    img.set_channel(3, entry)
+    assert img.get_channel(3)["rx_freq"] == 145.43
+    assert img.get_channel(3)["name"] == "TEST"
+    assert img.dirty_blocks() == [0x0E, 0x17, 0x58]
+
+    img.set_lockout(3, True)
+    assert img.get_lockout(3)
+    assert img.get_channel(3)["lockout"]
+
+    img.delete_channel(3)
+    assert img.get_channel(3) is None
+    with pytest.raises(ValueError):
+        img.set_lockout(3, True)
+
+
+def test_radio_image_settings(data):
+    img = image.RadioImage(data)
+    img.set_misc_setting("remote_id", b"123")
+    img.set_misc_setting("pc_port_speed", 3)
+    img.set_program_memory(1, "power_on_message", "HELLO")
+    assert img.get_misc_setting("remote_id") == b"123"
+    assert img.get_misc_setting("pc_port_speed") == 3
+    assert img.get_program_memory(1, "power_on_message") == "HELLO"
+    assert img.dirty_blocks() == [0x00, 0x04]
+
+    with pytest.raises(ValueError):
+        img.set_program_memory(6, "beep", 1)
+
+
+def test_radio_image_not_loaded(data):
+    img = image.RadioImage(data, loaded=[0x58])
+    img.set_channel_name(0, "TEST")
+    with pytest.raises(ValueError):
+        img.set_channel_name(0x200, "TEST")
+    with pytest.raises(ValueError):
+        img.set_misc_setting("key_lock", 1)
+
+
+def test_radio_image_commit(data):
+    radio = mock.MagicMock(memory_max=0x7F)
+    img = image.RadioImage(data)
+    img.set_channel_name(0, "TEST")
+    assert img.commit(radio) == [0x58]
+    radio.programming_mode.assert_called_once()
+    radio.write_block.assert_called_once_with(0x5800, img.data[0x5800:0x5900])
+    assert img.dirty_blocks() == []
+    assert img.commit(radio) == []
@@ -0,0 +1,100 @@
+import pytest
+
+from tmv71 import api
+from tmv71 import image
+from tmv71 import mirror
+from tmv71 import schema
+
+ME_CSV = "005,0145430000,0,1,1,0,1,0,23,23,000,00600000,0,0000000000,0,0,TEST"
+
+
+@pytest.fixture
+def channels(tmp_path):
+    return mirror.ChannelMirror("12345", directory=str(tmp_path))
+
+
+@pytest.fixture
+def radio(serial, channels):
+    radio = api.TMV71(port="dummy", speed=0, timeout=0)
+    radio.mirror = channels
+    return radio
+
+
+def test_unknown_channel(channels):
+    with pytest.raises(KeyError):
+        channels.get(5)
+
+    with pytest.raises(ValueError):
+        channels.get(1000)
+
+
+def test_set_and_delete(channels):
+    entry = schema.ME.from_csv(ME_CSV)
+    channels.set(5, entry)
+    res, updated = channels.get(5)
+    assert res == entry
+    assert updated > 0
+    assert channels.known() == 1
+
+    channels.delete(5)
+    assert channels.get(5)[0] is None
+
+
+def test_save_and_load(channels, tmp_path):
+    entry = schema.ME.from_csv(ME_CSV)
+    channels.set(5, entry)
+    channels.save()
+    assert not channels.dirty
+    assert (tmp_path / "12345.bin").stat().st_size == mirror.FILE_SIZE
+
+    loaded = mirror.ChannelMirror.open("12345", directory=str(tmp_path))
+    assert loaded.get(5) == channels.get(5)
+    assert loaded.known() == 1
+
+
+def test_load_corrupt(channels, tmp_path):
+    (tmp_path / "12345.bin").write_bytes(b"garbage")
+    loaded = mirror.ChannelMirror.open("12345", directory=str(tmp_path))
+    assert loaded.known() == 0
+
+
+def test_update_memory(channels):
+    data = bytearray(b"\xff" * mirror.IMAGE_SIZE)
+    image.encode_channel(data, 5, schema.ME.from_csv(ME_CSV))
+
+    # a channel is only known once all of its tables have been seen
+    for address, size in image.CHANNEL_REGIONS[:-1]:
+        end = address + size
+        channels.update_memory(address, data[address:end])
+        assert channels.known() == 0
+
+    address, size = image.CHANNEL_REGIONS[-1]
+    end = address + size
+    channels.update_memory(address, data[address:end])
+    assert channels.known() == image.CHANNEL_COUNT
+    assert channels.get(5)[0]["name"] == "TEST"
+    assert channels.get(6)[0] is None
+
+
+def test_delete_channel_entry(radio, serial, channels):
+    serial.stuff(b"N\r")
+    radio.delete_channel_entry(5)
+    assert channels.get(5)[0] is None
+
+
+def test_export_channels(radio, serial, channels):
+    serial.stuff(b"ME " + ME_CSV.rsplit(",", 1)[0].encode("ascii") + b"\r")
+    serial.stuff(b"MN 005,TEST\r")
+    res = list(radio._read_channels([5]))
+    assert channels.get(5)[0] == res[0][1]
+
+
+def test_write_block(radio, serial, channels):
+    data = b"\x00" * 256
+    serial.stuff(b"0M\r\x06\x06\r\x00")
+    with radio.programming_mode():
+        radio.write_block(image.CHANNEL_NAME_OFFSET, data)
+
+    assert channels.dirty
+    assert channels.known() == 0
+    assert channels.data[image.CHANNEL_NAME_OFFSET] == 0
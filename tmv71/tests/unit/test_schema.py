@@ -0,0 +1,146 @@
+import marshmallow
+import pytest
+
+from tmv71 import schema
+
+SAMPLES = {
+    "ME": "000,0145430000,0,1,1,0,1,0,23,23,000,00600000,0,0000000000,0,0,TEST",
+    "FO": "0,0146520000,0,0,0,0,0,0,8,8,000,00600000,0",
+    "CC": "0,0144000000,0,0,0,0,0,0,08,08,000,00600000,0,0000000000,0",
+    "MU": (
+        "1,3,0,00,00,3,2,0,5,0,0,0,00,00,0,0,00,00,0,00,00,0,0,0,0,"
+        "8,0,00,00,00,00,00,00,00,0,00,00,00,00,00,0,0"
+    ),
+}
+
+
+def marshmallow_load(s, values):
+    return s.load(dict(zip(s.declared_fields, values)))
+
+
+def marshmallow_dump(s, obj):
+    data = s.dump(obj)
+    return [data[f] for f in s.declared_fields if f in data]
+
+
+@pytest.mark.parametrize("name", sorted(SAMPLES))
+def test_codec_roundtrip(name):
+    s = getattr(schema, name)
+    values = SAMPLES[name].split(",")
+
+    obj = s.from_tuple(values)
+    assert obj == marshmallow_load(s, values)
+    assert isinstance(obj, schema.SchemaDict)
+    assert obj.schema is s
+
+    assert s.to_tuple(obj) == marshmallow_dump(s, obj) == values
+
+
+def test_codec_is_compiled_once():
+    codec = schema.ME.codec
+    assert codec is schema.ME.codec
+    assert schema.AE.codec is None
+
+
+def test_codec_post_load():
+    obj = schema.ME.from_csv(SAMPLES["ME"])
+    assert obj["admit"] == "C"
+
+
+def test_codec_default():
+    values = SAMPLES["CC"].split(",")[:-1]
+    obj = schema.CC.from_tuple(values)
+    assert obj["unknown"] == "0"
+
+
+def test_codec_reverse_lookup():
+    obj = schema.ME.from_csv(SAMPLES["ME"])
+    obj["dcs_code"] = 565
+    assert schema.ME.to_tuple(obj)[10] == "{:03d}".format(schema.DCS_CODE.index(565))
+
+
+@pytest.mark.parametrize(
+    "name,index,value",
+    [
+        ("ME", 1, "x"),
+        ("ME", 2, "99"),
+        ("ME", 4, "2"),
+        ("FO", 0, "2"),
+        ("MU", 1, "9"),
+    ],
+)
+def test_codec_load_errors(name, index, value):
+    s = getattr(schema, name)
+    values = SAMPLES[name].split(",")
+    values[index] = value
+
+    with pytest.raises(Exception) as expected:
+        marshmallow_load(s, values)
+    with pytest.raises(expected.type) as err:
+        s.from_tuple(values)
+
+    assert str(err.value) == str(expected.value)
+
+
+def test_codec_missing_field():
+    values = SAMPLES["FO"].split(",")[:-1]
+    with pytest.raises(marshmallow.ValidationError) as err:
+        schema.FO.from_tuple(values)
+
+    assert "mode" in err.value.messages
+
+
+def test_codec_dump_error():
+    obj = schema.ME.from_csv(SAMPLES["ME"])
+    obj["mode"] = "XX"
+    with pytest.raises(ValueError):
+        schema.ME.to_tuple(obj)
+
+
+@pytest.mark.parametrize("value", ["", "x"])
+def test_codec_dump_float_error(value):
+    obj = dict(schema.ME.from_csv(SAMPLES["ME"]), offset=value)
+
+    with pytest.raises(Exception) as expected:
+        marshmallow_dump(schema.ME, obj)
+    with pytest.raises(expected.type):
+        schema.ME.to_tuple(obj)
+
+
+def test_codec_dump_float_none():
+    obj = dict(schema.ME.from_csv(SAMPLES["ME"]), offset=None)
+    assert schema.ME.to_tuple(obj)[11] == "00000000"
+
+
+def test_codec_not_compilable():
+    class Unsupported(schema.RadioSchema):
+        compiled = True
+
+        value = marshmallow.fields.Decimal()
+
+    s = Unsupported()
+    assert s.codec is None
+    assert s.from_tuple(["1.5"]) == {"value": 1.5}
+
+
+def test_codec_fallback_logged(caplog):
+    caplog.set_level("DEBUG", logger="tmv71.schema")
+    obj = dict(schema.ME.from_csv(SAMPLES["ME"]), offset="x")
+
+    with pytest.raises(ValueError):
+        schema.ME.to_tuple(obj)
+    assert "codec cannot dump" in caplog.text
+
+
+def test_codec_bug_not_hidden(monkeypatch):
+    def broken(values):
+        raise RuntimeError("codec bug")
+
+    monkeypatch.setattr(schema.ME.codec, "load", broken)
+    with pytest.raises(RuntimeError):
+        schema.ME.from_csv(SAMPLES["ME"])
+
+
+def test_codec_exclude():
+    obj = schema.ME.from_csv(SAMPLES["ME"])
+    assert schema.ME_no_name.to_tuple(obj) == SAMPLES["ME"].split(",")[:-1]